@@ -2,25 +2,172 @@
   Internal bus for communication among modules
 """
 import time
-from queue import Queue
+import asyncio
+from queue import Empty
+from threading import Lock, Condition, Thread
 from datetime import timedelta
 from collections import deque
 
 from osgar.lib.serialize import serialize, deserialize
+from osgar.lib.latency import LatencyHistogram
 
 
 # restrict replay time from given input
 ASSERT_QUEUE_DELAY = timedelta(seconds=.1)
 
+# period of diagnostics (dropped messages, latency) reports in the info stream
+DIAGNOSTICS_PERIOD = 1.0
+
+QUEUE_POLICIES = ('drop_oldest', 'drop_newest', 'latest')
+
 
 class BusShutdownException(Exception):
     pass
 
 
+class Message:
+    """
+      Immutable message envelope shared by all subscribers - it carries both
+      the serialized bytes and the Python object. Whichever is missing is
+      computed on the first access and cached.
+    """
+    __slots__ = ('_raw', '_data', '_decoded')
+
+    def __init__(self, data=None, raw=None):
+        assert data is not None or raw is not None
+        self._raw = raw
+        self._data = data
+        self._decoded = raw is None or data is not None
+
+    @classmethod
+    def from_raw(cls, raw):
+        return cls(raw=raw)
+
+    @property
+    def raw(self):
+        if self._raw is None:
+            self._raw = serialize(self._data)
+        return self._raw
+
+    @property
+    def data(self):
+        if not self._decoded:
+            self._data = deserialize(self._raw)
+            self._decoded = True
+        return self._data
+
+    def __eq__(self, other):
+        # envelope compares equal to its payload
+        if isinstance(other, Message):
+            return self.raw == other.raw
+        return self.data == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Message(raw=%r)' % (self.raw,)
+
+
+class BusQueue:
+    """
+      Input queue of a module. Messages of given input channel can be
+      limited to maxsize, with policy:
+        drop_oldest - the oldest queued message of the channel is removed
+        drop_newest - the incoming message is discarded
+        latest      - only the most recent message is kept (maxsize=1)
+      Channels without policy are unbounded. The shutdown marker (None)
+      is never dropped.
+      Only counters of dropped messages are logged, so replay feeds all
+      messages - use policies for inputs where the output of the module
+      does not have to be replay-deterministic.
+      The time spent in the queue (microseconds) and queue depth are
+      collected per input channel in latency histograms.
+    """
+    def __init__(self):
+        self._items = deque()  # (enqueue time, item)
+        self._cond = Condition()
+        self._limits = {}  # channel -> (maxsize, policy)
+        self._sizes = {}  # number of queued messages of limited channels
+        self.dropped = {}  # channel -> total number of dropped messages
+        self.latency = {}  # channel -> LatencyHistogram since the last pop_latency()
+
+    def set_policy(self, channel, maxsize=None, policy='drop_oldest'):
+        assert policy in QUEUE_POLICIES, policy
+        if policy == 'latest':
+            maxsize = 1
+        with self._cond:
+            if maxsize is None:
+                self._limits.pop(channel, None)
+                self._sizes.pop(channel, None)
+            else:
+                assert maxsize > 0, maxsize
+                self._limits[channel] = (maxsize, policy)
+                self._sizes[channel] = sum(1 for __, item in self._items
+                                           if item is not None and item[1] == channel)
+
+    def put(self, item):
+        with self._cond:
+            if item is not None and item[1] in self._limits:
+                channel = item[1]
+                maxsize, policy = self._limits[channel]
+                if self._sizes[channel] >= maxsize:
+                    self.dropped[channel] = self.dropped.get(channel, 0) + 1
+                    if policy == 'drop_newest':
+                        return
+                    self._remove_oldest(channel)
+                self._sizes[channel] += 1
+            self._items.append((time.monotonic(), item))
+            self._cond.notify()
+
+    def _remove_oldest(self, channel):
+        for i, (__, item) in enumerate(self._items):
+            if item is not None and item[1] == channel:
+                del self._items[i]
+                self._sizes[channel] -= 1
+                return
+
+    def get(self):
+        with self._cond:
+            while len(self._items) == 0:
+                self._cond.wait()
+            return self._pop()
+
+    def get_nowait(self):
+        with self._cond:
+            if len(self._items) == 0:
+                raise Empty()
+            return self._pop()
+
+    def _pop(self):
+        depth = len(self._items)
+        enqueue_time, item = self._items.popleft()
+        if item is not None:
+            channel = item[1]
+            if channel in self._sizes:
+                self._sizes[channel] -= 1
+            hist = self.latency.get(channel)
+            if hist is None:
+                hist = self.latency[channel] = LatencyHistogram()
+            hist.add(int((time.monotonic() - enqueue_time) * 1000000), depth)
+        return item
+
+    def pop_latency(self):
+        "return collected latency histograms and start new ones"
+        with self._cond:
+            latency, self.latency = self.latency, {}
+        return latency
+
+    def qsize(self):
+        return len(self._items)
+
+    def empty(self):
+        return len(self._items) == 0
+
+
 class BusHandler:
     def __init__(self, logger, name='', out={}, slots={}):
         self.logger = logger
-        self.queue = Queue()
+        self.queue = BusQueue()
         self.name = name
         self.out = out
         self.slots = slots
@@ -29,23 +176,50 @@ class BusHandler:
             idx = self.logger.register('.'.join([self.name, publish_name]))
             self.stream_id[publish_name] = idx
         self._is_alive = True
+        # the lock of logger.write() - queues are filled in the order of the log
+        self._order_lock = getattr(logger, 'lock', None) or Lock()
+        self._reported_dropped = {}
+        self._diagnostics_time = time.monotonic()
 
     def publish(self, channel, data):
-        with self.logger.lock:
-            stream_id = self.stream_id[channel]  # local maping of indexes
-            timestamp = self.logger.write(stream_id, serialize(data))
+        # Only the timestamp assignment in logger.write() and the fan-out to
+        # queues (put() does not block) are serialized among all modules, so
+        # every module receives messages in the same order as they are logged
+        # (and replayed). Slots are called without any lock held - a slow slot
+        # blocks only this publisher and slots may publish back (cycles).
+        stream_id = self.stream_id[channel]  # local maping of indexes
+        # serialized once, the same envelope is passed to all subscribers
+        if isinstance(data, Message):
+            msg = data
+            bytes_data = data.raw
+        else:
+            bytes_data = serialize(data)
+            msg = Message(data, bytes_data)
+        with self._order_lock:
+            timestamp = self.logger.write(stream_id, bytes_data)
             for queue, input_channel in self.out[channel]:
-                queue.put((timestamp, input_channel, data))
-            for slot in self.slots.get(channel, []):
-                slot(data)
+                queue.put((timestamp, input_channel, msg))
+        for slot in self.slots.get(channel, []):
+            slot(msg.data)
         return timestamp
 
-    def listen(self):
+    def listen_message(self):
         packet = self.queue.get()
         if packet is None:
             raise BusShutdownException()
-        timestamp, channel, data = packet
-        return timestamp, channel, data
+        self._check_diagnostics()
+        return packet
+
+    def _check_diagnostics(self):
+        now = time.monotonic()
+        if now - self._diagnostics_time >= DIAGNOSTICS_PERIOD:
+            self.report_diagnostics(now)
+
+    def listen(self):
+        timestamp, channel, msg = self.listen_message()
+        if isinstance(msg, Message):
+            return timestamp, channel, msg.data
+        return timestamp, channel, msg
 
     def sleep(self, secs):
         time.sleep(secs)
@@ -55,12 +229,108 @@ class BusHandler:
 
     def shutdown(self):
         self._is_alive = False
+        self.report_diagnostics(time.monotonic())
         self.queue.put(None)
 
     def report_error(self, err):
-        with self.logger.lock:
-            self.logger.write(0, bytes(str({'error': str(err)}),
-                                       encoding='ascii'))
+        self.logger.write(0, bytes(str({'error': str(err)}), encoding='ascii'))
+
+    def report_diagnostics(self, now):
+        "write dropped messages (if changed) and queue latencies to the info stream"
+        period = now - self._diagnostics_time
+        self._diagnostics_time = now
+        if self.queue.dropped != self._reported_dropped:
+            self.report_dropped()
+        latency = self.queue.pop_latency()
+        if len(latency) > 0:
+            report = {}
+            for channel, hist in latency.items():
+                report['%s.%s' % (self.name, channel)] = dict(hist.to_dict(), period=round(period, 3))
+            self.logger.write(0, bytes(str({'latency': report}), encoding='ascii'))
+
+    def report_dropped(self):
+        dropped = dict(self.queue.dropped)
+        self._reported_dropped = dropped
+        counters = dict(('%s.%s' % (self.name, channel), count) for channel, count in dropped.items())
+        self.logger.write(0, bytes(str({'dropped': counters}), encoding='ascii'))
+
+
+class AsyncRuntime:
+    """
+      Event loop running in a background thread, shared by all asyncio
+      based nodes
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def submit(self, coro):
+        "schedule coroutine from any thread, returns concurrent.futures.Future"
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+class AsyncBusQueue(BusQueue):
+    """
+      BusQueue with asyncio consumer - put() can be called from any thread
+    """
+    def __init__(self, loop):
+        super().__init__()
+        self._loop = loop
+        self._ready = None  # asyncio.Event created in the loop thread
+
+    def put(self, item):
+        super().put(item)
+        self._loop.call_soon_threadsafe(self._wakeup)
+
+    def _wakeup(self):
+        if self._ready is not None:
+            self._ready.set()
+
+    async def get_async(self):
+        if self._ready is None:
+            self._ready = asyncio.Event()
+        while True:
+            try:
+                return self.get_nowait()
+            except Empty:
+                pass
+            self._ready.clear()
+            if self.empty():
+                await self._ready.wait()
+
+
+class AsyncBusHandler(BusHandler):
+    """
+      Bus of asyncio node - listen() and sleep() are coroutines, publish()
+      does not block and can be called directly. The queue interoperates with
+      thread based nodes, so both kinds can be linked together.
+    """
+    def __init__(self, logger, runtime, name='', out={}, slots={}):
+        super().__init__(logger, name=name, out=out, slots=slots)
+        self.runtime = runtime
+        self.queue = AsyncBusQueue(runtime.loop)
+
+    async def listen_message(self):
+        packet = await self.queue.get_async()
+        if packet is None:
+            raise BusShutdownException()
+        self._check_diagnostics()
+        return packet
+
+    async def listen(self):
+        timestamp, channel, msg = await self.listen_message()
+        if isinstance(msg, Message):
+            return timestamp, channel, msg.data
+        return timestamp, channel, msg
+
+    async def sleep(self, secs):
+        await asyncio.sleep(secs)
 
 
 class LogBusHandler:
@@ -105,8 +375,12 @@ class LogBusHandler:
                 self.max_delay_timestamp = dt
             if delay > ASSERT_QUEUE_DELAY:
                 print("maximum delay overshot:", delay)
-        ref_data = deserialize(bytes_data)
-        assert data == ref_data, (data, ref_data, dt)
+        if isinstance(data, Message):
+            data = data.data
+        if serialize(data) != bytes_data:
+            # the same bytes imply equal data, deserialize only on mismatch
+            ref_data = deserialize(bytes_data)
+            assert data == ref_data, (data, ref_data, dt)
         return dt
 
     def sleep(self, secs):
@@ -11,6 +11,8 @@ from .eduro import Eduro
 from .cortexpilot import Cortexpilot
 from .logusb import LogUSB
 from .replay import ReplayDriver
+from .asyncsocket import AsyncLogTCP, AsyncLogUDP, AsyncLogHTTP
+from .asyncserial import AsyncLogSerial
 
 # dictionary of all available drivers
 all_drivers = dict(gps=GPS, imu=IMU, spider=Spider, serial=LogSerial,
@@ -22,5 +24,7 @@ all_drivers = dict(gps=GPS, imu=IMU, spider=Spider, serial=LogSerial,
                    cortexpilot=Cortexpilot,
                    usb=LogUSB,
                    replay=ReplayDriver,
+                   asynctcp=AsyncLogTCP, asyncudp=AsyncLogUDP, asynchttp=AsyncLogHTTP,
+                   asyncserial=AsyncLogSerial,
                    )
 
@@ -0,0 +1,48 @@
+"""
+  asyncio version of serial wrapper & timestamper (see logserial.py)
+  The port is watched by the event loop, so it requires a platform with
+  file descriptor based serial ports (Linux, macOS).
+"""
+import asyncio
+
+import serial
+
+from osgar.node import AsyncNode
+from osgar.bus import BusShutdownException
+
+
+class AsyncLogSerial(AsyncNode):
+    def __init__(self, config, bus):
+        super().__init__(config, bus)
+        if 'port' in config:
+            self.com = serial.Serial(config['port'], config['speed'],
+                                     rtscts=config.get('rtscts', False))
+            if config.get('rtscts'):
+                self.com.setRTS()
+            self.com.timeout = 0  # non-blocking, read only available data
+            if config.get('reset'):
+                self.com.setDTR(0)
+        else:
+            self.com = None
+
+    def _on_readable(self):
+        data = self.com.read(max(1, self.com.in_waiting))
+        if len(data) > 0:
+            self.publish('raw', data)
+
+    def slot_raw(self, data):
+        self.com.write(data)
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        loop.add_reader(self.com.fileno(), self._on_readable)
+        try:
+            while True:
+                __, __, data = await self.bus.listen()
+                self.slot_raw(data)
+        except BusShutdownException:
+            pass
+        finally:
+            loop.remove_reader(self.com.fileno())
+
+# vim: expandtab sw=4 ts=4
@@ -0,0 +1,146 @@
+"""
+  asyncio version of socket wrappers & timestampers (see logsocket.py)
+"""
+import asyncio
+from urllib.parse import urlsplit
+
+from osgar.node import AsyncNode
+from osgar.bus import BusShutdownException
+
+
+class AsyncLogSocket(AsyncNode):
+    """
+      Base class - received data are published as 'raw', input 'raw' is sent
+    """
+    def __init__(self, config, bus):
+        super().__init__(config, bus)
+        host = config.get('host')
+        port = config.get('port')
+        self.pair = (host, port)  # (None, None) for unknown address
+        self.timeout = config.get('timeout')
+        self.bufsize = config.get('bufsize', 1024)
+
+    async def connect(self):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def _send(self, data):
+        raise NotImplementedError()
+
+    async def run_input(self):
+        pass
+
+    async def run(self):
+        await self.connect()
+        input_task = asyncio.ensure_future(self.run_input())
+        try:
+            while True:
+                __, channel, data = await self.bus.listen()
+                if channel == 'raw':
+                    self._send(data)
+                else:
+                    assert False, channel  # unsupported channel
+        except BusShutdownException:
+            pass
+        finally:
+            input_task.cancel()
+            self.close()
+
+
+class AsyncLogTCP(AsyncLogSocket):
+    """
+      TCP driver for existing static IP
+    """
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(*self.pair), self.timeout)
+
+    def close(self):
+        self.writer.close()
+
+    def _send(self, data):
+        self.writer.write(data)
+
+    async def run_input(self):
+        while True:
+            data = await self.reader.read(self.bufsize)
+            if len(data) == 0:
+                break  # connection closed
+            self.publish('raw', data)
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, node):
+        self.node = node
+
+    def datagram_received(self, data, addr):
+        self.node.publish('raw', data)
+
+
+class AsyncLogUDP(AsyncLogSocket):
+    async def connect(self):
+        loop = asyncio.get_event_loop()
+        self.transport, __ = await loop.create_datagram_endpoint(
+                lambda: _DatagramProtocol(self), local_addr=('0.0.0.0', self.pair[1]))
+
+    def close(self):
+        self.transport.close()
+
+    def _send(self, data):
+        self.transport.sendto(data, self.pair)
+
+
+async def http_get(url, timeout=None):
+    "minimal HTTP/1.0 GET returning the body (plain http only)"
+    parts = urlsplit(url)
+    assert parts.scheme == 'http', url
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(parts.hostname, parts.port or 80), timeout)
+    try:
+        writer.write(('GET %s HTTP/1.0\r\nHost: %s\r\n\r\n' % (path, parts.netloc)).encode('ascii'))
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    header, __, body = response.partition(b'\r\n\r\n')
+    status = header.split(b'\r\n', 1)[0].split()
+    assert len(status) >= 2 and status[1] == b'200', header
+    return body
+
+
+class AsyncLogHTTP(AsyncNode):
+    """
+      Periodic HTTP GET of given url (i.e. camera snapshot)
+    """
+    def __init__(self, config, bus):
+        super().__init__(config, bus)
+        self.url = config['url']
+        self.sleep_time = config.get('sleep', None)
+        self.timeout = config.get('timeout')
+
+    async def run_input(self):
+        while self.is_alive():
+            try:
+                data = await http_get(self.url, self.timeout)
+                if len(data) > 0:
+                    self.publish('raw', data)
+            except asyncio.TimeoutError:
+                pass
+            if self.sleep_time is not None:
+                await self.sleep(self.sleep_time)
+
+    async def run(self):
+        input_task = asyncio.ensure_future(self.run_input())
+        try:
+            while True:
+                await self.bus.listen()  # no inputs, wait for shutdown
+        except BusShutdownException:
+            pass
+        finally:
+            input_task.cancel()
+
+# vim: expandtab sw=4 ts=4
@@ -1,13 +1,53 @@
 """
   Driver "replay" replaying old logfile
-"""
 
-from threading import Thread
+  init options:
+    filename  - recorded log file
+    pins      - {recorded stream name: output channel}
+    speed     - replay speed, 1.0 for real-time (default), 2.0 twice as fast,
+                0 or null as fast as possible
+    step      - publish one record per received input message (step-by-step)
+    start_sec - start at given time offset (the position is found via index)
+    end_sec   - stop at given time offset
+"""
+import time
+from datetime import timedelta
+from threading import Thread, Event
 
 from osgar.logger import LogReader, lookup_stream_names
 from osgar.lib.serialize import deserialize
 from osgar.bus import BusShutdownException
 
+# when the replay is late more than MAX_LAG seconds (slow consumer, pause)
+# the clock is restarted instead of publishing burst of old records
+MAX_LAG = 1.0
+
+
+class ReplayClock:
+    """
+      Pacing according to recorded timestamps. The due time is always
+      computed from the origin, so the sleep errors do not accumulate.
+    """
+    def __init__(self, speed=1.0, stop_event=None):
+        self.speed = speed
+        self.stop_event = Event() if stop_event is None else stop_event
+        self.origin = None  # (recorded timestamp, monotonic time)
+
+    def wait(self, timestamp):
+        "wait until recorded timestamp is due, returns False if stopped"
+        if not self.speed:
+            return not self.stop_event.is_set()
+        now = time.monotonic()
+        if self.origin is None:
+            self.origin = (timestamp, now)
+        due = self.origin[1] + (timestamp - self.origin[0]).total_seconds() / self.speed
+        if now - due > MAX_LAG:
+            self.origin = (timestamp, now)
+            due = now
+        if due > now:
+            return not self.stop_event.wait(due - now)
+        return not self.stop_event.is_set()
+
 
 class ReplayDriver:
     def __init__(self, config, bus):
@@ -16,6 +56,15 @@ class ReplayDriver:
 
         self.filename = config['filename']
         self.pins = config['pins']
+        self.step = config.get('step', False)
+        self.start_time = self._offset(config.get('start_sec'))
+        self.end_time = self._offset(config.get('end_sec'))
+        self._stop = Event()
+        self.clock = ReplayClock(config.get('speed', 1.0), stop_event=self._stop)
+
+    @staticmethod
+    def _offset(seconds):
+        return None if seconds is None else timedelta(seconds=seconds)
 
     def start(self):
         self.input_thread.start()
@@ -23,23 +72,36 @@ class ReplayDriver:
     def join(self, timeout=None):
         self.input_thread.join(timeout=timeout)
 
+    def wait_for_step(self):
+        try:
+            self.bus.listen()
+            return True
+        except BusShutdownException:
+            return False
+
     def run_input(self):
         names = lookup_stream_names(self.filename)
         print(names)
         ids = [i + 1 for i, name in enumerate(names) if name in self.pins]
         print(ids)
-        for timestamp, channel_index, data_raw in LogReader(self.filename,
-                only_stream_id=ids):
-            if not self.bus.is_alive():
-                break
-            channel = names[channel_index - 1]
-            assert channel in self.pins
-            data = deserialize(data_raw)
-            # TODO reuse timestamp
-            self.bus.publish(self.pins[channel], data)
+        with LogReader(self.filename, only_stream_id=ids,
+                       start=self.start_time, end=self.end_time) as log:
+            for timestamp, channel_index, data_raw in log:
+                if not self.bus.is_alive():
+                    break
+                if self.step:
+                    if not self.wait_for_step():
+                        break
+                elif not self.clock.wait(timestamp):
+                    break
+                channel = names[channel_index - 1]
+                assert channel in self.pins
+                data = deserialize(data_raw)
+                self.bus.publish(self.pins[channel], data)
         print('Replay completed!')
 
     def request_stop(self):
+        self._stop.set()
         self.bus.shutdown()
 
 # vim: expandtab sw=4 ts=4
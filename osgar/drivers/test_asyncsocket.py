@@ -0,0 +1,100 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import os
+import socket
+import http.server
+from threading import Thread
+
+from osgar.drivers.asyncsocket import AsyncLogTCP, AsyncLogUDP, AsyncLogHTTP
+from osgar.drivers.asyncserial import AsyncLogSerial
+from osgar.bus import BusHandler, AsyncBusHandler, AsyncRuntime
+
+
+class AsyncLogSocketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.runtime = AsyncRuntime()
+        self.logger = MagicMock()
+        self.logger.register = MagicMock(return_value=1)
+        self.output = BusHandler(self.logger)
+
+    def tearDown(self):
+        self.runtime.stop()
+
+    def create_bus(self):
+        return AsyncBusHandler(self.logger, self.runtime, out={'raw': [(self.output.queue, 'raw')]})
+
+    def test_tcp(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        bus = self.create_bus()
+        device = AsyncLogTCP(config={'host': '127.0.0.1', 'port': server.getsockname()[1]}, bus=bus)
+        device.start()
+        conn, addr = server.accept()
+        conn.sendall(b'hello')
+        self.assertEqual(self.output.listen()[1:], ('raw', b'hello'))
+        bus.queue.put((1, 'raw', b'bin data'))
+        self.assertEqual(conn.recv(100), b'bin data')
+        device.request_stop()
+        device.join(timeout=1)
+        conn.close()
+        server.close()
+
+    def test_udp(self):
+        tmp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        tmp.bind(('127.0.0.1', 0))
+        port = tmp.getsockname()[1]
+        tmp.close()
+        bus = self.create_bus()
+        # local and remote port are the same - datagrams are sent back to itself
+        device = AsyncLogUDP(config={'host': '127.0.0.1', 'port': port}, bus=bus)
+        device.start()
+        bus.queue.put((1, 'raw', b'bin data'))
+        self.assertEqual(self.output.listen()[1:], ('raw', b'bin data'))
+        device.request_stop()
+        device.join(timeout=1)
+
+    def test_http(self):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(b'image ' + self.path.encode('ascii'))
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+        thread = Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        bus = self.create_bus()
+        url = 'http://127.0.0.1:%d/snapshot.jpg' % server.server_address[1]
+        device = AsyncLogHTTP(config={'url': url, 'sleep': 0.01}, bus=bus)
+        device.start()
+        self.assertEqual(self.output.listen()[1:], ('raw', b'image /snapshot.jpg'))
+        device.request_stop()
+        device.join(timeout=1)
+        server.shutdown()
+        server.server_close()
+
+    def test_serial(self):
+        read_fd, write_fd = os.pipe()
+        with patch('osgar.drivers.asyncserial.serial.Serial') as mock:
+            com = mock.return_value
+            com.fileno = MagicMock(return_value=read_fd)
+            com.in_waiting = 4
+            com.read = lambda size: os.read(read_fd, size)
+            bus = self.create_bus()
+            device = AsyncLogSerial(config={'port': 'COM1', 'speed': 115200}, bus=bus)
+            device.start()
+            os.write(write_fd, b'$GPS')
+            self.assertEqual(self.output.listen()[1:], ('raw', b'$GPS'))
+            bus.queue.put((1, 'raw', b'cmd'))
+            device.request_stop()
+            device.join(timeout=1)
+            com.write.assert_called_once_with(b'cmd')
+        os.close(read_fd)
+        os.close(write_fd)
+
+# vim: expandtab sw=4 ts=4
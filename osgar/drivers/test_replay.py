@@ -0,0 +1,109 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import os
+from datetime import timedelta
+
+from osgar.drivers.replay import ReplayDriver, ReplayClock
+from osgar.logger import LogWriter
+from osgar.bus import BusHandler, BusQueue
+from osgar.lib.serialize import serialize
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def wait(self, secs):
+        self.sleeps.append(secs)
+        self.now += secs
+        return False  # not stopped
+
+
+class ReplayClockTest(unittest.TestCase):
+
+    def pace(self, clock, timestamps, fake, work=0.0):
+        for t in timestamps:
+            self.assertTrue(clock.wait(timedelta(seconds=t)))
+            fake.now += work
+
+    def test_speed(self):
+        for speed, expected in [(1.0, [1.0, 0.5]), (2.0, [0.5, 0.25])]:
+            fake = FakeTime()
+            clock = ReplayClock(speed)
+            clock.stop_event.wait = fake.wait
+            with patch('osgar.drivers.replay.time', fake):
+                self.pace(clock, [10.0, 11.0, 11.5], fake)
+            self.assertEqual(fake.sleeps, expected)
+
+    def test_drift_correction(self):
+        fake = FakeTime()
+        clock = ReplayClock(1.0)
+        clock.stop_event.wait = fake.wait
+        with patch('osgar.drivers.replay.time', fake):
+            # 0.1s of processing per message is compensated, the sleep errors do not accumulate
+            self.pace(clock, [0.0, 1.0, 2.0, 3.0], fake, work=0.1)
+            self.assertEqual([round(x, 6) for x in fake.sleeps], [0.9, 0.9, 0.9])
+            fake.now += 10.0  # paused - restart the clock instead of burst
+            fake.sleeps = []
+            self.pace(clock, [4.0, 5.0], fake)
+            self.assertEqual(fake.sleeps, [1.0])
+
+    def test_as_fast_as_possible(self):
+        clock = ReplayClock(speed=0)
+        self.assertTrue(clock.wait(timedelta(seconds=1000)))
+        clock.stop_event.set()
+        self.assertFalse(clock.wait(timedelta(seconds=1001)))
+
+
+class ReplayDriverTest(unittest.TestCase):
+
+    def setUp(self):
+        with LogWriter(prefix='tmpReplayDriver') as log:
+            stream_id = log.register('lidar.scan')
+            self.timestamps = [log.write(stream_id, serialize(i)) for i in range(20)]
+        self.filename = log.filename
+        self.addCleanup(os.remove, self.filename)
+        self.addCleanup(lambda: os.path.exists(self.filename + '.idx') and os.remove(self.filename + '.idx'))
+
+    def replay(self, **config):
+        logger = MagicMock()
+        logger.register = MagicMock(return_value=1)
+        output = BusQueue()
+        bus = BusHandler(logger, out={'scan': [(output, 'scan')]})
+        config = dict(filename=self.filename, pins={'lidar.scan': 'scan'}, **config)
+        with patch('builtins.print'):
+            driver = ReplayDriver(config, bus=bus)
+            driver.start()
+            return driver, output
+
+    def received(self, output):
+        ret = []
+        while not output.empty():
+            ret.append(output.get()[2])
+        return ret
+
+    def test_fast(self):
+        driver, output = self.replay(speed=None)
+        driver.join()
+        self.assertEqual(self.received(output), list(range(20)))
+
+    def test_start_offset(self):
+        start = self.timestamps[10]
+        driver, output = self.replay(speed=None, start_sec=start.total_seconds())
+        driver.join()
+        self.assertEqual(self.received(output), list(range(10, 20)))
+
+    def test_step(self):
+        driver, output = self.replay(step=True)
+        for i in range(3):
+            driver.bus.queue.put((timedelta(), 'step', None))
+        self.assertEqual([output.get()[2] for i in range(3)], [0, 1, 2])
+        driver.request_stop()
+        driver.join()
+        self.assertTrue(output.empty())
+
+# vim: expandtab sw=4 ts=4
@@ -0,0 +1,102 @@
+"""
+  Wait for growing files - Linux inotify with polling fallback
+"""
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+
+POLL_PERIOD = 0.1  # sec, used when inotify is not available
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+_EVENT = struct.Struct('iIII')  # watch descriptor, mask, cookie, length of name
+
+_libc = None
+
+
+def _inotify():
+    "return libc with inotify functions or None"
+    global _libc
+    if _libc is None:
+        _libc = False
+        if sys.platform.startswith('linux'):
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+                if hasattr(libc, 'inotify_init1'):  # glibc 2.9+
+                    _libc = libc
+            except OSError:
+                pass
+    return _libc or None
+
+
+class FileWatcher:
+    """
+      Wait for modification of the file or of files with the same name
+      prefix (i.e. segments of log). The directory is watched so that also
+      replaced files (manifest) are reported.
+    """
+    def __init__(self, filename, poll_period=POLL_PERIOD):
+        self.dirname = os.path.dirname(os.path.abspath(filename))
+        self.prefix = os.fsencode(os.path.basename(filename))
+        self.poll_period = poll_period
+        self.fd = None
+        libc = _inotify()
+        if libc is not None:
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+                if libc.inotify_add_watch(fd, os.fsencode(self.dirname), mask) >= 0:
+                    self.fd = fd
+                else:
+                    os.close(fd)
+
+    def wait(self, timeout=None):
+        """wait for modification, return False after timeout
+           (without inotify it returns True after poll_period)
+        """
+        if self.fd is None:
+            time.sleep(self.poll_period if timeout is None else min(timeout, self.poll_period))
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            readable, __, __ = select.select([self.fd], [], [], remaining)
+            if len(readable) == 0:
+                return False
+            if self._read_events():
+                return True
+
+    def _read_events(self):
+        "read all pending events, return True if some concerns watched files"
+        changed = False
+        while True:
+            try:
+                buf = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return changed
+            pos = 0
+            while pos < len(buf):
+                __, __, __, size = _EVENT.unpack_from(buf, pos)
+                pos += _EVENT.size
+                if buf[pos:pos + size].startswith(self.prefix):
+                    changed = True
+                pos += size
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# vim: expandtab sw=4 ts=4
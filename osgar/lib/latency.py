@@ -0,0 +1,74 @@
+"""
+  Latency histogram with logarithmic buckets (resolution ~12%)
+"""
+
+SUB_BUCKETS = 8
+
+
+def bucket_index(value):
+    "integer value (i.e. microseconds) -> bucket index"
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - 4
+    return SUB_BUCKETS * shift + (value >> shift)
+
+
+def bucket_value(index):
+    "the lowest value of given bucket"
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return (index % SUB_BUCKETS + SUB_BUCKETS) << shift
+
+
+class LatencyHistogram:
+    """
+      Histogram of latencies (in microseconds) and maximal queue depth
+    """
+    def __init__(self):
+        self.counts = {}  # bucket index -> count
+        self.count = 0
+        self.max = 0
+        self.depth = 0
+
+    def add(self, latency, depth=0):
+        index = bucket_index(latency)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        if latency > self.max:
+            self.max = latency
+        if depth > self.depth:
+            self.depth = depth
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.max = max(self.max, other.max)
+        self.depth = max(self.depth, other.depth)
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0
+        limit = self.count * p / 100.0
+        total = 0
+        for index in sorted(self.counts):
+            total += self.counts[index]
+            if total >= limit:
+                return min(bucket_value(index), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count, 'p50': self.percentile(50), 'p99': self.percentile(99),
+                'max': self.max, 'depth': self.depth, 'hist': self.counts}
+
+    @classmethod
+    def from_dict(cls, d):
+        hist = cls()
+        hist.counts = dict(d['hist'])
+        hist.count = d['count']
+        hist.max = d['max']
+        hist.depth = d['depth']
+        return hist
+
+# vim: expandtab sw=4 ts=4
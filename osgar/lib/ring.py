@@ -0,0 +1,150 @@
+"""
+  Single-producer single-consumer ring buffer in shared memory
+
+  Frames are written with one copy into the shared memory and the consumer
+  gets them as memoryview (no copy), valid until release() is called.
+"""
+import struct
+import multiprocessing
+from multiprocessing import shared_memory
+
+_POS = struct.Struct('<Q')
+_WRITE_POS, _READ_POS, _CLOSED = 0, 8, 16  # offsets of header fields
+_HEADER_SIZE = 24
+_FRAME = struct.Struct('<I')
+_WRAP = 0xFFFFFFFF  # marker - the next frame starts at the beginning
+
+
+class RingClosed(Exception):
+    pass
+
+
+class SharedRing:
+    """
+      Ring buffer of variable size frames, the positions are stored in the
+      header of the shared memory block and guarded by Condition.
+      The instance can be passed to the child process as an argument, the
+      creator process is the owner and removes the shared memory in detach().
+    """
+    def __init__(self, size, ctx=None):
+        if ctx is None:
+            ctx = multiprocessing.get_context('spawn')
+        self.size = size
+        self._shm = shared_memory.SharedMemory(create=True, size=_HEADER_SIZE + size)
+        self._owner = True
+        self._cond = ctx.Condition()
+        for offset in [_WRITE_POS, _READ_POS, _CLOSED]:
+            _POS.pack_into(self._shm.buf, offset, 0)
+        self._view = None
+        self._pending = 0
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'size': self.size, 'cond': self._cond}
+
+    def __setstate__(self, state):
+        self.size = state['size']
+        self._cond = state['cond']
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._owner = False
+        self._view = None
+        self._pending = 0
+
+    def _get(self, offset):
+        return _POS.unpack_from(self._shm.buf, offset)[0]
+
+    def put(self, *parts):
+        "write one frame composed of given parts (bytes-like objects)"
+        size = sum(len(part) for part in parts)
+        if _FRAME.size + size > self.size:
+            raise ValueError('Frame of %d bytes does not fit into ring of %d bytes' % (size, self.size))
+        with self._cond:
+            while True:
+                if self._get(_CLOSED):
+                    raise RingClosed()
+                write_pos = self._get(_WRITE_POS)
+                read_pos = self._get(_READ_POS)
+                offset = write_pos % self.size
+                skip = self.size - offset if self.size - offset < _FRAME.size + size else 0
+                if skip > 0 and read_pos == write_pos:
+                    # empty ring (no frame held by consumer) - rewind both positions to
+                    # the beginning, otherwise frame larger than the rest of the buffer
+                    # would wait for space which never comes
+                    write_pos = read_pos = write_pos + skip
+                    _POS.pack_into(self._shm.buf, _WRITE_POS, write_pos)
+                    _POS.pack_into(self._shm.buf, _READ_POS, read_pos)
+                    offset, skip = 0, 0
+                if self.size - (write_pos - read_pos) >= skip + _FRAME.size + size:
+                    break
+                self._cond.wait()
+
+        # the free space is not touched by consumer - copy data without lock
+        buf = self._shm.buf
+        if skip > 0:
+            if skip >= _FRAME.size:
+                _FRAME.pack_into(buf, _HEADER_SIZE + offset, _WRAP)
+            offset = 0
+        _FRAME.pack_into(buf, _HEADER_SIZE + offset, size)
+        pos = _HEADER_SIZE + offset + _FRAME.size
+        for part in parts:
+            buf[pos:pos + len(part)] = part
+            pos += len(part)
+
+        with self._cond:
+            _POS.pack_into(buf, _WRITE_POS, write_pos + skip + _FRAME.size + size)
+            self._cond.notify_all()
+
+    def get(self):
+        """
+          return memoryview of the next frame (blocking) or None if the ring
+          is closed and empty, the frame is valid until release()
+        """
+        assert self._view is None, 'release() of previous frame missing'
+        with self._cond:
+            while True:
+                read_pos = self._get(_READ_POS)
+                if self._get(_WRITE_POS) > read_pos:
+                    break
+                if self._get(_CLOSED):
+                    return None
+                self._cond.wait()
+
+        buf = self._shm.buf
+        offset = read_pos % self.size
+        skip = 0
+        if self.size - offset < _FRAME.size or _FRAME.unpack_from(buf, _HEADER_SIZE + offset)[0] == _WRAP:
+            skip = self.size - offset
+            offset = 0
+        size = _FRAME.unpack_from(buf, _HEADER_SIZE + offset)[0]
+        self._pending = skip + _FRAME.size + size
+        start = _HEADER_SIZE + offset + _FRAME.size
+        self._view = buf[start:start + size]
+        return self._view
+
+    def release(self):
+        "free space of the frame returned by the last get()"
+        if self._view is None:
+            return
+        self._view.release()
+        self._view = None
+        with self._cond:
+            _POS.pack_into(self._shm.buf, _READ_POS, self._get(_READ_POS) + self._pending)
+            self._cond.notify_all()
+
+    def close(self):
+        "no more frames - wakes up both producer and consumer"
+        with self._cond:
+            _POS.pack_into(self._shm.buf, _CLOSED, 1)
+            self._cond.notify_all()
+
+    def detach(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        try:
+            self._shm.close()
+        except BufferError:
+            pass  # frame still referenced by other thread, released with the process
+        if self._owner:
+            self._shm.unlink()
+
+# vim: expandtab sw=4 ts=4
@@ -9,5 +9,16 @@ def serialize(data):
 
 
 def deserialize(bytes_data):
+    # bytes_data can be any buffer (bytes, bytearray, memoryview) - there is
+    # no need to copy records from LogIndexedReader.view() before decoding
     return msgpack.unpackb(bytes_data, raw=False)
 
+
+def array_decoder(dtype):
+    """return decoder of lists of numbers (i.e. LIDAR scans) into numpy
+       arrays, usable as LogReader stream decoder"""
+    import numpy as np
+
+    def decode(bytes_data):
+        return np.array(deserialize(bytes_data), dtype=dtype)
+    return decode
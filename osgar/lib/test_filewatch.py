@@ -0,0 +1,52 @@
+import unittest
+import os
+import time
+import tempfile
+from threading import Timer
+from unittest.mock import patch
+
+from osgar.lib.filewatch import FileWatcher
+
+
+def append(filename, data):
+    with open(filename, 'ab') as f:
+        f.write(data)
+
+
+class FileWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'test.log')
+        append(self.filename, b'header')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_wait(self):
+        with FileWatcher(self.filename) as watcher:
+            if watcher.fd is not None:
+                self.assertFalse(watcher.wait(0.05))  # timeout
+            proc = Timer(0.05, append, [self.filename, b'record'])
+            proc.start()
+            self.assertTrue(watcher.wait(10))
+            proc.join()
+
+    def test_other_files_ignored(self):
+        with FileWatcher(self.filename) as watcher:
+            if watcher.fd is None:
+                self.skipTest('inotify not available')
+            append(os.path.join(self.tmpdir.name, 'other.log'), b'data')
+            self.assertFalse(watcher.wait(0.05))
+            append(self.filename + '.001', b'segment')
+            self.assertTrue(watcher.wait(0.05))
+
+    def test_polling_fallback(self):
+        with patch('osgar.lib.filewatch._inotify', return_value=None):
+            with FileWatcher(self.filename, poll_period=0.01) as watcher:
+                self.assertIsNone(watcher.fd)
+                start = time.monotonic()
+                self.assertTrue(watcher.wait())
+                self.assertLess(time.monotonic() - start, 1.0)
+
+# vim: expandtab sw=4 ts=4
@@ -0,0 +1,33 @@
+import unittest
+
+from osgar.lib.latency import LatencyHistogram, bucket_index, bucket_value
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def test_buckets(self):
+        prev = -1
+        for value in range(100000):
+            index = bucket_index(value)
+            self.assertIn(index - prev, [0, 1])  # monotonic without gaps
+            self.assertLessEqual(bucket_value(index), value)
+            self.assertLess(value - bucket_value(index), max(1, value / 8))
+            prev = index
+
+    def test_percentile(self):
+        hist = LatencyHistogram()
+        for value in range(1, 101):
+            hist.add(value * 1000, depth=value % 7)
+        self.assertEqual(hist.count, 100)
+        self.assertEqual(hist.max, 100000)
+        self.assertEqual(hist.depth, 6)
+        self.assertAlmostEqual(hist.percentile(50), 50000, delta=50000/8)
+        self.assertAlmostEqual(hist.percentile(99), 99000, delta=99000/8)
+        self.assertEqual(hist.percentile(100), 98304)
+
+        merged = LatencyHistogram.from_dict(hist.to_dict())
+        merged.merge(hist)
+        self.assertEqual(merged.count, 200)
+        self.assertEqual(merged.percentile(50), hist.percentile(50))
+
+# vim: expandtab sw=4 ts=4
@@ -20,6 +20,10 @@
 # more than an hour of recording. The file contains absolute time and date in
 # the overall file header allowing splitting the file and getting absolute time
 # from deltas if necessary.
+#   The timestamps are taken from monotonic clock relative to the log start, so
+# wall-clock jumps (NTP) do not affect them. The 32bit overflow is resolved
+# by readers, so the recording can be longer than a day as long as there is
+# at least one record per overflow period.
 #
 #   The stream ID is currently just integer without detailed description. There
 # is planned extra info stored in "info channel/stream" ID = 0.
@@ -28,70 +32,394 @@
 # 0 and 0xFFFF. The big block could be then split into several smaller once. This
 # part is not defined yet.
 #
+#   Format version 2 (opt-in, file header 'Pyr\x02') uses record header
+#   <timestamp>, <streamID>, <size>, <CRC32>
+# with 64bit timestamp (no overflow), 32bit size (no splitting into chunks)
+# and CRC32 of the header fields and data, so that the valid part of a log
+# truncated by power cut can be found (see osgar.tools.logrecover).
+#
 
 import datetime
 import struct
 import os
+import json
 import logging
 import time
-from threading import RLock
+try:
+    from time import monotonic_ns
+except ImportError:  # Python < 3.7
+    def monotonic_ns():
+        return int(time.monotonic() * 1000000000)
+from threading import RLock, Lock, Condition, Thread
 from ast import literal_eval
 import mmap
+import zlib
+import lzma
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+
+from osgar.lib.serialize import deserialize
+from osgar.lib.latency import LatencyHistogram
+from osgar.lib.filewatch import FileWatcher
 
 
 INFO_STREAM_ID = 0
 ENV_OSGAR_LOGS = 'OSGAR_LOGS'
+INDEX_FILE_EXT = '.idx'  # sidecar file with cached LogIndex
+READ_BUFFER_SIZE = 1 << 20  # read-ahead of LogReader
+METADATA_CACHE_SIZE = 64  # number of logs with cached LogMetadata
 
 TIMESTAMP_OVERFLOW_STEP = (1 << 32)  # in microseconds resolution
 TIMESTAMP_MASK = TIMESTAMP_OVERFLOW_STEP - 1
 
+_HEADER = struct.Struct('IHH')  # timestamp, stream ID, size
+_HEADER_V2 = struct.Struct('<qHII')  # timestamp, stream ID, size, CRC32
+_HEADER_V2_CRC = 14  # CRC32 covers the header before CRC and the data
+LOG_MAGIC = {1: b'Pyr\x00', 2: b'Pyr\x02'}  # format version -> file magic
+_FILE_VERSION = {magic: version for version, magic in LOG_MAGIC.items()}
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+# Compression of selected streams - every record of such stream starts with
+# one byte codec ID (0 = stored without compression) followed by the data.
+# Compressed streams are announced in the info stream as
+# {'compress': {<stream ID>: <codec name>}} before the first record.
+CODECS = {}  # codec name -> (codec ID, compress, decompress)
+_CODECS_BY_ID = {}
+
+def register_codec(name, codec_id, compress, decompress):
+    assert 0 < codec_id < 256, codec_id
+    assert codec_id not in _CODECS_BY_ID or CODECS.get(name, (None,))[0] == codec_id, (name, codec_id)
+    CODECS[name] = (codec_id, compress, decompress)
+    _CODECS_BY_ID[codec_id] = (name, compress, decompress)
+
+register_codec('zlib', 1, lambda data: zlib.compress(data, 1), zlib.decompress)
+register_codec('lzma', 2, lambda data: lzma.compress(data, preset=1), lzma.decompress)
+
+
+def _compress(codec, data):
+    codec_id, compress, __ = CODECS[codec]
+    packed = compress(data)
+    if len(packed) >= len(data):
+        return b'\x00' + data
+    return bytes([codec_id]) + packed
+
+
+def _decompress(data):
+    codec_id = data[0]
+    body = memoryview(data)[1:]
+    if codec_id == 0:
+        return bytes(body)
+    return _CODECS_BY_ID[codec_id][2](body)
+
+
+def _parse_compress_info(data, compressed):
+    "update compressed {stream ID: codec} from info stream record"
+    if data.startswith(b"{'compress'"):
+        compressed.update(literal_eval(data.decode('ascii'))['compress'])
+
+def _file_version(magic):
+    assert magic in _FILE_VERSION, magic
+    return _FILE_VERSION[magic]
+
+def _pack_record(buf, micros, stream_id, data):
+    "append record to bytearray buffer (split into 64kB chunks if needed)"
+    time_frac = micros & TIMESTAMP_MASK
+    index = 0
+    while index + 0xFFFF <= len(data):
+        buf += struct.pack('IHH', time_frac, stream_id, 0xFFFF)
+        buf += data[index:index + 0xFFFF]
+        index += 0xFFFF
+    buf += struct.pack('IHH', time_frac, stream_id, len(data) - index)
+    buf += data[index:]
+    return buf
+
+def _pack_record_v2(buf, micros, stream_id, data):
+    "append record in format version 2 to bytearray buffer"
+    header = _HEADER_V2.pack(micros, stream_id, len(data), 0)[:_HEADER_V2_CRC]
+    buf += header
+    buf += struct.pack('<I', zlib.crc32(data, zlib.crc32(header)))
+    buf += data
+    return buf
+
+def _valid_record_v2(data, pos):
+    "return end of valid version 2 record starting at pos or None"
+    if pos + _HEADER_V2.size > len(data):
+        return None
+    __, __, size, crc = _HEADER_V2.unpack_from(data, pos)
+    start = pos + _HEADER_V2.size
+    end = start + size
+    if end > len(data):
+        return None
+    with memoryview(data) as buf:
+        if zlib.crc32(buf[start:end], zlib.crc32(buf[pos:pos + _HEADER_V2_CRC])) != crc:
+            return None
+    return end
+
+
+# Segmented log - the log file is only a manifest listing the segment files.
+# Every segment is a complete log with its own header (start time) and
+# timestamps relative to it. The manifest contains the segment start offsets
+# (in microseconds from the log start) and the number of info records (note,
+# config, names, ...) repeated at the beginning of the segment, so that each
+# segment can be also processed alone.
+MANIFEST_MAGIC = b'PyrM'
+SEGMENT_SHIFT = 40  # record position in segment set = segment << SEGMENT_SHIFT | file offset
+SEGMENT_POS_MASK = (1 << SEGMENT_SHIFT) - 1
+
+
+def write_manifest(filename, segments):
+    "atomic replace of manifest with segments [{'filename', 'offset', 'header_records'}]"
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(MANIFEST_MAGIC)
+        f.write(json.dumps({'segments': segments}).encode('ascii'))
+    os.replace(tmp_filename, filename)
+
+
+def read_manifest(filename):
+    """return list of segments (filepath, offset in microseconds, number of
+       repeated info records) or None if the file is ordinary log
+    """
+    with open(filename, 'rb') as f:
+        if f.read(4) != MANIFEST_MAGIC:
+            return None
+        manifest = json.loads(f.read().decode('ascii'))
+    dirname = os.path.dirname(filename)
+    return [(os.path.join(dirname, segment['filename']), segment['offset'], segment['header_records'])
+            for segment in manifest['segments']]
+
+
 class LogWriter:
-    def __init__(self, prefix='naio', note=''):
+    """
+      Log writer with optional buffered mode
+
+      buffered=False - every record is written and flushed immediately
+      buffered=True  - records are collected in memory and written in batches
+                       by background flusher thread, at latest after
+                       flush_period (sec) or when flush_size (bytes) is reached
+      fsync=None     - no explicit os.fsync() call
+      fsync='close'  - data are synced to disk when the log is closed
+      fsync='batch'  - data are synced to disk after every written batch
+                       (after every record with buffered=False)
+      max_pending    - in buffered mode write() blocks while more data (bytes)
+                       wait for the flusher; an I/O error of the flusher is
+                       raised by the next write() and by close()
+      compress       - optional {stream name or ID: codec name} (see CODECS),
+                       in buffered mode the data are compressed by the flusher
+      segment_size, segment_duration
+                     - optional rollover into segment files <filename>.000,
+                       <filename>.001, ... after given size (bytes) or
+                       duration (sec), the filename is then the manifest
+                       listing the segments (see read_manifest())
+      version        - file format version (1 or 2 with 64bit timestamps,
+                       32bit sizes and record CRC)
+    """
+    def __init__(self, prefix='naio', note='', buffered=False,
+                 flush_period=0.1, flush_size=1 << 20, fsync=None, compress=None,
+                 segment_size=None, segment_duration=None, version=1, max_pending=64 << 20):
+        assert fsync in [None, 'close', 'batch'], fsync
+        assert version in LOG_MAGIC, version
+        self.version = version
+        self._pack = _pack_record if version == 1 else _pack_record_v2
         self.lock = RLock()
         self.start_time = datetime.datetime.utcnow()
+        self.start_ns = monotonic_ns()  # anchor of relative timestamps
         self.filename = prefix + self.start_time.strftime("%y%m%d_%H%M%S.log")
         if ENV_OSGAR_LOGS in os.environ:
             os.makedirs(os.environ[ENV_OSGAR_LOGS], exist_ok=True)
             self.filename = os.path.join(os.environ[ENV_OSGAR_LOGS], self.filename)
         else:
             logging.warning('Environment variable %s is not set - using working directory' % ENV_OSGAR_LOGS)
-        self.f = open(self.filename, 'wb')
-        self.f.write(b'Pyr\x00')
 
-        t = self.start_time
-        self.f.write(struct.pack('HBBBBBI', t.year, t.month, t.day,
-                t.hour, t.minute, t.second, t.microsecond))
-        self.f.flush()
+        self.fsync = fsync
+        self.segment_size = segment_size
+        self.segment_duration = None if segment_duration is None else int(segment_duration * 1000000)
+        self.segments = None  # list of segment descriptions for the manifest
+        self._segment_offset = 0  # start of the current segment in microseconds
+        self._segment_bytes = 0
+        self._segment_records = 0
+        self._header_records = []  # info records repeated at the beginning of every segment
+        self._data_written = False
+        self.f = None
+        if segment_size is None and segment_duration is None:
+            self.f = open(self.filename, 'wb')
+            self._write_file_header(self.start_time)
+        else:
+            self.segments = []
+            self._open_segment(0)
+
+        self.flush_period = flush_period
+        self.flush_size = flush_size
+        self.max_pending = max_pending
+        self._pending = []  # list of (microseconds, stream_id, data) waiting for flusher
+        self._pending_size = 0
+        self._io_lock = Lock()  # keeps batches in order
+        self._closing = False
+        self._flusher = None
+        self._error = None  # exception of the flusher thread
+        self._drained = Condition(self.lock)  # pending records taken by the flusher
+        self.compress = {} if compress is None else compress
+        for codec in self.compress.values():
+            assert codec in CODECS, codec
+        self._codecs = {}  # stream ID -> codec name
+        if buffered:
+            self._wakeup = Condition(self.lock)
+            self._flusher = Thread(target=self._run_flusher, daemon=True)
+            self._flusher.start()
+
         if len(note) > 0:
             self.write(stream_id=INFO_STREAM_ID, data=bytes(note, encoding='utf-8'))
         self.names = []
+        for stream_id, codec in self.compress.items():
+            if isinstance(stream_id, int):
+                self._set_codec(stream_id, codec)
+
+    def _write_file_header(self, t):
+        self.f.write(LOG_MAGIC[self.version])
+        self.f.write(struct.pack('HBBBBBI', t.year, t.month, t.day,
+                t.hour, t.minute, t.second, t.microsecond))
+        self.f.flush()
+        self._segment_bytes = 4 + 12
+
+    def _open_segment(self, offset):
+        "close the current segment and start the next one at offset (microseconds)"
+        if self.f is not None:
+            self.f.flush()
+            if self.fsync is not None:
+                os.fsync(self.f.fileno())
+            self.f.close()
+        filename = '%s.%03d' % (self.filename, len(self.segments))
+        self.f = open(filename, 'wb')
+        self._write_file_header(self.start_time + _MICROSECOND * offset)
+        with self.lock:
+            header_records = list(self._header_records)
+        buf = bytearray()
+        for data in header_records:
+            self._pack(buf, 0, INFO_STREAM_ID, data)
+        self.f.write(buf)
+        self.f.flush()
+        self._segment_offset = offset
+        self._segment_bytes += len(buf)
+        self._segment_records = 0
+        self.segments.append({'filename': os.path.basename(filename), 'offset': offset,
+                              'header_records': len(header_records)})
+        write_manifest(self.filename, self.segments)
+
+    def _need_rollover(self, micros, size):
+        "is new segment needed for the record of given time and size (bytes not written yet)?"
+        if self.segments is None or self._segment_records == 0:
+            return False
+        return ((self.segment_size is not None and self._segment_bytes + size > self.segment_size) or
+                (self.segment_duration is not None and
+                 micros - self._segment_offset >= self.segment_duration))
+
+    def _set_codec(self, stream_id, codec):
+        self.write(stream_id=INFO_STREAM_ID, data=bytes(str({'compress': {stream_id: codec}}), encoding='ascii'))
+        self._codecs[stream_id] = codec
 
     def register(self, name):
         with self.lock:
             assert name not in self.names, (name, self.names)
             self.names.append(name)
             self.write(stream_id=INFO_STREAM_ID, data=bytes(str({'names': self.names}), encoding='ascii'))
-            return len(self.names)
+            stream_id = len(self.names)
+            if name in self.compress:
+                self._set_codec(stream_id, self.compress[name])
+            return stream_id
 
     def write(self, stream_id, data):
         with self.lock:
-            dt = datetime.datetime.utcnow() - self.start_time
-            bytes_data = data
-            assert dt.days == 0, dt  # multiple days not supported yet
-            time_frac = (dt.seconds * 1000000 + dt.microseconds) & TIMESTAMP_MASK
-            index = 0
-            while index + 0xFFFF <= len(bytes_data):
-                self.f.write(struct.pack('IHH', time_frac,
-                             stream_id, 0xFFFF))
-                self.f.write(bytes_data[index:index + 0xFFFF])
-                index += 0xFFFF
-            self.f.write(struct.pack('IHH', time_frac,
-                         stream_id, len(bytes_data) - index))
-            self.f.write(bytes_data[index:])
-            self.f.flush()
-        return dt
+            if self._flusher is not None:
+                while self._error is None and self._pending_size >= self.max_pending:
+                    self._wakeup.notify()
+                    self._drained.wait()
+                if self._error is not None:
+                    raise self._error
+            micros = (monotonic_ns() - self.start_ns) // 1000
+            if self.segments is not None:
+                if stream_id != INFO_STREAM_ID:
+                    self._data_written = True
+                elif not self._data_written or data.startswith((b"{'names'", b"{'compress'")):
+                    self._header_records.append(data)
+            if self._flusher is None:
+                if stream_id in self._codecs:
+                    data = _compress(self._codecs[stream_id], data)
+                if self._need_rollover(micros, len(data) + _HEADER_V2.size):
+                    self._open_segment(micros)
+                record = self._pack(bytearray(), micros - self._segment_offset, stream_id, data)
+                self.f.write(record)
+                self.f.flush()
+                if self.fsync == 'batch':
+                    os.fsync(self.f.fileno())
+                self._segment_bytes += len(record)
+                self._segment_records += 1
+            else:
+                self._pending.append((micros, stream_id, data))
+                self._pending_size += len(data)
+                if self._pending_size >= self.flush_size:
+                    self._wakeup.notify()
+        return _MICROSECOND * micros  # faster than timedelta(microseconds=micros)
+
+    def flush(self):
+        "write all pending records to the file"
+        with self._io_lock:
+            with self.lock:
+                records, self._pending = self._pending, []
+                self._pending_size = 0
+                self._drained.notify_all()
+            if len(records) > 0:
+                buf = bytearray()
+                codecs, pack = self._codecs, self._pack
+                for micros, stream_id, data in records:
+                    if stream_id in codecs:
+                        data = _compress(codecs[stream_id], data)
+                    if self._need_rollover(micros, len(buf) + len(data) + _HEADER_V2.size):
+                        self.f.write(buf)
+                        buf = bytearray()
+                        self._open_segment(micros)
+                    pack(buf, micros - self._segment_offset, stream_id, data)
+                    self._segment_records += 1
+                self.f.write(buf)
+                self.f.flush()
+                self._segment_bytes += len(buf)
+                if self.fsync == 'batch':
+                    os.fsync(self.f.fileno())
+
+    def _run_flusher(self):
+        while True:
+            with self.lock:
+                if not self._closing and self._pending_size < self.flush_size:
+                    self._wakeup.wait(self.flush_period)
+                closing = self._closing
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error('Log flusher of %s failed: %s' % (self.filename, e))
+                with self.lock:
+                    self._error = e
+                    self._drained.notify_all()
+                break
+            if closing:
+                break
 
     def close(self):
+        if self._flusher is not None:
+            with self.lock:
+                self._closing = True
+                self._wakeup.notify()
+            self._flusher.join()
+            self._flusher = None
+        if self._error is not None:
+            try:
+                self.f.close()
+            except OSError:
+                pass  # the same error again - unwritten data in file buffer
+            self.f = None
+            raise self._error
+        self.f.flush()
+        if self.fsync is not None:
+            os.fsync(self.f.fileno())
         self.f.close()
         self.f = None
 
@@ -104,28 +432,182 @@ class LogWriter:
         self.close()
 
 
+class LogRecord:
+    """
+      Log record with lazy decoding - the data are decoded on the first
+      access and cached
+    """
+    __slots__ = ('timestamp', 'stream_id', 'raw', '_decoder', '_data')
+
+    def __init__(self, timestamp, stream_id, raw, decoder=None):
+        self.timestamp = timestamp
+        self.stream_id = stream_id
+        self.raw = raw
+        self._decoder = decoder
+        self._data = raw
+
+    @property
+    def data(self):
+        if self._decoder is not None:
+            self._data = self._decoder(self.raw)
+            self._decoder = None
+        return self._data
+
+
 class LogReader:
-    def __init__(self, filename, follow=False, only_stream_id=None):
+    """
+      Sequential log reader - iterates (timestamp, stream_id, data)
+      The optional start and end (timedelta) limit the reading to given time
+      window, where the start position is looked up in the log index.
+
+      With lazy=True the reader yields LogRecord objects instead, where
+      data are decoded only when needed. Stream data are deserialized by
+      default, but the decoder can be changed per stream via decoders
+      dictionary {stream name or ID: function(raw_bytes)}.
+    """
+    def __init__(self, filename, follow=False, only_stream_id=None,
+                 start=None, end=None, lazy=False, decoders=None):
         self.filename = filename
         self.follow = follow
-        self.f = open(self.filename, 'rb')
-        data = self._read(4)
-        assert data == b'Pyr\x00', data
+        self.end = end
+        self.lazy = lazy
+        self.decoders = {} if decoders is None else decoders
+        self.stream_decoders = {}  # stream ID -> decoder
+        self._update_decoders([])
+        self.compressed = {}  # stream ID -> codec name
+        self.f = None
+        self._watcher = None  # FileWatcher of followed log
+        self.segments = read_manifest(filename)  # None for single file log
+        self._open_segment(0)
+        self.start_time = self.segment_start_time
+        if len(self.decoders) > 0:
+            # names are known also when the names records are skipped by seek
+            self._update_decoders(log_metadata(filename).names)
+        if start is not None:
+            self._seek(start)
+        self.gen = self._read_gen(only_stream_id=only_stream_id)
+
+    def _open_segment(self, segment):
+        "open log file (or given segment of segmented log) and read its header"
+        if self.f is not None:
+            self.f.close()
+        if self.segments is None:
+            filename, self.segment_offset, self._skip_records = self.filename, 0, 0
+        else:
+            filename, self.segment_offset, self._skip_records = self.segments[segment]
+        self.segment = segment
+        self.f = open(filename, 'rb', buffering=READ_BUFFER_SIZE)
+        self.version = _file_version(self._read(4))
+        self._read_record = self._read_record_v1 if self.version == 1 else self._read_record_v2
 
         data = self._read(12)
-        self.start_time = datetime.datetime(*struct.unpack('HBBBBBI', data))
+        self.segment_start_time = datetime.datetime(*struct.unpack('HBBBBBI', data))
         self.us_offset = 0  # increase after overflow
         self.prev_microseconds = 0
-        self.gen = self._read_gen(only_stream_id=only_stream_id)
+
+    def _next_segment(self):
+        "continue with the next segment, return False at the end of log"
+        if self.segments is None or self.segment + 1 >= len(self.segments):
+            return False
+        self._open_segment(self.segment + 1)
+        return True
+
+    def _segment_finished(self):
+        "is the current segment complete (the writer already started the next one)?"
+        if self.segments is None:
+            return False
+        self.segments = read_manifest(self.filename)
+        return self.segment + 1 < len(self.segments)
+
+    def _seek(self, start):
+        with LogIndexedReader(self.filename) as log:
+            # info records before the start are skipped - take codecs from the index
+            self.compressed.update(log._compressed_streams())
+            if len(self.decoders) > 0:
+                self._update_decoders(log.stream_names())
+            k = log.seek(start)
+            if k < len(log):
+                pos, micros = log.index.pos[k], log.index.micros[k]
+            else:
+                pos, micros = log.index.end_pos, log.index.end_micros
+        if self.segments is not None:
+            self._open_segment(pos >> SEGMENT_SHIFT)
+            self._skip_records = 0
+            pos &= SEGMENT_POS_MASK
+            micros -= self.segment_offset
+        self.f.seek(pos)
+        self.prev_microseconds = micros & TIMESTAMP_MASK
+        self.us_offset = micros - self.prev_microseconds
+
+    def _update_decoders(self, names):
+        for stream, decoder in self.decoders.items():
+            try:
+                self.stream_decoders[int(stream)] = decoder
+            except ValueError:
+                if stream in names:
+                    self.stream_decoders[names.index(stream) + 1] = decoder
+
+    def _decoder(self, stream_id):
+        if stream_id in self.stream_decoders:
+            return self.stream_decoders[stream_id]
+        return None if stream_id == INFO_STREAM_ID else deserialize
 
     def _read(self, size):
         buf = self.f.read(size)
         if self.follow:
             while len(buf) < size:
-                time.sleep(0.1)
+                if self._segment_finished():
+                    buf += self.f.read(size - len(buf))  # the rest of complete segment
+                    break
+                if self._watcher is None:
+                    # watch before the next read - no append can be missed
+                    self._watcher = FileWatcher(self.filename)
+                else:
+                    self._watcher.wait()
                 buf += self.f.read(size - len(buf))
         return buf
 
+    def _read_record_v1(self):
+        "read (time, stream, data) or None at the end of file"
+        header = self._read(8)
+        if len(header) < 8:
+            return None
+        microseconds, stream_id, size = _HEADER.unpack(header)
+        if self.prev_microseconds > microseconds:
+            self.us_offset += TIMESTAMP_OVERFLOW_STEP
+        self.prev_microseconds = microseconds
+        microseconds += self.us_offset
+        dt = datetime.timedelta(microseconds=microseconds + self.segment_offset)
+        data = self._read(size)
+        assert len(data) == size, (len(data), size)
+        if size == 0xFFFF:
+            # large record split into 64kB chunks - join all parts at once
+            parts = [data]
+            while size == 0xFFFF:
+                header = self._read(8)
+                if len(header) < 8:
+                    break
+                ref_microseconds, ref_stream_id, size = _HEADER.unpack(header)
+                assert microseconds & TIMESTAMP_MASK == ref_microseconds, (microseconds & TIMESTAMP_MASK, ref_microseconds)
+                assert stream_id == ref_stream_id, (stream_id, ref_stream_id)
+                part = self._read(size)
+                assert len(part) == size, (len(part), size)
+                parts.append(part)
+            data = b''.join(parts)
+        return dt, stream_id, data
+
+    def _read_record_v2(self):
+        "read (time, stream, data) or None at the end of file or of the valid data"
+        header = self._read(_HEADER_V2.size)
+        if len(header) < _HEADER_V2.size:
+            return None
+        microseconds, stream_id, size, crc = _HEADER_V2.unpack(header)
+        data = self._read(size)
+        if len(data) < size or zlib.crc32(data, zlib.crc32(header[:_HEADER_V2_CRC])) != crc:
+            logging.warning('Invalid record in %s - end of valid data' % self.filename)
+            return None
+        return datetime.timedelta(microseconds=microseconds + self.segment_offset), stream_id, data
+
     def _read_gen(self, only_stream_id=None):
         "packed generator - yields (time, stream, data)"
         if only_stream_id is None:
@@ -137,34 +619,36 @@ class LogReader:
                 multiple_streams = set([only_stream_id])
 
         while True:
-            header = self._read(8)
-            if len(header) < 8:
+            record = self._read_record()
+            if record is None:
+                if self._next_segment():
+                    continue
                 break
-            microseconds, stream_id, size = struct.unpack('IHH', header)
-            if self.prev_microseconds > microseconds:
-                self.us_offset += TIMESTAMP_OVERFLOW_STEP
-            self.prev_microseconds = microseconds
-            microseconds += self.us_offset
-            dt = datetime.timedelta(microseconds=microseconds)
-            data = self._read(size)
-            assert len(data) == size, (len(data), size)
-            while size == 0xFFFF:
-                header = self._read(8)
-                if len(header) < 8:
-                    break
-                ref_microseconds, ref_stream_id, size = struct.unpack('IHH', header)
-                assert microseconds & TIMESTAMP_MASK == ref_microseconds, (microseconds & TIMESTAMP_MASK, ref_microseconds)
-                assert stream_id == ref_stream_id, (stream_id, ref_stream_id)
-                part = self._read(size)
-                assert len(part) == size, (len(part), size)
-                data += part
-
+            dt, stream_id, data = record
+            if self._skip_records > 0:
+                self._skip_records -= 1  # info records repeated in segment
+                continue
+            if self.end is not None and dt > self.end:
+                break
+            if stream_id == INFO_STREAM_ID:
+                _parse_compress_info(data, self.compressed)
+                if self.lazy and data.startswith(b"{'names'"):
+                    # stream names are needed for decoders given by name
+                    self._update_decoders(literal_eval(data.decode('ascii'))['names'])
+            elif stream_id in self.compressed:
+                data = _decompress(data)
             if len(multiple_streams) == 0 or stream_id in multiple_streams:
-                yield dt, stream_id, data
+                if self.lazy:
+                    yield LogRecord(dt, stream_id, data, self._decoder(stream_id))
+                else:
+                    yield dt, stream_id, data
 
     def close(self):
         self.f.close()
         self.f = None
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
 
 
     # context manager functions
@@ -191,100 +675,486 @@ class LogAsserter(LogReader):
             pass
 
 
-def _create_index(data, pos, start_time=datetime.timedelta()):
-    """index is list of (pos,timestamp) where the last item
-       `pos` points just past the last valid packet
-       `timestamp` is last valid timestamp
-       this marker says where and when the next parsing
-       should continue when growing the file
+def _create_index(data, index):
+    """extend index by complete records found in data after index.end_pos
+       the index.end_pos and index.end_micros then point just past
+       the last complete record and to its timestamp, i.e. where and when
+       the next parsing should continue when growing the file
     """
-    index = []
+    # the loop is hot for large logs - headers are unpacked in place without
+    # slicing and timestamps are kept as integers (see LogIndex)
+    unpack_from = _HEADER.unpack_from
     end = len(data)
-    times, prev = divmod(start_time, datetime.timedelta(microseconds=TIMESTAMP_OVERFLOW_STEP))
-    us_offset = times * TIMESTAMP_OVERFLOW_STEP
-    prev_micros = prev.microseconds + prev.seconds * 10**6 + prev.days * 24 * 3600 * 10**6
-    dt = start_time
+    pos = index.end_pos
+    prev_micros = index.end_micros & TIMESTAMP_MASK
+    us_offset = index.end_micros - prev_micros
+    positions, timestamps, streams = [], [], []
+    append_pos, append_micros, append_stream = positions.append, timestamps.append, streams.append
     while pos + 8 <= end:
-        start = pos
-        header = data[pos:pos+8]
-        micros, channel, size = struct.unpack('IHH', header)
+        micros, channel, size = unpack_from(data, pos)
+        next_pos = pos + 8 + size
+        while size == 0xFFFF and next_pos + 8 <= end:
+            micros_, __, size = unpack_from(data, next_pos)
+            assert micros == micros_
+            next_pos += 8 + size
+        if next_pos > end or size == 0xFFFF:  # current packet is not complete
+            break
         if prev_micros > micros:
             us_offset += TIMESTAMP_OVERFLOW_STEP
         prev_micros = micros
-        dt = datetime.timedelta(microseconds=micros+us_offset)
-        pos += 8 + size
-        while size == 0xFFFF and pos + 8 <= end:
-            header = data[pos:pos+8]
-            micros_, channel, size = struct.unpack('IHH', header)
-            assert micros == micros_
-            pos += 8 + size
-        if pos > end: # current packet is not complete
-            index.append((start, dt))
-            return index
-        index.append((start, dt))
-    index.append((pos, dt))
+        append_pos(pos)
+        append_micros(micros + us_offset)
+        append_stream(channel)
+        pos = next_pos
+    index.pos.extend(positions)
+    index.micros.extend(timestamps)
+    index.stream.extend(streams)
+    index.end_pos = pos
+    index.end_micros = prev_micros + us_offset
     return index
 
 
+def _create_index_v2(data, index):
+    "variant of _create_index() for format version 2 - stops at the first invalid record"
+    pos = index.end_pos
+    micros = index.end_micros
+    positions, timestamps, streams = [], [], []
+    while True:
+        next_pos = _valid_record_v2(data, pos)
+        if next_pos is None:  # incomplete or invalid record
+            break
+        micros, channel = _HEADER_V2.unpack_from(data, pos)[:2]
+        positions.append(pos)
+        timestamps.append(micros)
+        streams.append(channel)
+        pos = next_pos
+    index.pos.extend(positions)
+    index.micros.extend(timestamps)
+    index.stream.extend(streams)
+    index.end_pos = pos
+    index.end_micros = micros
+    return index
+
+
+class LogIndex:
+    """
+      Index of complete log records stored in compact arrays:
+        pos    - file offset of the record
+        micros - timestamp in microseconds (with resolved overflows)
+        stream - stream ID
+    """
+    # magic, version, log size, log mtime, number of records, end_pos, end_micros,
+    # CRC32 of the indexed data tail (identifies the content, the log may only grow)
+    FILE_HEADER = struct.Struct('<4sIQqQQqI')
+    FILE_MAGIC = b'PyrI'
+    FILE_VERSION = 2
+    TAIL_SIZE = 4096  # bytes before end_pos covered by the CRC
+
+    def __init__(self, start_pos=4+12):
+        self.pos = array('Q')
+        self.micros = array('q')
+        self.stream = array('H')
+        self.end_pos = start_pos
+        self.end_micros = 0
+        self._by_stream = {}  # stream ID -> array of record indices
+        self._by_stream_size = 0  # number of records already sorted into _by_stream
+
+    def __len__(self):
+        return len(self.pos)
+
+    def stream_records(self, stream_id):
+        "return array of indices of all records of given stream"
+        if self._by_stream_size < len(self):
+            by_stream = self._by_stream
+            for i in range(self._by_stream_size, len(self)):
+                stream = self.stream[i]
+                if stream not in by_stream:
+                    by_stream[stream] = array('Q')
+                by_stream[stream].append(i)
+            self._by_stream_size = len(self)
+        return self._by_stream.get(stream_id, array('Q'))
+
+    def update(self, data):
+        "index new records, return True if anything was added"
+        size = len(self)
+        if data[:4] == LOG_MAGIC[2]:
+            _create_index_v2(data, self)
+        else:
+            _create_index(data, self)
+        return len(self) > size
+
+    def _tail_crc(self, data, end_pos):
+        return zlib.crc32(data[max(0, end_pos - self.TAIL_SIZE):end_pos])
+
+    def save(self, filename, data, log_mtime):
+        "store index of log data (bytes-like, i.e. mmap) into sidecar file"
+        with open(filename, 'wb') as f:
+            f.write(self.FILE_HEADER.pack(self.FILE_MAGIC, self.FILE_VERSION,
+                    len(data), log_mtime, len(self), self.end_pos, self.end_micros,
+                    self._tail_crc(data, self.end_pos)))
+            f.write(data[:4+12])
+            f.write(self.pos.tobytes())
+            f.write(self.micros.tobytes())
+            f.write(self.stream.tobytes())
+
+    @classmethod
+    def load(cls, filename, data, log_mtime):
+        """return index stored in sidecar file or None if the file is missing
+           or does not match the log data (the log may only grow in the meantime)
+        """
+        log_header, log_size = data[:4+12], len(data)
+        try:
+            with open(filename, 'rb') as f:
+                buf = f.read()
+        except OSError:
+            return None
+        header_size = cls.FILE_HEADER.size
+        if len(buf) < header_size + len(log_header):
+            return None
+        magic, version, size, mtime, count, end_pos, end_micros, tail_crc = cls.FILE_HEADER.unpack_from(buf)
+        if magic != cls.FILE_MAGIC or version != cls.FILE_VERSION:
+            return None
+        pos = header_size + len(log_header)
+        if buf[header_size:pos] != log_header:
+            return None  # different log
+        if size > log_size or (size == log_size and mtime != log_mtime):
+            return None  # log was modified
+        index = cls()
+        if end_pos > log_size or index._tail_crc(data, end_pos) != tail_crc:
+            return None  # different content (i.e. rewritten by a tool)
+        for arr in [index.pos, index.micros, index.stream]:
+            arr_size = count * arr.itemsize
+            if pos + arr_size > len(buf):
+                return None  # truncated index file
+            arr.frombytes(buf[pos:pos + arr_size])
+            pos += arr_size
+        index.end_pos = end_pos
+        index.end_micros = end_micros
+        return index
+
+
 class LogIndexedReader:
-    def __init__(self, filepath):
+    """
+      Random access to log records via memory mapped file. The index is
+      cached in sidecar file <filepath>.idx so that next opening of the same
+      (or grown) log is fast.
+      Segmented log is opened as one log - every segment has its own reader
+      and the positions in the common index refer to segment and file offset.
+    """
+    def __init__(self, filepath, index_file=True):
         self.filepath = filepath
+        self.index_filepath = filepath + INDEX_FILE_EXT if index_file else None
+        self.compressed = {}  # stream ID -> codec name
+        self._compressed_info_size = 0  # number of already parsed info records
+        self._watcher = None  # FileWatcher used by wait()
 
     def __enter__(self):
+        self.segments = read_manifest(self.filepath)
+        if self.segments is not None:
+            self.readers = []  # readers of individual segments
+            self._indexed = []  # number of segment records already in common index
+            self.index = LogIndex()
+            self._add_segments()
+            return self
         self.fd = os.open(self.filepath, os.O_RDONLY)
         self.data = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
-        assert self.data[0:4] == b'Pyr\x00', self.data[0:4]
+        self.version = _file_version(self.data[0:4])
         start_time = datetime.datetime(*struct.unpack('HBBBBBI', self.data[4:4+12]))
-        self.index = _create_index(self.data, 4+12)
-        assert self.index[-1][0] <= len(self.data), (self.index[-1][0], len(self.data))
+        self.index = None
+        if self.index_filepath is not None:
+            self.index = LogIndex.load(self.index_filepath, self.data, self._mtime())
+        if self.index is None:
+            self.index = LogIndex()
+            self.index_modified = True
+        else:
+            self.index_modified = False
+        if self.index.update(self.data):
+            self.index_modified = True
+        assert self.index.end_pos <= len(self.data), (self.index.end_pos, len(self.data))
+        self._save_index()
         return self
 
     def __exit__(self, *args):
-        self.data.close()
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+        if self.segments is not None:
+            for reader in self.readers:
+                reader.__exit__(*args)
+            return
+        self._save_index()
+        self._close_data()
         os.close(self.fd)
 
-    def __getitem__(self, index):
-        if abs(index) >= len(self):
+    def _add_segments(self):
+        "open new segments listed in the manifest and add their records to the index"
+        for k in range(len(self.readers), len(self.segments)):
+            reader = LogIndexedReader(self.segments[k][0], index_file=self.index_filepath is not None)
+            self.readers.append(reader.__enter__())
+            self._indexed.append(0)
+            self._extend_index(k)
+
+    def _extend_index(self, k):
+        "add new records of k-th segment to the common index"
+        index, segment_index = self.index, self.readers[k].index
+        __, offset, skip = self.segments[k]
+        first = max(skip, self._indexed[k])
+        base = k << SEGMENT_SHIFT
+        index.pos.extend(base | pos for pos in segment_index.pos[first:])
+        index.micros.extend(micros + offset for micros in segment_index.micros[first:])
+        index.stream.extend(segment_index.stream[first:])
+        index.end_pos = base | segment_index.end_pos
+        index.end_micros = segment_index.end_micros + offset
+        self._indexed[k] = len(segment_index)
+
+    def _close_data(self):
+        try:
+            self.data.close()
+        except BufferError:
+            pass  # memoryviews from view() still exist - unmapped when released
+
+    def _mtime(self):
+        return os.fstat(self.fd).st_mtime_ns
+
+    def _save_index(self):
+        if self.index_filepath is None or not self.index_modified:
+            return
+        try:
+            self.index.save(self.index_filepath, self.data, self._mtime())
+            self.index_modified = False
+        except OSError as e:
+            logging.warning('Cannot save index file %s: %s' % (self.index_filepath, e))
+
+    def _record_range(self, index):
+        "return (index, reader of the segment, start, end) of the record"
+        positions = self.index.pos
+        count = len(positions)
+        if abs(index) > count or index == count:
             raise IndexError("log index {} out of range".format(index))
-        assert index < len(self)
-        a = self.data[self.index[index][0]:self.index[index+1][0]]
-        pos = 0
-        data = bytes()
-        while True:
-            micros, channel, size = struct.unpack('IHH', a[pos:pos+8])
-            pos += 8
-            data += a[pos:pos+size]
-            pos += size
-            if size < 0xFFFF:
-                break
-        dt = self.index[index][1]
+        if index < 0:
+            index += count
+        start = positions[index]
+        end = positions[index + 1] if index + 1 < count else self.index.end_pos
+        if self.segments is None:
+            return index, self, start, end
+        reader = self.readers[start >> SEGMENT_SHIFT]
+        if end >> SEGMENT_SHIFT != start >> SEGMENT_SHIFT:
+            end = reader.index.end_pos  # the last record of the segment
+        return index, reader, start & SEGMENT_POS_MASK, end & SEGMENT_POS_MASK
+
+    def _chunks(self, data, start, end):
+        "yield (offset, size) of data chunks of record stored in data[start:end]"
+        pos = start
+        while pos < end:
+            size = _HEADER.unpack_from(data, pos)[2]
+            yield pos + 8, size
+            pos += 8 + size
+
+    def __getitem__(self, index):
+        index, reader, start, end = self._record_range(index)
+        mapped = reader.data
+        __, channel, size = _HEADER.unpack_from(mapped, start)
+        if reader.version == 2:
+            channel = _HEADER_V2.unpack_from(mapped, start)[1]
+            data = mapped[start + _HEADER_V2.size:end]
+        elif size < 0xFFFF:
+            data = mapped[start + 8:end]
+        else:
+            with memoryview(mapped) as buf:
+                data = b''.join([buf[pos:pos + size] for pos, size in self._chunks(mapped, start, end)])
+        if channel != INFO_STREAM_ID and channel in self._compressed_streams():
+            data = _decompress(data)
+        dt = datetime.timedelta(microseconds=self.index.micros[index])
         return dt, channel, data
 
+    def _compressed_streams(self):
+        info = self.index.stream_records(INFO_STREAM_ID)
+        for k in range(self._compressed_info_size, len(info)):
+            _parse_compress_info(self[info[k]][2], self.compressed)
+        self._compressed_info_size = len(info)
+        return self.compressed
+
+    def view(self, index, decompress=True):
+        """zero-copy variant of reader[index] - data are returned as memoryview
+           of the mapped file (or as bytearray for records split into several
+           chunks) and they are valid only until the next grow()
+           (records of compressed streams are returned decompressed as bytes
+           unless decompress=False, i.e. for raw copy into another log)
+        """
+        index, reader, start, end = self._record_range(index)
+        mapped = reader.data
+        __, channel, size = _HEADER.unpack_from(mapped, start)
+        if reader.version == 2:
+            channel = _HEADER_V2.unpack_from(mapped, start)[1]
+            data = memoryview(mapped)[start + _HEADER_V2.size:end]
+        elif size < 0xFFFF:
+            data = memoryview(mapped)[start + 8:end]
+        else:
+            full_chunks = (end - start - 8) // (0xFFFF + 8)
+            data = bytearray(end - start - 8 * (full_chunks + 1))
+            offset = 0
+            with memoryview(mapped) as buf:
+                for pos, size in self._chunks(mapped, start, end):
+                    data[offset:offset + size] = buf[pos:pos + size]
+                    offset += size
+        if decompress and channel != INFO_STREAM_ID and channel in self._compressed_streams():
+            data = _decompress(data)
+        dt = datetime.timedelta(microseconds=self.index.micros[index])
+        return dt, channel, data
+
+    def seek(self, timestamp):
+        "return position of the first record at or after given time"
+        micros = timestamp // datetime.timedelta(microseconds=1)
+        return bisect_left(self.index.micros, micros)
+
+    def stream_names(self):
+        names = []
+        for i in self.index.stream_records(INFO_STREAM_ID):
+            data = self[i][2]
+            if data.startswith(b"{'names'"):
+                names = literal_eval(data.decode('ascii'))['names']
+        return names
+
+    def stream(self, stream):
+        "return view of single stream given by ID or name"
+        try:
+            stream_id = int(stream)
+        except ValueError:
+            stream_id = self.stream_names().index(stream) + 1
+        return LogStreamView(self, stream_id)
+
     def grow(self):
+        if self.segments is not None:
+            last = len(self.readers) - 1
+            self.readers[last].grow()
+            self._extend_index(last)
+            self.segments = read_manifest(self.filepath)
+            self._add_segments()
+            return len(self.index)
         if (len(self.data) < self.data.size()):
-            self.data.close()
+            self._close_data()
             self.data = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
-            index = _create_index(self.data, self.index[-1][0], self.index[-1][1])
-            self.index[-1:] = index
-        return len(self.index)-1
+            if self.index.update(self.data):
+                self.index_modified = True
+        return len(self.index)
+
+    def wait(self, timeout=None):
+        """wait until new records are appended to the log (or timeout),
+           return the number of records
+        """
+        size = len(self)
+        if self._watcher is None:
+            self._watcher = FileWatcher(self.filepath)  # created before grow() - no append is missed
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.grow() == size:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if (remaining is not None and remaining <= 0) or not self._watcher.wait(remaining):
+                break
+        return len(self)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class LogStreamView:
+    """
+      Records of single stream of LogIndexedReader, i.e. view[k] is
+      k-th record of the stream. Positions are indices to the whole log.
+    """
+    def __init__(self, reader, stream_id):
+        self.reader = reader
+        self.stream_id = stream_id
+
+    @property
+    def records(self):
+        return self.reader.index.stream_records(self.stream_id)
 
     def __len__(self):
-        return len(self.index)-1
+        return len(self.records)
+
+    def __getitem__(self, k):
+        return self.reader[self.records[k]]
+
+    def position(self, k):
+        "position of k-th stream record in the whole log"
+        return self.records[k]
+
+    def next_after(self, pos):
+        "position of the first stream record after pos or None"
+        records = self.records
+        k = bisect_right(records, pos)
+        return records[k] if k < len(records) else None
+
+    def prev_before(self, pos):
+        "position of the last stream record before pos or None"
+        records = self.records
+        k = bisect_left(records, pos)
+        return records[k - 1] if k > 0 else None
+
+
+class LogMetadata:
+    """
+      Log header and info records stored at the beginning of the log:
+        start_time - absolute time of the log start
+        note       - the first info record (original arguments)
+        config     - the second info record parsed as dictionary (or None),
+                     shared by all users of cached metadata - do not modify
+        names      - stream names
+      Only the info records before the first record of other stream are
+      read (all names are defined BEFORE data on other channels).
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.info = []  # raw info records
+        segments = read_manifest(filename)
+        if segments is not None:
+            filename = segments[0][0]  # the first segment of segmented log
+        with open(filename, 'rb') as f:
+            version = _file_version(f.read(4))
+            self.start_time = datetime.datetime(*struct.unpack('HBBBBBI', f.read(12)))
+            header_struct = _HEADER if version == 1 else _HEADER_V2
+            while True:
+                header = f.read(header_struct.size)
+                if len(header) < header_struct.size:
+                    break
+                __, stream_id, size = header_struct.unpack(header)[:3]
+                if stream_id != INFO_STREAM_ID:
+                    break
+                parts = [f.read(size)]
+                while version == 1 and size == 0xFFFF:
+                    header = f.read(8)
+                    if len(header) < 8:
+                        break
+                    size = _HEADER.unpack(header)[2]
+                    parts.append(f.read(size))
+                self.info.append(b''.join(parts))
+
+        self.note = self.info[0].decode('utf-8', errors='replace') if len(self.info) > 0 else None
+        self.config = None
+        if len(self.info) > 1:
+            try:
+                self.config = literal_eval(self.info[1].decode('ascii'))
+            except (ValueError, SyntaxError, UnicodeDecodeError):
+                pass  # not a config record
+        self.names = []
+        for data in self.info:
+            if data.startswith(b"{'names'"):
+                self.names = literal_eval(data.decode('ascii'))['names']
+
+
+@lru_cache(maxsize=METADATA_CACHE_SIZE)
+def _cached_metadata(filename, size, mtime):
+    return LogMetadata(filename)
+
+
+def log_metadata(filename):
+    "return LogMetadata cached per file (until the file is modified)"
+    stat = os.stat(filename)
+    return _cached_metadata(os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
 
 
 def lookup_stream_names(filename):
-    names = []
-    with LogReader(filename) as log:
-        for __, channel, line in log:
-            # optimization - all names are defined BEFORE other data on other channels
-            if channel != 0:
-                break
-            if b'Errno' in line:
-                continue
-            d = literal_eval(line.decode('ascii'))
-            if 'names' in d:
-                names = d['names']
-    return names
+    return list(log_metadata(filename).names)
 
 
 def lookup_stream_id(filename, stream_name):
@@ -297,22 +1167,115 @@ def lookup_stream_id(filename, stream_name):
     names = lookup_stream_names(filename)
     return names.index(stream_name) + 1
 
-def calculate_stat(filename):
+def _scan_range(filename, first, last, map_fn, only_stream_id):
+    "process records first..last-1 in worker process"
+    with LogIndexedReader(filename) as log:
+        if only_stream_id is None:
+            positions = range(first, last)
+        else:
+            positions = []
+            for stream_id in only_stream_id:
+                records = log.index.stream_records(stream_id)
+                positions.extend(records[bisect_left(records, first):bisect_left(records, last)])
+            positions.sort()
+        return map_fn(log[k] for k in positions)
+
+
+def scan_log(filename, map_fn, reduce_fn, jobs=None, only_stream_id=None):
+    """
+      Parallel map/reduce over single log. The log is split into parts of
+      similar size aligned to record boundaries (via the index), each part
+      is processed by map_fn(iterator of (timestamp, stream_id, data)) in
+      separate process and the partial results are merged in order by
+      reduce_fn(a, b). Both functions have to be picklable (module level).
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import reduce
+
+    if only_stream_id is not None:
+        try:
+            only_stream_id = list(only_stream_id)
+        except TypeError:
+            only_stream_id = [only_stream_id]
+
+    jobs = jobs or os.cpu_count()
+    with LogIndexedReader(filename) as log:  # the index is shared via the sidecar file
+        positions = log.index.pos
+        if log.segments is None:
+            segment_sizes = [log.index.end_pos]
+        else:
+            segment_sizes = [reader.index.end_pos for reader in log.readers]
+        total = sum(segment_sizes)
+        bounds = []
+        for i in range(jobs):
+            # byte offset in the whole log -> position (segment << SEGMENT_SHIFT | file offset)
+            offset, segment = total * i // jobs, 0
+            while offset >= segment_sizes[segment] and segment + 1 < len(segment_sizes):
+                offset -= segment_sizes[segment]
+                segment += 1
+            bounds.append(bisect_left(positions, segment << SEGMENT_SHIFT | offset))
+        bounds.append(len(log))
+    ranges = [(first, last) for first, last in zip(bounds[:-1], bounds[1:]) if first < last]
+    if len(ranges) == 0:
+        ranges = [(0, 0)]
+    with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [executor.submit(_scan_range, filename, first, last, map_fn, only_stream_id)
+                   for first, last in ranges]
+        return reduce(reduce_fn, [f.result() for f in futures])
+
+
+def scan_logs(filenames, fn, jobs=None):
+    "process many logs by fn(filename) with bounded pool, return list of results"
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(fn, filenames))
+
+
+def _stat_map(records):
     from collections import defaultdict
     stat = defaultdict(int)
     count = defaultdict(int)
-    with LogReader(filename) as log:
-        for timestamp, stream_id, data in log:
-            stat[stream_id] += len(data)
-            count[stream_id] += 1
+    timestamp = datetime.timedelta()
+    for timestamp, stream_id, data in records:
+        stat[stream_id] += len(data)
+        count[stream_id] += 1
     return stat, count, timestamp
 
+
+def _stat_reduce(a, b):
+    stat, count, timestamp = a
+    for stream_id, size in b[0].items():
+        stat[stream_id] += size
+    for stream_id, num in b[1].items():
+        count[stream_id] += num
+    return stat, count, max(timestamp, b[2])
+
+
+def calculate_stat(filename, jobs=1):
+    if jobs > 1:
+        return scan_log(filename, _stat_map, _stat_reduce, jobs=jobs)
+    with LogReader(filename) as log:
+        return _stat_map(log)
+
+def lookup_latency(filename):
+    "collect queue latency reports -> {link name: (LatencyHistogram, measured period in sec)}"
+    latency = {}
+    with LogReader(filename, only_stream_id=INFO_STREAM_ID) as log:
+        for __, __, data in log:
+            if not data.startswith(b"{'latency'"):
+                continue
+            for link, report in literal_eval(data.decode('ascii'))['latency'].items():
+                hist, period = latency.get(link, (LatencyHistogram(), 0.0))
+                hist.merge(LatencyHistogram.from_dict(report))
+                latency[link] = (hist, period + report['period'])
+    return latency
+
+
 def main():
     import argparse
     import sys
 
-    from osgar.lib.serialize import deserialize
-
     parser = argparse.ArgumentParser(description='Extract data from log')
     parser.add_argument('logfile', help='filename of stored file')
     parser.add_argument('--stream', help='stream ID or name', default=None, nargs='*')
@@ -320,8 +1283,14 @@ def main():
     parser.add_argument('--times', help='display timestamps', action='store_true')
     parser.add_argument('--sec', help='display timestamps in seconds', action='store_true')
     parser.add_argument('--stat', help='output only message statistics', action='store_true')
+    parser.add_argument('--jobs', '-j', help='number of processes for --stat', type=int, default=1)
+    parser.add_argument('--latency', help='output only bus queue latencies', action='store_true')
     parser.add_argument('--raw', help='skip data deserialization',
                         action='store_true')
+    parser.add_argument('--start-time-sec', '-s', help='start reading at given time (sec)',
+                        type=float, default=None)
+    parser.add_argument('--end-time-sec', '-e', help='stop reading at given time (sec)',
+                        type=float, default=None)
     args = parser.parse_args()
 
     if args.list_names:
@@ -329,7 +1298,7 @@ def main():
         sys.exit()
 
     if args.stat:
-        stat, count, timestamp = calculate_stat(args.logfile)
+        stat, count, timestamp = calculate_stat(args.logfile, jobs=args.jobs)
         seconds = timestamp.total_seconds()
         names = ['sys'] + lookup_stream_names(args.logfile)
         column_width = max([len(x) for x in names])
@@ -340,6 +1309,16 @@ def main():
         print('\nTotal time', timestamp)
         sys.exit()
 
+    if args.latency:
+        latency = lookup_latency(args.logfile)
+        column_width = max([len(x) for x in latency] + [4])
+        print('link'.rjust(column_width), '   count |   rate | p50 [ms] | p99 [ms] | max [ms] | depth')
+        for link, (hist, period) in sorted(latency.items()):
+            print(link.rjust(column_width), '%8d | %5.1fHz | %8.3f | %8.3f | %8.3f | %5d' % (
+                  hist.count, hist.count/period if period > 0 else 0,
+                  hist.percentile(50)/1000, hist.percentile(99)/1000, hist.max/1000, hist.depth))
+        sys.exit()
+
     if args.stream is None:
         only_stream = None
     else:
@@ -347,14 +1326,20 @@ def main():
         for name in args.stream:
             only_stream.append(lookup_stream_id(args.logfile, name))
 
-    with LogReader(args.logfile, only_stream_id=only_stream) as log:
-        for timestamp, stream_id, data in log:
-            if not args.raw and stream_id != 0:
-                data = deserialize(data)
+    start, end = None, None
+    if args.start_time_sec is not None:
+        start = datetime.timedelta(seconds=args.start_time_sec)
+    if args.end_time_sec is not None:
+        end = datetime.timedelta(seconds=args.end_time_sec)
+
+    with LogReader(args.logfile, only_stream_id=only_stream, start=start, end=end,
+                   lazy=True) as log:
+        for record in log:
+            data = record.raw if args.raw else record.data
             if args.times:
-                print(timestamp, stream_id, data)
+                print(record.timestamp, record.stream_id, data)
             elif args.sec:
-                print(timestamp.total_seconds(), stream_id, data)
+                print(record.timestamp.total_seconds(), record.stream_id, data)
             else:
                 sys.stdout.buffer.write(data)
 
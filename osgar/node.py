@@ -44,4 +44,50 @@ class Node(Thread):
     def request_stop(self):
         self.bus.shutdown()
 
+
+class AsyncNode:
+    """
+       Parent class for asyncio based nodes - all of them share one event
+       loop (AsyncRuntime of AsyncBusHandler). The interface for the
+       recorder is the same as for thread based Node.
+    """
+    def __init__(self, config, bus):
+        self.bus = bus
+        self.time = None
+        self._future = None
+
+    def publish(self, channel, data):
+        return self.bus.publish(channel, data)
+
+    async def listen(self):
+        return await self.bus.listen()
+
+    async def sleep(self, secs):
+        await self.bus.sleep(secs)
+
+    def is_alive(self):
+        return self.bus.is_alive()
+
+    async def update(self):
+        timestamp, channel, data = await self.bus.listen()
+        self.time = timestamp
+        setattr(self, channel, data)
+        return channel
+
+    async def run(self):
+        try:
+            while True:
+                await self.update()
+        except BusShutdownException:
+            pass
+
+    def start(self):
+        self._future = self.bus.runtime.submit(self.run())
+
+    def request_stop(self):
+        self.bus.shutdown()
+
+    def join(self, timeout=None):
+        self._future.result(timeout)
+
 # vim: expandtab sw=4 ts=4
@@ -0,0 +1,193 @@
+"""
+  Run node in a separate process
+
+  The node communicates with the main process via two shared memory rings.
+  The main process keeps BusHandler of the node, so it remains the only
+  logger and timestamp authority - the log is the same as for node running
+  in a thread.
+  Requires Python 3.8+ (multiprocessing.shared_memory).
+"""
+import time
+import struct
+import datetime
+import multiprocessing
+from threading import Thread, Lock
+
+from osgar.bus import BusQueue, BusShutdownException, Message
+from osgar.lib.config import get_class_by_name
+from osgar.lib.ring import SharedRing, RingClosed
+from osgar.lib.serialize import serialize, deserialize
+
+DEFAULT_RING_SIZE = 16 * 1024 * 1024
+
+# frame: kind, timestamp in microseconds, channel name length, channel name, data
+_FRAME_HEADER = struct.Struct('<BqH')
+_DATA, _SLOT, _ERROR, _SHUTDOWN = range(4)
+
+
+def _put_frame(ring, kind, timestamp=None, channel='', data=b''):
+    micros = 0 if timestamp is None else timestamp // datetime.timedelta(microseconds=1)
+    channel = channel.encode('utf-8')
+    ring.put(_FRAME_HEADER.pack(kind, micros, len(channel)), channel, data)
+
+
+def _parse_frame(view):
+    kind, micros, channel_size = _FRAME_HEADER.unpack_from(view)
+    start = _FRAME_HEADER.size
+    channel = bytes(view[start:start + channel_size]).decode('utf-8')
+    return kind, datetime.timedelta(microseconds=micros), channel, view[start + channel_size:]
+
+
+class ProcessNode:
+    """
+      Proxy of the node running in a separate process - it can be used in
+      place of the node (start/request_stop/join and slots)
+    """
+    def __init__(self, driver, config, bus, ring_size=DEFAULT_RING_SIZE):
+        assert driver != 'application', 'application has to run in the main process'
+        self.bus = bus
+        ctx = multiprocessing.get_context('spawn')
+        self._input = SharedRing(ring_size, ctx)
+        self._output = SharedRing(ring_size, ctx)
+        self._input_lock = Lock()  # inputs and slots share one producer
+        start_ns = getattr(bus.logger, 'start_ns', None)
+        self._process = ctx.Process(target=_run_node, daemon=True,
+                                    args=(driver, config, self._input, self._output, start_ns))
+        self._forwarder = Thread(target=self._forward_inputs, daemon=True)
+        self._receiver = Thread(target=self._receive_outputs, daemon=True)
+
+    def __getattr__(self, name):
+        if name.startswith('slot_'):
+            return lambda data: self._send(_SLOT, None, name, serialize(data))
+        raise AttributeError(name)
+
+    def _send(self, kind, timestamp=None, channel='', data=b''):
+        with self._input_lock:
+            _put_frame(self._input, kind, timestamp, channel, data)
+
+    def _forward_inputs(self):
+        try:
+            while True:
+                try:
+                    timestamp, channel, msg = self.bus.listen_message()
+                except BusShutdownException:
+                    self._send(_SHUTDOWN)
+                    break
+                raw = msg.raw if isinstance(msg, Message) else serialize(msg)
+                self._send(_DATA, timestamp, channel, raw)
+        except RingClosed:
+            pass  # the process terminated
+
+    def _receive_outputs(self):
+        while True:
+            view = self._output.get()
+            if view is None:
+                break
+            kind, __, channel, data = _parse_frame(view)
+            if kind == _DATA:
+                # one copy from shared memory, the log is written from this buffer
+                self.bus.publish(channel, Message.from_raw(bytes(data)))
+            elif kind == _ERROR:
+                self.bus.report_error(bytes(data).decode('utf-8'))
+            data.release()
+            self._output.release()
+
+    def start(self):
+        self._process.start()
+        self._forwarder.start()
+        self._receiver.start()
+
+    def request_stop(self):
+        self.bus.shutdown()
+
+    def is_alive(self):
+        return self._process.is_alive()
+
+    def join(self, timeout=None):
+        self._process.join(timeout)
+        self._input.close()  # in the case the process crashed
+        self._output.close()
+        self._forwarder.join()
+        self._receiver.join()
+        self._input.detach()
+        self._output.detach()
+
+
+class ProcessBus:
+    """
+      BusHandler replacement inside of the node process. Published timestamps
+      are only estimated from the log start (the monotonic clock is shared
+      by processes), the real ones are assigned by the main process.
+    """
+    def __init__(self, output, start_ns):
+        self.queue = BusQueue()
+        self._output = output
+        self._output_lock = Lock()
+        self._start_ns = start_ns
+        self._is_alive = True
+
+    def _send(self, kind, channel='', data=b''):
+        with self._output_lock:
+            _put_frame(self._output, kind, None, channel, data)
+
+    def publish(self, channel, data):
+        raw = data.raw if isinstance(data, Message) else serialize(data)
+        self._send(_DATA, channel, raw)
+        if self._start_ns is None:
+            return datetime.timedelta()
+        return datetime.timedelta(microseconds=(time.monotonic_ns() - self._start_ns) // 1000)
+
+    def listen(self):
+        packet = self.queue.get()
+        if packet is None:
+            raise BusShutdownException()
+        return packet
+
+    def sleep(self, secs):
+        time.sleep(secs)
+
+    def is_alive(self):
+        return self._is_alive
+
+    def shutdown(self):
+        self._is_alive = False
+        self.queue.put(None)
+
+    def report_error(self, err):
+        self._send(_ERROR, data=str(err).encode('utf-8'))
+
+
+def _receive_inputs(ring, bus, node):
+    while True:
+        view = ring.get()
+        if view is None:
+            break
+        kind, timestamp, channel, data = _parse_frame(view)
+        if kind == _SHUTDOWN:
+            node.request_stop()
+        elif kind == _DATA:
+            bus.queue.put((timestamp, channel, deserialize(data)))  # decoded from shared memory
+        elif kind == _SLOT:
+            getattr(node, channel)(deserialize(data))
+        data.release()
+        ring.release()
+        if kind == _SHUTDOWN:
+            break
+
+
+def _run_node(driver, config, input_ring, output_ring, start_ns):
+    "entry point of the node process"
+    try:
+        bus = ProcessBus(output_ring, start_ns)
+        node = get_class_by_name(driver)(config, bus=bus)
+        receiver = Thread(target=_receive_inputs, args=(input_ring, bus, node), daemon=True)
+        node.start()
+        receiver.start()
+        node.join()
+    finally:
+        input_ring.close()
+        output_ring.close()
+        input_ring.detach()
+        output_ring.detach()
+
+# vim: expandtab sw=4 ts=4
@@ -6,41 +6,61 @@ import argparse
 import sys
 import os
 import time
-from queue import Queue
 
 from osgar.logger import LogWriter
 from osgar.lib.config import load, get_class_by_name
-from osgar.bus import BusHandler
+from osgar.bus import BusHandler, AsyncBusHandler, AsyncRuntime
+from osgar.node import AsyncNode
 
 
 class Recorder:
     def __init__(self, config, logger, application=None):
         self.modules = {}
 
+        self.runtime = None  # event loop shared by asyncio nodes, created on demand
+
         que = {}
         for module_name, module_config in config['modules'].items():
             out, slots = {}, {}
             for output_type in module_config['out']:
                 out[output_type] = []
                 slots[output_type] = []
-            bus = BusHandler(logger, out=out, slots=slots, name=module_name)
-            que[module_name] = bus.queue
 
             module_class = module_config['driver']
             if module_class == 'application':
                 assert application is not None  # external application required
+                bus = BusHandler(logger, out=out, slots=slots, name=module_name)
                 module = application(module_config['init'], bus=bus)
+            elif module_config.get('process', False):
+                # CPU intensive node running in a separate process
+                from osgar.process import ProcessNode  # shared memory requires Python 3.8+
+                bus = BusHandler(logger, out=out, slots=slots, name=module_name)
+                module = ProcessNode(module_class, module_config['init'], bus=bus)
             else:
-                module = get_class_by_name(module_class)(module_config['init'], bus=bus)
+                cls = get_class_by_name(module_class)
+                if isinstance(cls, type) and issubclass(cls, AsyncNode):
+                    if self.runtime is None:
+                        self.runtime = AsyncRuntime()
+                    bus = AsyncBusHandler(logger, self.runtime, out=out, slots=slots, name=module_name)
+                else:
+                    bus = BusHandler(logger, out=out, slots=slots, name=module_name)
+                module = cls(module_config['init'], bus=bus)
+            que[module_name] = bus.queue
 
             self.modules[module_name] = module
 
-        for from_module, to_module in config['links']:
+        for link in config['links']:
+            # optional 3rd item is input queue policy, for example {"policy": "latest"}
+            from_module, to_module = link[:2]
             (from_driver, from_name), (to_driver, to_name) = from_module.split('.'), to_module.split('.')
             if to_name.startswith('slot_'):
+                assert len(link) == 2, link  # slots are called directly, no queue
                 self.modules[from_driver].bus.slots[from_name].append(getattr(self.modules[to_driver], to_name))
             else:
-                self.modules[from_driver].bus.out[from_name].append((self.modules[to_driver].bus.queue, to_name))
+                to_bus = self.modules[to_driver].bus
+                if len(link) > 2:
+                    to_bus.queue.set_policy(to_name, **link[2])
+                self.modules[from_driver].bus.out[from_name].append((to_bus.queue, to_name))
 
     def start(self):
         for module in self.modules.values():
@@ -54,28 +74,37 @@ class Recorder:
             module.request_stop()
         for module in self.modules.values():
             module.join()
-
-
-def record(config_filename, log_prefix, duration_sec=None, application=None):
-    log = LogWriter(prefix=log_prefix, note=str(sys.argv))
-    if type(config_filename) == str:
-        config = load(config_filename)
-    else:
-        config = load(*config_filename)
-    log.write(0, bytes(str(config), 'ascii'))  # write configuration
-    recorder = Recorder(config=config['robot'], logger=log, application=application)
-    recorder.start()
-    if application is not None:
-        game = recorder.modules['app']  # TODO nicer reference
-        game.join()  # wait for application termination
-    else:
-        if duration_sec is None:
-            while True:
-                time.sleep(1.0)
+        if self.runtime is not None:
+            self.runtime.stop()
+
+
+def record(config_filename, log_prefix, duration_sec=None, application=None,
+           segment_size=None, segment_duration=None, log_version=1):
+    # records are written to disk by the logger thread in batches
+    log = LogWriter(prefix=log_prefix, note=str(sys.argv), buffered=True,
+                    segment_size=segment_size, segment_duration=segment_duration,
+                    version=log_version)
+    try:
+        if type(config_filename) == str:
+            config = load(config_filename)
+        else:
+            config = load(*config_filename)
+        log.write(0, bytes(str(config), 'ascii'))  # write configuration
+        recorder = Recorder(config=config['robot'], logger=log, application=application)
+        recorder.start()
+        if application is not None:
+            game = recorder.modules['app']  # TODO nicer reference
+            game.join()  # wait for application termination
         else:
-            time.sleep(duration_sec)
+            if duration_sec is None:
+                while True:
+                    time.sleep(1.0)
+            else:
+                time.sleep(duration_sec)
 
-    recorder.finish()
+        recorder.finish()
+    finally:
+        log.close()
 
 
 if __name__ == "__main__":
@@ -84,9 +113,17 @@ if __name__ == "__main__":
     parser.add_argument('config', help='configuration file')
     parser.add_argument('--note', help='add description')
     parser.add_argument('--duration', help='recording duration (sec), default infinite', type=float)
+    parser.add_argument('--segment-size', help='split log into segments of given size (MB)', type=float)
+    parser.add_argument('--segment-duration', help='split log into segments of given duration (sec)',
+                        type=float)
+    parser.add_argument('--log-version', help='log format version (default 1)', type=int,
+                        choices=[1, 2], default=1)
     args = parser.parse_args()
 
     prefix = os.path.basename(args.config).split('.')[0] + '-'
-    record(args.config, log_prefix=prefix, duration_sec=args.duration)
+    segment_size = None if args.segment_size is None else int(args.segment_size * 1000000)
+    record(args.config, log_prefix=prefix, duration_sec=args.duration,
+           segment_size=segment_size, segment_duration=args.segment_duration,
+           log_version=args.log_version)
 
 # vim: expandtab sw=4 ts=4
@@ -5,7 +5,10 @@
 import argparse
 import sys
 import math
-from ast import literal_eval
+import threading
+import traceback
+from copy import deepcopy
+from collections import namedtuple
 from datetime import timedelta
 from queue import Queue
 
@@ -15,20 +18,38 @@ from osgar.lib.config import load as config_load, get_class_by_name
 from osgar.bus import LogBusHandler, LogBusHandlerInputsOnly
 
 
-def replay(args, application=None):
-    log = LogReader(args.logfile, only_stream_id=0)
-    print("original args:", next(log)[-1])  # old arguments
-    config_str = next(log)[-1]
-    config = literal_eval(config_str.decode('ascii'))
+# raw I/O drivers - they have inputs (data sent to the device), but they need
+# the hardware also in replay, their recorded outputs are the inputs of replay
+IO_DRIVERS = {'serial', 'tcp', 'tcpdynamic', 'tcpserver', 'udp', 'http', 'usb', 'replay',
+              'asynctcp', 'asyncudp', 'asynchttp', 'asyncserial'}
+
+
+def recorded_sources(config):
+    "names of modules replaced by their recorded outputs - raw I/O drivers and modules without inputs"
+    modules = config['robot']['modules']
+    with_inputs = set(edge_to.split('.')[0] for __, edge_to, *__ in config['robot']['links'])
+    return set(module for module, module_config in modules.items()
+               if module_config['driver'] in IO_DRIVERS or module not in with_inputs)
+
+
+def _load_config(args):
+    metadata = logger.log_metadata(args.logfile)
+    print("original args:", metadata.note)  # old arguments
     if args.config is not None:
         config = config_load(*args.config)
+    else:
+        config = deepcopy(metadata.config)  # modules may modify their init
 
-    names = logger.lookup_stream_names(args.logfile)
+    names = getattr(args, 'names', None)  # optionally cached by caller
+    if names is None:
+        names = metadata.names
     print("stream names:")
     for name in names:
         print(" ", name)
-    
-    module = args.module
+    return config, names
+
+
+def _create_module(args, config, names, module, application):
     assert module in config['robot']['modules'], (module, list(config['robot']['modules'].keys()))
     module_config = config['robot']['modules'][module]
 
@@ -38,7 +59,7 @@ def replay(args, application=None):
     print("outputs:", output_names)
 
     inputs = {}
-    for edge_from, edge_to in config['robot']['links']:
+    for edge_from, edge_to, *__ in config['robot']['links']:
         if edge_to.split('.')[0] == module:
             inputs[1 + names.index(edge_from)] = edge_to.split('.')[1]
 
@@ -63,22 +84,128 @@ def replay(args, application=None):
     return module_instance
 
 
+def replay(args, application=None):
+    config, names = _load_config(args)
+    return _create_module(args, config, names, args.module, application)
+
+
+def replay_graph(args, application=None):
+    """
+      Create all modules given by args.module (list of names, 'all' for all
+      but recorded sources, see recorded_sources()). Every module has its own LogBusHandler, so it
+      gets recorded inputs and its outputs are checked against the log.
+      Returns {module name: instance}.
+    """
+    config, names = _load_config(args)
+    modules = config['robot']['modules']
+    sources = recorded_sources(config)
+    selected = []
+    for name in args.module:
+        if name == 'all':
+            for module, module_config in modules.items():
+                if module in sources:
+                    continue
+                if module_config['driver'] == 'application' and application is None:
+                    print("skipping", module, "(application not available)")
+                    continue
+                selected.append(module)
+        else:
+            selected.append(name)
+    selected = sorted(set(selected), key=list(modules.keys()).index)
+    instances = {}
+    for module in selected:
+        print("module:", module)
+        instances[module] = _create_module(args, config, names, module, application)
+    return instances
+
+
+# arguments of threading.excepthook (Python 3.8+)
+_ExceptHookArgs = namedtuple('_ExceptHookArgs', 'exc_type exc_value exc_traceback thread')
+
+
+def _catch_errors(run, hook):
+    "wrap run() of thread for Python < 3.8 without threading.excepthook"
+    def wrapper():
+        try:
+            run()
+        except Exception:
+            hook(_ExceptHookArgs(*sys.exc_info(), threading.current_thread()))
+    return wrapper
+
+
+def run_graph(instances):
+    """
+      Run replayed modules in parallel (no real time, the clock is given by
+      the log) and wait for all of them.
+      Returns {module name: exception or None}, where the end of log is
+      a success.
+    """
+    errors = dict((name, None) for name in instances)
+    names = {}  # thread -> module name
+    raised = []
+    prev_hook = getattr(threading, 'excepthook', None)
+
+    def hook(exc_args):
+        if not issubclass(exc_args.exc_type, StopIteration):
+            raised.append((exc_args.thread, exc_args.exc_value))
+            traceback.print_exception(exc_args.exc_type, exc_args.exc_value, exc_args.exc_traceback)
+
+    if prev_hook is not None:
+        threading.excepthook = hook
+    else:  # Python < 3.8 - only errors of node threads are collected
+        for instance in instances.values():
+            if isinstance(instance, threading.Thread):
+                instance.run = _catch_errors(instance.run, hook)
+    try:
+        for name, instance in instances.items():
+            names[instance] = name  # thread based node
+            running = set(threading.enumerate())
+            instance.start()
+            for thread in set(threading.enumerate()) - running:
+                names[thread] = name
+        for instance in instances.values():
+            instance.join()
+    finally:
+        if prev_hook is not None:
+            threading.excepthook = prev_hook
+    for thread, exc in raised:
+        if thread in names:
+            errors[names[thread]] = exc
+    return errors
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Replay module from log')
     parser.add_argument('logfile', help='recorded log file')
     parser.add_argument('--force', '-F', dest='force', action='store_true', help='force replay even for failing output asserts')
     parser.add_argument('--config', nargs='+', help='force alternative configuration file')
-    parser.add_argument('--module', help='module name for analysis', required=True)  # TODO default "all"
+    parser.add_argument('--module', nargs='+', default=['all'],
+                        help='module name(s) for analysis, "all" for all but drivers and modules without inputs (default)')
     parser.add_argument('--verbose', '-v', help="verbose mode", action='store_true')
     args = parser.parse_args()
 
-    module_instance = replay(args)
-    module_instance.verbose = args.verbose
+    if len(args.module) == 1 and args.module[0] != 'all':
+        args.module = args.module[0]
+        module_instance = replay(args)
+        module_instance.verbose = args.verbose
 
-    module_instance.start()
-    # now wait until the module is alive
-    module_instance.join()
-    if not args.force:
-        print("maximum delay:", module_instance.bus.max_delay)
+        module_instance.start()
+        # now wait until the module is alive
+        module_instance.join()
+        if not args.force:
+            print("maximum delay:", module_instance.bus.max_delay)
+    else:
+        instances = replay_graph(args)
+        for instance in instances.values():
+            instance.verbose = args.verbose
+        errors = run_graph(instances)
+        print("\nreplay summary:")
+        for name, instance in instances.items():
+            status = 'OK' if errors[name] is None else 'FAILED %r' % errors[name]
+            if not args.force:
+                status += ', maximum delay: %s' % instance.bus.max_delay
+            print(" ", name, status)
+        if any(err is not None for err in errors.values()):
+            sys.exit(1)
 
 # vim: expandtab sw=4 ts=4
@@ -1,11 +1,17 @@
 import unittest
-from unittest.mock import MagicMock
+import os
+import time
+from contextlib import ExitStack
+from unittest.mock import MagicMock, patch, call
+from ast import literal_eval
 from queue import Queue
 from datetime import timedelta
+from threading import Thread, Event, Barrier
 
-from osgar.bus import (BusHandler, BusShutdownException,
+from osgar.bus import (BusHandler, BusShutdownException, Message, BusQueue,
                        LogBusHandler, LogBusHandlerInputsOnly)
 
+from osgar.logger import LogWriter, LogReader
 from osgar.lib.serialize import serialize, deserialize
 
 
@@ -46,6 +52,37 @@ class BusHandlerTest(unittest.TestCase):
 
         self.assertEqual(handler2.listen(), (123, 42, b"Hello!"))
 
+    def test_shared_message(self):
+        logger = MagicMock()
+        logger.register = MagicMock(return_value=1)
+        logger.write = MagicMock(return_value=123)
+        handler2 = BusHandler(logger)
+        handler3 = BusHandler(logger)
+        handler1 = BusHandler(logger, out={'scan':[(handler2.queue, 'scan'), (handler3.queue, 'scan')]})
+        scan = [1000, 1001, 1002]
+        handler1.publish('scan', scan)
+        logger.write.assert_called_once_with(1, serialize(scan))
+
+        dt2, channel2, msg2 = handler2.listen_message()
+        dt3, channel3, msg3 = handler3.listen_message()
+        self.assertIs(msg2, msg3)  # no copies
+        self.assertIs(msg2.data, scan)
+        self.assertEqual(msg2.raw, serialize(scan))
+        with self.assertRaises(AttributeError):
+            msg2.data = None
+
+        # re-publish of received envelope reuses the bytes
+        handler4 = BusHandler(logger, out={'scan':[]})
+        with unittest.mock.patch('osgar.bus.serialize') as ser:
+            handler4.publish('scan', msg2)
+            ser.assert_not_called()
+
+    def test_message_from_raw(self):
+        msg = Message.from_raw(serialize([1, 2]))
+        self.assertEqual(msg.raw, b'\x92\x01\x02')
+        self.assertEqual(msg.data, [1, 2])
+        self.assertIs(msg.data, msg.data)  # decoded once
+
     def test_shutdown(self):
         logger = MagicMock()
         handler = BusHandler(logger)
@@ -127,6 +164,130 @@ class BusHandlerTest(unittest.TestCase):
         bus = BusHandler(logger, out={'stdout':[]})
         self.assertEqual(bus.publish('stdout', 'hello world!'), timedelta(123))
 
+    def test_slow_slot_does_not_block_others(self):
+        logger = MagicMock()
+        logger.register = MagicMock(return_value=1)
+        in_slot, release = Event(), Event()
+
+        def slow_slot(data):
+            in_slot.set()
+            release.wait()
+
+        bus1 = BusHandler(logger, name='slow', out={'raw':[]}, slots={'raw':[slow_slot]})
+        receiver = BusHandler(logger)
+        bus2 = BusHandler(logger, name='fast', out={'raw':[(receiver.queue, 'raw')]})
+        logger.write = MagicMock(return_value=timedelta(1))
+
+        thread = Thread(target=bus1.publish, args=('raw', b'1'))
+        thread.start()
+        self.assertTrue(in_slot.wait(1))
+        bus2.publish('raw', b'2')  # would dead-lock with global lock
+        self.assertEqual(receiver.listen(), (timedelta(1), 'raw', b'2'))
+        release.set()
+        thread.join()
+
+    def test_slot_cycle(self):
+        # slots publishing back to each other from two threads (like eduro.can <-> can.slot_can)
+        with ExitStack() as at_exit:
+            with LogWriter(prefix='tmpBusCycle', note='test_slot_cycle') as logger:
+                at_exit.callback(os.remove, logger.filename)
+                slots_a, slots_b = [], []
+                bus_a = BusHandler(logger, name='a', out={'raw': []}, slots={'raw': slots_a})
+                bus_b = BusHandler(logger, name='b', out={'raw': []}, slots={'raw': slots_b})
+                both_in_slot = Barrier(2, timeout=1)
+
+                def reply(bus):
+                    def slot(data):
+                        if data < 1:
+                            both_in_slot.wait()  # ABBA - each thread is inside its own slot
+                            bus.publish('raw', data + 1)
+                    return slot
+                slots_a.append(reply(bus_b))
+                slots_b.append(reply(bus_a))
+
+                threads = [Thread(target=bus.publish, args=('raw', 0), daemon=True)
+                           for bus in [bus_a, bus_b]]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join(5)
+                    self.assertFalse(thread.is_alive())  # dead-lock
+            with LogReader(logger.filename, only_stream_id=[1, 2]) as log:
+                self.assertEqual(sorted(deserialize(data) for __, __, data in log), [0, 0, 1, 1])
+
+    def test_queue_order_matches_log(self):
+        with ExitStack() as at_exit:
+            with LogWriter(prefix='tmpBusOrder', note='test_queue_order_matches_log') as logger:
+                at_exit.callback(os.remove, logger.filename)
+                receiver = BusHandler(logger)
+                slow_queue = MagicMock()
+                slow_queue.put.side_effect = lambda item: (time.sleep(0.001), receiver.queue.put(item))
+                buses = [BusHandler(logger, name='slow', out={'raw': [(slow_queue, 'raw')]}),
+                         BusHandler(logger, name='fast', out={'raw': [(receiver.queue, 'raw')]})]
+                threads = [Thread(target=lambda bus=bus: [bus.publish('raw', i) for i in range(100)])
+                           for bus in buses]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            received = [receiver.listen() for i in range(200)]
+            with LogReader(logger.filename, only_stream_id=[1, 2]) as log:
+                logged = [(dt, 'raw', deserialize(data)) for dt, __, data in log]
+            self.assertEqual(received, logged)
+
+    def test_queue_policies(self):
+        queue = BusQueue()
+        queue.set_policy('image', policy='latest')
+        queue.set_policy('scan', maxsize=2, policy='drop_oldest')
+        queue.set_policy('pose', maxsize=1, policy='drop_newest')
+        for i in range(3):
+            queue.put((i, 'image', i))
+            queue.put((i, 'scan', i))
+            queue.put((i, 'pose', i))
+            queue.put((i, 'raw', i))  # unbounded
+        queue.put(None)
+        self.assertEqual(queue.dropped, {'image': 2, 'scan': 1, 'pose': 2})
+        items = []
+        while not queue.empty():
+            items.append(queue.get())
+        self.assertEqual(items, [(0, 'pose', 0), (0, 'raw', 0), (1, 'scan', 1), (1, 'raw', 1),
+                                 (2, 'image', 2), (2, 'scan', 2), (2, 'raw', 2), None])
+
+        # released space is available again
+        queue.put((3, 'pose', 3))
+        self.assertEqual(queue.get(), (3, 'pose', 3))
+
+    def test_report_dropped(self):
+        logger = MagicMock()
+        bus = BusHandler(logger, name='detector')
+        bus.queue.set_policy('image', policy='latest')
+        bus.queue.put((1, 'image', b'1'))
+        bus.queue.put((2, 'image', b'2'))
+        self.assertEqual(bus.listen(), (2, 'image', b'2'))
+        bus.shutdown()
+        self.assertEqual(logger.write.call_args_list[0], call(0, b"{'dropped': {'detector.image': 1}}"))
+
+    def test_report_latency(self):
+        logger = MagicMock()
+        bus = BusHandler(logger, name='detector')
+        for i in range(3):
+            bus.queue.put((i, 'image', b'jpeg'))
+        for i in range(3):
+            bus.listen()
+        with patch('osgar.bus.time.monotonic', return_value=bus._diagnostics_time + 2.0):
+            bus.queue.put((4, 'image', b'jpeg'))
+            bus.listen()  # report is due
+        self.assertEqual(logger.write.call_count, 1)
+        stream_id, data = logger.write.call_args[0]
+        self.assertEqual(stream_id, 0)
+        report = literal_eval(data.decode('ascii'))['latency']['detector.image']
+        self.assertEqual(report['count'], 4)
+        self.assertEqual(report['depth'], 3)
+        self.assertEqual(report['period'], 2.0)
+        self.assertLessEqual(report['p50'], report['p99'])
+        self.assertLessEqual(report['p99'], report['max'])
+        self.assertEqual(bus.queue.latency, {})  # new measurement window
+
     def test_bus_sleep(self):
         logger = MagicMock()
         bus = BusHandler(logger, out={})
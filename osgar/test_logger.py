@@ -2,28 +2,30 @@ import unittest
 import os
 import time
 import logging
-from threading import Timer
-from datetime import datetime, timedelta
+import struct
+import errno
+from threading import Timer, Thread, Event
+from datetime import timedelta
 from unittest.mock import patch, MagicMock
 from contextlib import ExitStack
 
 import numpy as np
 
-import osgar.logger  # needed for patching the osgar.logger.datetime.datetime
+from osgar.lib.serialize import serialize, deserialize, array_decoder
+import osgar.logger  # needed for patching the osgar.logger.monotonic_ns
 from osgar.logger import (LogWriter, LogReader, LogAsserter, INFO_STREAM_ID,
-                          lookup_stream_id, LogIndexedReader)
+                          lookup_stream_id, LogIndexedReader, INDEX_FILE_EXT,
+                          scan_log, scan_logs, calculate_stat, register_codec,
+                          lookup_latency, LogMetadata, log_metadata, lookup_stream_names,
+                          read_manifest)
+from osgar.bus import BusHandler
 
 logging.getLogger().setLevel(logging.ERROR)
 
 
-class TimeStandsStill:
-    # inspired by
-    # https://marcusahnve.org/blog/2017/mocking-datetime-in-python/
-    def __init__(self, datetime):
-        self.datetime = datetime
-
-    def utcnow(self):
-        return self.datetime
+def to_ns(**kwargs):
+    "time for the patched monotonic clock of LogWriter"
+    return timedelta(**kwargs) // timedelta(microseconds=1) * 1000
 
 
 def delayed_copy(src, dst, skip_size):
@@ -35,6 +37,34 @@ def delayed_copy(src, dst, skip_size):
             f2.write(buf)
             f2.flush()
 
+def remove_log(filename):
+    os.remove(filename)
+    if os.path.exists(filename + INDEX_FILE_EXT):
+        os.remove(filename + INDEX_FILE_EXT)
+
+
+def remove_segmented_log(filename):
+    for segment in read_manifest(filename):
+        remove_log(segment[0])
+    remove_log(filename)
+
+
+def collect_records(records):
+    return [(timestamp, stream_id, data) for timestamp, stream_id, data in records]
+
+
+def concat(a, b):
+    return a + b
+
+
+def part_size(records):
+    return [sum(1 for record in records)]
+
+
+def count_records(filename):
+    with LogReader(filename) as log:
+        return len(list(log))
+
 
 class LoggerStreamingTest(unittest.TestCase):
 
@@ -185,7 +215,7 @@ class LoggerStreamingTest(unittest.TestCase):
 
     def test_time_overflow(self):
         with LogWriter(prefix='tmp8', note='test_time_overflow') as log:
-            log.start_time = datetime.utcnow() - timedelta(hours=1, minutes=30)
+            log.start_ns -= to_ns(hours=1, minutes=30)
             t1 = log.write(1, b'\x01\x02')
             self.assertGreater(t1, timedelta(hours=1))
             filename = log.filename
@@ -196,19 +226,18 @@ class LoggerStreamingTest(unittest.TestCase):
 
 
     def test_time_overflow2(self):
-        with patch('osgar.logger.datetime.datetime'):
-            osgar.logger.datetime.datetime = TimeStandsStill(datetime(2020, 1, 21))
+        with patch('osgar.logger.monotonic_ns', return_value=0) as clock:
             with osgar.logger.LogWriter(prefix='tmp9', note='test_time_overflow') as log:
                 filename = log.filename
                 t1 = log.write(1, b'\x01')
                 self.assertEqual(t1, timedelta(0))
-                osgar.logger.datetime.datetime = TimeStandsStill(datetime(2020, 1, 21, 1))
+                clock.return_value = to_ns(hours=1)
                 t2 = log.write(1, b'\x02')
                 self.assertEqual(t2, timedelta(hours=1))
-                osgar.logger.datetime.datetime = TimeStandsStill(datetime(2020, 1, 21, 2))
+                clock.return_value = to_ns(hours=2)
                 t3 = log.write(1, b'\x03')
                 self.assertEqual(t3, timedelta(hours=2))
-                osgar.logger.datetime.datetime = TimeStandsStill(datetime(2020, 1, 21, 4))
+                clock.return_value = to_ns(hours=4)
                 # TODO this write should rise exception as the time gap is too big to track!
                 t4 = log.write(1, b'\x04')
                 self.assertEqual(t4, timedelta(hours=4))
@@ -223,17 +252,30 @@ class LoggerStreamingTest(unittest.TestCase):
 #            self.assertEqual(dt, timedelta(hours=4))
         os.remove(filename)
 
+    def test_multiple_days(self):
+        with patch('osgar.logger.monotonic_ns', return_value=0) as clock:
+            with osgar.logger.LogWriter(prefix='tmpDays', note='test_multiple_days') as log:
+                filename = log.filename
+                start_time = log.start_time
+                for hour in range(0, 50):  # at least one record per overflow period
+                    clock.return_value = to_ns(hours=hour)
+                    self.assertEqual(log.write(1, bytes([hour])), timedelta(hours=hour))
+        with LogReader(filename, only_stream_id=1) as log:
+            self.assertEqual(log.start_time, start_time)
+            timestamps = [dt for dt, __, __ in log]
+        self.assertEqual(timestamps[-1], timedelta(days=2, hours=1))
+        os.remove(filename)
+
     def test_large_blocks_with_time_overflow(self):
-        with patch('osgar.logger.datetime.datetime'):
-            osgar.logger.datetime.datetime = TimeStandsStill(datetime(2019, 1, 1))
+        with patch('osgar.logger.monotonic_ns', return_value=0) as clock:
             with osgar.logger.LogWriter(prefix='tmpA', note='test_time_overflow with large blocks') as log:
                 filename = log.filename
                 t1 = log.write(1, b'\x01'*100000)
                 self.assertEqual(t1, timedelta(0))
-                osgar.logger.datetime.datetime = TimeStandsStill(datetime(2019, 1, 1, 1))
+                clock.return_value = to_ns(hours=1)
                 t2 = log.write(1, b'\x02'*100000)
                 self.assertEqual(t2, timedelta(hours=1))
-                osgar.logger.datetime.datetime = TimeStandsStill(datetime(2019, 1, 1, 2))
+                clock.return_value = to_ns(hours=2)
                 t3 = log.write(1, b'\x03'*100000)
                 self.assertEqual(t3, timedelta(hours=2))
         with LogReader(filename, only_stream_id=1) as log:
@@ -309,6 +351,179 @@ class LoggerStreamingTest(unittest.TestCase):
             self.assertEqual(data, b'\x02')
         os.remove(filename)
 
+    def test_buffered_writer(self):
+        sample = [bytes([i % 256]) * (i * 1000) for i in range(100)]
+        with LogWriter(prefix='tmpBuf', note='test_buffered_writer',
+                       buffered=True, flush_size=100000) as log:
+            filename = log.filename
+            times = [log.write(1, data) for data in sample]
+
+        with LogReader(filename, only_stream_id=1) as log:
+            arr = [(t, data) for t, __, data in log]
+        self.assertEqual(arr, list(zip(times, sample)))
+        os.remove(filename)
+
+    def test_buffered_writer_latency(self):
+        with LogWriter(prefix='tmpBufLatency', note='test_buffered_writer_latency',
+                       buffered=True, flush_period=0.01) as log:
+            filename = log.filename
+            t1 = log.write(1, b'\x01\x02')
+            time.sleep(0.1)  # record should be already on the disk
+            with LogReader(filename, only_stream_id=1) as log2:
+                self.assertEqual(next(log2), (t1, 1, b'\x01\x02'))
+        os.remove(filename)
+
+    def test_buffered_writer_error(self):
+        log = LogWriter(prefix='tmpBufError', note='test_buffered_writer_error',
+                        buffered=True, flush_period=0.01)
+        f = log.f
+        self.addCleanup(os.remove, log.filename)
+        self.addCleanup(f.close)
+        log.f = MagicMock()
+        log.f.write.side_effect = OSError(errno.ENOSPC, 'No space left on device')
+        log.write(1, b'\x01')
+        for i in range(100):
+            if log._error is not None:
+                break
+            time.sleep(0.01)
+        with self.assertRaises(OSError):
+            log.write(1, b'\x02')
+        with self.assertRaises(OSError):
+            log.close()
+
+    def test_buffered_writer_max_pending(self):
+        release = Event()
+        with LogWriter(prefix='tmpBufPending', note='test_buffered_writer_max_pending',
+                       buffered=True, flush_period=0.01, max_pending=1000) as log:
+            filename = log.filename
+            f = log.f
+            log.f = MagicMock()
+            log.f.write.side_effect = lambda buf: release.wait()  # slow disk
+            writer = Thread(target=lambda: [log.write(1, b'\x01' * 600) for i in range(10)])
+            writer.start()
+            time.sleep(0.1)
+            self.assertLess(log._pending_size, 1000 + 600)
+            self.assertTrue(writer.is_alive())  # blocked by full buffer
+            log.f.write.side_effect = f.write
+            release.set()
+            writer.join()
+            log.flush()
+            self.assertEqual(log._pending_size, 0)
+            log.f = f
+        os.remove(filename)
+
+    def test_writer_fsync(self):
+        with patch('osgar.logger.os.fsync') as fsync:
+            with LogWriter(prefix='tmpFsync', note='test_writer_fsync',
+                           buffered=True, fsync='close') as log:
+                filename = log.filename
+                log.write(1, b'\x01')
+                log.flush()
+                self.assertEqual(fsync.call_count, 0)
+            self.assertEqual(fsync.call_count, 1)
+
+            with LogWriter(prefix='tmpFsyncBatch', note='test_writer_fsync', fsync='batch') as log:
+                filename2 = log.filename
+                log.write(1, b'\x01')
+                log.write(1, b'\x02')
+                self.assertEqual(fsync.call_count, 1 + 3)  # note and two records
+        os.remove(filename2)
+        os.remove(filename)
+
+    def test_lazy_records(self):
+        with LogWriter(prefix='tmpLazy', note='test_lazy_records') as log:
+            filename = log.filename
+            scan_id = log.register('lidar.scan')
+            pose_id = log.register('app.pose2d')
+            t1 = log.write(scan_id, serialize([1, 2, 3]))
+            t2 = log.write(pose_id, serialize([4, 5, 6]))
+
+        decoder = MagicMock(return_value='decoded')
+        with LogReader(filename, only_stream_id=[scan_id, pose_id], lazy=True,
+                       decoders={'lidar.scan': decoder}) as log:
+            scan, pose = list(log)
+        self.assertEqual((scan.timestamp, scan.stream_id, scan.raw),
+                         (t1, scan_id, serialize([1, 2, 3])))
+        decoder.assert_not_called()
+        self.assertEqual(scan.data, 'decoded')
+        self.assertEqual(scan.data, 'decoded')
+        decoder.assert_called_once_with(serialize([1, 2, 3]))
+        self.assertEqual((pose.timestamp, pose.data), (t2, [4, 5, 6]))
+
+        with LogReader(filename, only_stream_id=0, lazy=True) as log:
+            self.assertEqual(next(log).data, b'test_lazy_records')
+
+        with LogReader(filename, only_stream_id=pose_id, lazy=True,
+                       decoders={pose_id: array_decoder(np.int32)}) as log:
+            data = next(log).data
+            self.assertEqual(data.dtype, np.int32)
+            self.assertEqual(data.tolist(), [4, 5, 6])
+        os.remove(filename)
+
+    def test_compression(self):
+        scan = serialize(list(range(1000)) * 10)
+        for buffered in [False, True]:
+            with LogWriter(prefix='tmpCompress', note='test_compression', buffered=buffered,
+                           compress={'lidar.scan': 'zlib', 'app.pose2d': 'lzma', 5: 'zlib'}) as log:
+                filename = log.filename
+                scan_id = log.register('lidar.scan')
+                pose_id = log.register('app.pose2d')
+                raw_id = log.register('camera.raw')
+                t1 = log.write(scan_id, scan)
+                t2 = log.write(pose_id, b'\x01')  # too short for compression
+                t3 = log.write(raw_id, scan)
+                t4 = log.write(5, b'')
+
+            with LogReader(filename, only_stream_id=[scan_id, pose_id, raw_id, 5]) as log:
+                self.assertEqual(list(log), [(t1, scan_id, scan), (t2, pose_id, b'\x01'),
+                                             (t3, raw_id, scan), (t4, 5, b'')])
+            with LogReader(filename, only_stream_id=0) as log:
+                self.assertIn(b"{'compress': {1: 'zlib'}}", [data for __, __, data in log])
+
+            with LogIndexedReader(filename, index_file=False) as log:
+                self.assertEqual(log[-4], (t1, scan_id, scan))
+                self.assertEqual(log[-3], (t2, pose_id, b'\x01'))
+                self.assertEqual(log[-2], (t3, raw_id, scan))
+                self.assertEqual(log.view(-4)[2], scan)
+                self.assertLess(log.index.pos[-3] - log.index.pos[-4], len(scan) // 10)
+            os.remove(filename)
+
+    def test_seek_compressed(self):
+        scan = serialize(list(range(1000)) * 10)
+        with ExitStack() as at_exit:
+            with patch('osgar.logger.monotonic_ns', return_value=0) as clock:
+                with LogWriter(prefix='tmpSeekCompress', note='test_seek_compressed',
+                               compress={'lidar.scan': 'zlib'}) as log:
+                    at_exit.callback(remove_log, log.filename)
+                    scan_id = log.register('lidar.scan')
+                    for sec in range(1, 4):
+                        clock.return_value = to_ns(seconds=sec)
+                        log.write(scan_id, scan)
+
+            with LogReader(log.filename, start=timedelta(seconds=2)) as log:
+                self.assertEqual(list(log), [(timedelta(seconds=2), scan_id, scan),
+                                             (timedelta(seconds=3), scan_id, scan)])
+
+            decoder = MagicMock(return_value='decoded')
+            with LogReader(log.filename, start=timedelta(seconds=3), lazy=True,
+                           decoders={'lidar.scan': decoder}) as log:
+                self.assertEqual(next(log).data, 'decoded')
+            decoder.assert_called_once_with(scan)
+
+    def test_register_codec(self):
+        register_codec('reversed', 42, lambda data: bytes(reversed(data[1:])),
+                       lambda data: b'\x00' + bytes(reversed(data)))
+        self.addCleanup(osgar.logger.CODECS.pop, 'reversed')
+        self.addCleanup(osgar.logger._CODECS_BY_ID.pop, 42)
+        with LogWriter(prefix='tmpCodec', note='test_register_codec', compress={1: 'reversed'}) as log:
+            filename = log.filename
+            log.write(1, b'\x00\x01\x02')
+        with open(filename, 'rb') as f:
+            self.assertTrue(f.read().endswith(b'\x2a\x02\x01'))
+        with LogReader(filename, only_stream_id=1) as log:
+            self.assertEqual(next(log)[2], b'\x00\x01\x02')
+        os.remove(filename)
+
 
 class LoggerIndexedTest(unittest.TestCase):
 
@@ -324,7 +539,7 @@ class LoggerIndexedTest(unittest.TestCase):
         with ExitStack() as at_exit:
 
             with LogWriter(prefix='tmpIndexed', note=note) as log:
-                at_exit.callback(os.remove, log.filename)
+                at_exit.callback(remove_log, log.filename)
                 for a in sample:
                     t = log.write(1, a)
                     times.append(t)
@@ -344,7 +559,7 @@ class LoggerIndexedTest(unittest.TestCase):
         self.assertEqual(len(data), 100000)
         with ExitStack() as at_exit:
             with LogWriter(prefix='tmpIndexedLarge', note='test_large_block') as log:
-                at_exit.callback(os.remove, log.filename)
+                at_exit.callback(remove_log, log.filename)
                 t1 = log.write(1, data)
                 t2 = log.write(1, data[:0xFFFF])
                 t3 = log.write(1, b'')
@@ -360,19 +575,18 @@ class LoggerIndexedTest(unittest.TestCase):
 
     def test_time_overflow(self):
         with ExitStack() as at_exit:
-            with patch('osgar.logger.datetime.datetime'):
-                osgar.logger.datetime.datetime = TimeStandsStill(datetime(2020, 1, 21))
+            with patch('osgar.logger.monotonic_ns', return_value=0) as clock:
                 with osgar.logger.LogWriter(prefix='tmp9', note='test_time_overflow') as log:
-                    at_exit.callback(os.remove, log.filename)
+                    at_exit.callback(remove_log, log.filename)
                     t1 = log.write(1, b'\x01')
                     self.assertEqual(t1, timedelta(0))
-                    osgar.logger.datetime.datetime = TimeStandsStill(datetime(2020, 1, 21, 1))
+                    clock.return_value = to_ns(hours=1)
                     t2 = log.write(1, b'\x02')
                     self.assertEqual(t2, timedelta(hours=1))
-                    osgar.logger.datetime.datetime = TimeStandsStill(datetime(2020, 1, 21, 2))
+                    clock.return_value = to_ns(hours=2)
                     t3 = log.write(1, b'\x03')
                     self.assertEqual(t3, timedelta(hours=2))
-                    osgar.logger.datetime.datetime = TimeStandsStill(datetime(2020, 1, 21, 4))
+                    clock.return_value = to_ns(hours=4)
                     # TODO this write should rise exception as the time gap is too big to track!
                     t4 = log.write(1, b'\x04')
                     self.assertEqual(t4, timedelta(hours=4))
@@ -388,16 +602,15 @@ class LoggerIndexedTest(unittest.TestCase):
 
     def test_large_blocks_with_time_overflow(self):
         with ExitStack() as at_exit:
-            with patch('osgar.logger.datetime.datetime'):
-                osgar.logger.datetime.datetime = TimeStandsStill(datetime(2019, 1, 1))
+            with patch('osgar.logger.monotonic_ns', return_value=0) as clock:
                 with osgar.logger.LogWriter(prefix='tmpA', note='test_time_overflow with large blocks') as log:
-                    at_exit.callback(os.remove, log.filename)
+                    at_exit.callback(remove_log, log.filename)
                     t1 = log.write(1, b'\x01'*100000)
                     self.assertEqual(t1, timedelta(0))
-                    osgar.logger.datetime.datetime = TimeStandsStill(datetime(2019, 1, 1, 1))
+                    clock.return_value = to_ns(hours=1)
                     t2 = log.write(1, b'\x02'*100000)
                     self.assertEqual(t2, timedelta(hours=1))
-                    osgar.logger.datetime.datetime = TimeStandsStill(datetime(2019, 1, 1, 2))
+                    clock.return_value = to_ns(hours=2)
                     t3 = log.write(1, b'\x03'*100000)
                     self.assertEqual(t3, timedelta(hours=2))
             with LogIndexedReader(log.filename) as log:
@@ -409,15 +622,14 @@ class LoggerIndexedTest(unittest.TestCase):
                 self.assertEqual(dt, timedelta(hours=2))
 
     def test_no_eof(self):
-        with patch('osgar.logger.datetime.datetime'):
-            osgar.logger.datetime.datetime = TimeStandsStill(datetime(2019, 1, 1))
+        with patch('osgar.logger.monotonic_ns', return_value=0) as clock:
             with LogWriter(prefix='tmpEof', note='test_EOF') as log:
                 filename = log.filename
-                osgar.logger.datetime.datetime = TimeStandsStill(datetime(2019, 1, 1, 1))
+                clock.return_value = to_ns(hours=1)
                 t1 = log.write(1, b'\x01'*100)
-                osgar.logger.datetime.datetime = TimeStandsStill(datetime(2019, 1, 1, 2))
+                clock.return_value = to_ns(hours=2)
                 t2 = log.write(1, b'\x02'*100)
-                osgar.logger.datetime.datetime = TimeStandsStill(datetime(2019, 1, 1, 3))
+                clock.return_value = to_ns(hours=3)
                 t3 = log.write(1, b'\x03'*100000)
 
         partial = filename + '.part'
@@ -453,28 +665,47 @@ class LoggerIndexedTest(unittest.TestCase):
                 self.assertEqual(len(log), 4)
                 self.assertEqual(data, b'\x03'*100000)
 
-        os.remove(partial)
+        remove_log(partial)
+        os.remove(filename)
+
+    def test_wait(self):
+        with LogWriter(prefix='tmpWait', note='test_wait') as log:
+            filename = log.filename
+            log.write(1, b'\x01'*100)
+        partial = filename + '.part'
+        with open(filename, 'rb') as f_in, open(partial, 'wb') as f_out:
+            f_out.write(f_in.read(100))
+        with LogIndexedReader(partial) as log:
+            self.assertEqual(log.wait(0.05), 1)  # timeout without new data
+            proc = Timer(0.1, delayed_copy, [filename, partial, 100])
+            start = time.monotonic()
+            proc.start()
+            self.assertEqual(log.wait(10), 2)
+            self.assertLess(time.monotonic() - start, 5)
+            proc.join()
+            dt, channel, data = log[1]
+            self.assertEqual(data, b'\x01'*100)
+        remove_log(partial)
         os.remove(filename)
 
     def test_large_blocks_with_growing_file(self):
         block_size = 100000 # fits into 2 packets, so 16 bytes overhead
         with ExitStack() as at_exit:
-            with patch('osgar.logger.datetime.datetime'):
-                osgar.logger.datetime.datetime = TimeStandsStill(datetime(2019, 1, 1))
+            with patch('osgar.logger.monotonic_ns', return_value=0) as clock:
                 with osgar.logger.LogWriter(prefix='tmpA', note='') as log:
-                    at_exit.callback(os.remove, log.filename)
+                    at_exit.callback(remove_log, log.filename)
                     t1 = log.write(1, b'\x01'*block_size)
                     self.assertEqual(t1, timedelta(0))
-                    osgar.logger.datetime.datetime = TimeStandsStill(datetime(2019, 1, 1, 1))
+                    clock.return_value = to_ns(hours=1)
                     t2 = log.write(1, b'\x02'*block_size)
                     self.assertEqual(t2, timedelta(hours=1))
-                    osgar.logger.datetime.datetime = TimeStandsStill(datetime(2019, 1, 1, 2))
+                    clock.return_value = to_ns(hours=2)
                     t3 = log.write(1, b'\x03'*block_size)
                     self.assertEqual(t3, timedelta(hours=2))
 
             partial = log.filename + '.part'
             with open(log.filename, 'rb') as f_in, open(partial, 'wb') as f_out:
-                at_exit.callback(os.remove, partial)
+                at_exit.callback(remove_log, partial)
                 # log file starts with 16 byte header
                 f_out.write(f_in.read(16))
                 f_out.write(f_in.read(100))
@@ -512,5 +743,369 @@ class LoggerIndexedTest(unittest.TestCase):
                     dt, channel, data = log[2]
                     self.assertEqual(dt, timedelta(hours=2))
 
+    def test_index_file(self):
+        with ExitStack() as at_exit:
+            with LogWriter(prefix='tmpIndexFile', note='test_index_file') as log:
+                at_exit.callback(remove_log, log.filename)
+                t1 = log.write(1, b'\x01')
+                t2 = log.write(2, b'\x02'*100000)
+            filename = log.filename
+
+            with LogIndexedReader(filename) as log:
+                self.assertEqual(len(log), 3)
+            self.assertTrue(os.path.exists(filename + INDEX_FILE_EXT))
+
+            with patch('osgar.logger._create_index') as create_index:
+                with LogIndexedReader(filename) as log:
+                    self.assertEqual(len(log), 3)
+                    self.assertEqual(log[1], (t1, 1, b'\x01'))
+                    self.assertEqual(log[2], (t2, 2, b'\x02'*100000))
+                # nothing new in the log, but the index still should not be
+                # corrupted by the second pass
+                self.assertEqual(create_index.call_count, 1)
+
+            # the log grows - the index is reused and extended
+            t3 = t2 + timedelta(microseconds=1)
+            with open(filename, 'ab') as f:
+                f.write(struct.pack('IHH', t3 // timedelta(microseconds=1), 3, 1) + b'\x03')
+            with LogIndexedReader(filename) as log:
+                self.assertEqual(len(log), 4)
+                self.assertEqual(log[3], (t3, 3, b'\x03'))
+
+    def test_index_file_mismatch(self):
+        with ExitStack() as at_exit:
+            with LogWriter(prefix='tmpIndexMismatch', note='test_index_file_mismatch') as log:
+                at_exit.callback(remove_log, log.filename)
+                t1 = log.write(1, b'\x01\x02')
+            filename = log.filename
+
+            with LogIndexedReader(filename) as log:
+                self.assertEqual(len(log), 2)
+
+            # the same size, but different content (stream ID and data)
+            with open(filename, 'r+b') as f:
+                f.seek(-6, os.SEEK_END)
+                f.write(b'\x05\x00\x02\x00\x03\x04')
+            os.utime(filename, ns=(0, 0))
+            with LogIndexedReader(filename) as log:
+                self.assertEqual(len(log), 2)
+                self.assertEqual(log[1], (t1, 5, b'\x03\x04'))
+
+            with LogIndexedReader(filename, index_file=False) as log:
+                self.assertEqual(log[1], (t1, 5, b'\x03\x04'))
+
+    def test_index_file_rewritten_log(self):
+        with ExitStack() as at_exit:
+            with LogWriter(prefix='tmpIndexRewritten', note='test_index_file_rewritten_log') as log:
+                at_exit.callback(remove_log, log.filename)
+                header = log.f.tell()
+            filename = log.filename
+            with open(filename, 'rb') as f:
+                start = f.read(header)
+            with open(filename, 'wb') as f:
+                f.write(start + struct.pack('IHH', 1, 1, 5) + b'\x01' * 5)
+            with LogIndexedReader(filename) as log:
+                self.assertEqual(len(log), 2)
+
+            # longer log with the same header but different records (i.e. new logcut output)
+            with open(filename, 'wb') as f:
+                f.write(start + struct.pack('IHH', 1, 2, 1) + b'\x02' + struct.pack('IHH', 2, 3, 1) + b'\x03')
+            with LogIndexedReader(filename) as log:
+                self.assertEqual([log[i][1] for i in range(len(log))], [0, 2, 3])
+
+    def test_stream_view(self):
+        with ExitStack() as at_exit:
+            with LogWriter(prefix='tmpStreamView', note='test_stream_view') as log:
+                at_exit.callback(remove_log, log.filename)
+                scan_id = log.register('lidar.scan')
+                pose_id = log.register('app.pose2d')
+                for i in range(3):
+                    log.write(scan_id, bytes([i]))
+                    log.write(pose_id, bytes([10 + i]))
+                    log.write(pose_id, bytes([20 + i]))
+
+            with LogIndexedReader(log.filename) as log:
+                self.assertEqual(log.stream_names(), ['lidar.scan', 'app.pose2d'])
+                scans = log.stream('lidar.scan')
+                poses = log.stream(pose_id)
+                self.assertEqual(len(scans), 3)
+                self.assertEqual(len(poses), 6)
+                self.assertEqual(scans[2][1:], (scan_id, b'\x02'))
+                self.assertEqual(poses[-1][1:], (pose_id, bytes([22])))
+                self.assertEqual([scans.position(k) for k in range(3)], [3, 6, 9])
+
+                self.assertEqual(scans.next_after(3), 6)
+                self.assertEqual(scans.next_after(4), 6)
+                self.assertIsNone(scans.next_after(9))
+                self.assertEqual(scans.prev_before(6), 3)
+                self.assertIsNone(scans.prev_before(3))
+                self.assertEqual(poses.prev_before(6), 5)
+                self.assertEqual(len(log.stream(42)), 0)
+
+    def test_seek(self):
+        with ExitStack() as at_exit:
+            with patch('osgar.logger.monotonic_ns', return_value=0) as clock:
+                with osgar.logger.LogWriter(prefix='tmpSeek', note='test_seek') as log:
+                    filename = log.filename
+                    at_exit.callback(remove_log, filename)
+                    for hour in range(1, 5):  # overflow every ~71 minutes
+                        clock.return_value = to_ns(hours=hour)
+                        log.write(1, bytes([hour]))
+                        clock.return_value = to_ns(hours=hour, minutes=50)
+                        log.write(2, bytes([hour]))
+
+            with LogIndexedReader(filename) as log:
+                self.assertEqual(log.seek(timedelta()), 0)
+                self.assertEqual(log.seek(timedelta(hours=2)), 3)
+                self.assertEqual(log.seek(timedelta(hours=2, minutes=1)), 4)
+                self.assertEqual(log.seek(timedelta(hours=4, minutes=50)), 8)
+                self.assertEqual(log.seek(timedelta(hours=5)), 9)
+                self.assertEqual(log[log.seek(timedelta(hours=3, minutes=30))][:2],
+                                 (timedelta(hours=3, minutes=50), 2))
+
+            with LogReader(filename, start=timedelta(hours=2, minutes=1),
+                           end=timedelta(hours=4)) as log:
+                arr = [(dt, stream_id) for dt, stream_id, data in log]
+            self.assertEqual(arr, [(timedelta(hours=2, minutes=50), 2),
+                                   (timedelta(hours=3), 1),
+                                   (timedelta(hours=3, minutes=50), 2),
+                                   (timedelta(hours=4), 1)])
+
+            with LogReader(filename, only_stream_id=1,
+                           start=timedelta(hours=4, minutes=1)) as log:
+                self.assertEqual(list(log), [])
+
+    def test_view(self):
+        large = bytes([x for x in range(100)]*1000)
+        with ExitStack() as at_exit:
+            with LogWriter(prefix='tmpView', note='test_view') as log:
+                at_exit.callback(remove_log, log.filename)
+                filename = log.filename
+                t1 = log.write(1, serialize([1, 2, 3]))
+                t2 = log.write(1, large)
+                t3 = log.write(1, large[:0xFFFF])
+                t4 = log.write(1, large * 3)
+
+            with open(filename, 'rb') as f_in, open(filename + '.part', 'wb') as f_out:
+                at_exit.callback(remove_log, filename + '.part')
+                f_out.write(f_in.read(100))
+                f_out.flush()
+                with LogIndexedReader(filename + '.part') as log:
+                    dt, channel, data = log.view(1)
+                    self.assertIsInstance(data, memoryview)
+                    self.assertEqual((dt, channel), (t1, 1))
+                    self.assertEqual(deserialize(data), [1, 2, 3])
+
+                    f_out.write(f_in.read())
+                    f_out.flush()
+                    log.grow()  # the old mapping is still referenced by data
+                    self.assertEqual(deserialize(data), [1, 2, 3])
+
+                    dt, channel, data = log.view(2)
+                    self.assertIsInstance(data, bytearray)
+                    self.assertEqual((dt, data), (t2, large))
+                    self.assertEqual(log.view(3)[1:], (1, large[:0xFFFF]))
+                    self.assertEqual(log.view(4)[1:], (1, large * 3))
+                    self.assertEqual(log[4], (t4, 1, large * 3))
+                    self.assertIsInstance(log[4][2], bytes)
+                    data = log.view(-1)[2]
+
+    def test_scan_log(self):
+        with ExitStack() as at_exit:
+            filenames = []
+            for prefix in ['tmpScanA', 'tmpScanB']:
+                with LogWriter(prefix=prefix, note='test_scan_log') as log:
+                    at_exit.callback(remove_log, log.filename)
+                    for i in range(100):
+                        log.write(1 + i % 3, bytes([i]) * (i * 1000))
+                filenames.append(log.filename)
+            filename = filenames[0]
+
+            with LogReader(filename) as log:
+                ref = list(log)
+            self.assertEqual(scan_log(filename, collect_records, concat, jobs=4), ref)
+            self.assertEqual(scan_log(filename, collect_records, concat, jobs=4, only_stream_id=[1, 3]),
+                             [r for r in ref if r[1] in [1, 3]])
+            self.assertEqual(scan_log(filename, collect_records, concat, jobs=200), ref)
+
+            stat, count, timestamp = calculate_stat(filename)
+            self.assertEqual(calculate_stat(filename, jobs=3), (stat, count, timestamp))
+            self.assertEqual(count[2], 33)
+            self.assertEqual(timestamp, ref[-1][0])
+
+            self.assertEqual(scan_logs(filenames, count_records, jobs=2), [101, 101])
+
+    def test_lookup_latency(self):
+        with LogWriter(prefix='tmpLatency', note='test_lookup_latency') as log:
+            bus = BusHandler(log, name='app')
+            for k in range(2):
+                for i in range(5):
+                    bus.queue.put((timedelta(), 'scan', i))
+                for i in range(5):
+                    bus.listen()
+                bus.report_diagnostics(bus._diagnostics_time + 0.5)
+        self.addCleanup(remove_log, log.filename)
+        latency = lookup_latency(log.filename)
+        self.assertEqual(list(latency.keys()), ['app.scan'])
+        hist, period = latency['app.scan']
+        self.assertEqual(hist.count, 10)
+        self.assertEqual(hist.depth, 5)
+        self.assertAlmostEqual(period, 1.0)
+
+    def test_log_metadata(self):
+        config = {'robot': {'modules': {}, 'links': []}, 'description': 'x' * 100000}
+        with LogWriter(prefix='tmpMetadata', note=str(['run', 'config.json'])) as log:
+            log.write(INFO_STREAM_ID, bytes(str(config), 'ascii'))
+            scan = log.register('lidar.scan')
+            log.register('camera.raw')
+            log.write(scan, serialize([1, 2, 3]))
+            log.write(INFO_STREAM_ID, bytes(str({'names': ['late']}), 'ascii'))  # ignored, after data
+        self.addCleanup(remove_log, log.filename)
+
+        metadata = LogMetadata(log.filename)
+        self.assertEqual(metadata.start_time, log.start_time)
+        self.assertEqual(metadata.note, "['run', 'config.json']")
+        self.assertEqual(metadata.config, config)
+        self.assertEqual(metadata.names, ['lidar.scan', 'camera.raw'])
+
+        cached = log_metadata(log.filename)
+        self.assertIs(log_metadata(log.filename), cached)
+        self.assertEqual(lookup_stream_id(log.filename, 'camera.raw'), 2)
+        with patch('osgar.logger.LogMetadata') as mock:
+            self.assertEqual(lookup_stream_names(log.filename), ['lidar.scan', 'camera.raw'])
+            mock.assert_not_called()
+
+        with open(log.filename, 'ab') as f:
+            f.write(b'\x00' * 8)  # modified log is read again
+        self.assertIsNot(log_metadata(log.filename), cached)
+
+
+class LoggerSegmentsTest(unittest.TestCase):
+
+    def write_log(self, prefix, **kwargs):
+        with patch('osgar.logger.monotonic_ns', return_value=0) as clock:
+            with osgar.logger.LogWriter(prefix=prefix, note='test_segments', **kwargs) as log:
+                log.write(INFO_STREAM_ID, bytes(str({'robot': {}}), 'ascii'))
+                scan, pose = log.register('lidar.scan'), log.register('pose2d')
+                for i in range(100):
+                    clock.return_value = to_ns(seconds=i)
+                    log.write(scan, bytes([i]) * 100)
+                    log.write(pose, serialize(i))
+        self.addCleanup(remove_segmented_log, log.filename)
+        return log.filename
+
+    def test_scan_segments(self):
+        filename = self.write_log('tmpScanSegments', segment_size=8000)
+        self.assertEqual(len(read_manifest(filename)), 2)
+        parts = scan_log(filename, part_size, concat, jobs=8)
+        self.assertEqual(len(parts), 8)  # split by bytes, not by segments
+        self.assertEqual(sum(parts), 4 + 200)  # note, config, 2x names and records
+        with LogReader(filename) as log:
+            self.assertEqual(scan_log(filename, collect_records, concat, jobs=3), list(log))
+
+    def test_size_rollover(self):
+        for buffered in [False, True]:
+            filename = self.write_log('tmpSegments%d' % buffered, segment_size=2000, buffered=buffered)
+            segments = read_manifest(filename)
+            self.assertGreater(len(segments), 5)
+            self.assertEqual(segments[0][1:], (0, 0))
+            for path, offset, header_records in segments:
+                self.assertLessEqual(os.path.getsize(path), 2000)
+
+            with LogReader(filename) as log:
+                records = list(log)
+            self.assertEqual(len(records), 4 + 200)  # note, config, 2x names
+            self.assertEqual(records[-1], (timedelta(seconds=99), 2, serialize(99)))
+
+            # every segment is valid log with the names
+            path, offset, header_records = segments[5]
+            self.assertEqual(lookup_stream_names(path), ['lidar.scan', 'pose2d'])
+            with LogReader(path) as log:
+                dt, stream_id, data = list(log)[header_records]
+            self.assertIn((dt + timedelta(microseconds=offset), stream_id, data), records)
+
+            with LogIndexedReader(filename) as log:
+                self.assertEqual(len(log), len(records))
+                self.assertEqual(log[-1], (timedelta(seconds=99), 2, serialize(99)))
+                self.assertEqual(log.stream_names(), ['lidar.scan', 'pose2d'])
+                scans = log.stream('lidar.scan')
+                self.assertEqual(len(scans), 100)
+                self.assertEqual(scans[50], (timedelta(seconds=50), 1, bytes([50]) * 100))
+                self.assertEqual(bytes(log.view(log.seek(timedelta(seconds=30)))[2]), bytes([30]) * 100)
+
+    def test_growing_segments(self):
+        with LogWriter(prefix='tmpSegmentsGrow', note='test_growing_segments', segment_size=1000) as log:
+            self.addCleanup(remove_segmented_log, log.filename)
+            stream_id = log.register('raw')
+            for i in range(10):
+                log.write(stream_id, bytes(100))
+            with LogIndexedReader(log.filename) as indexed, \
+                    LogReader(log.filename, follow=True, only_stream_id=stream_id) as reader:
+                self.assertEqual(len(indexed.stream(stream_id)), 10)
+                for i in range(30):
+                    log.write(stream_id, bytes([i]) * 100)
+                self.assertGreater(len(read_manifest(log.filename)), 3)
+                indexed.grow()
+                self.assertEqual(len(indexed.stream(stream_id)), 40)
+                self.assertEqual(indexed[-1][2], bytes([29]) * 100)
+                self.assertEqual([next(reader)[2] for i in range(40)][-1], bytes([29]) * 100)
+
+    def test_duration_rollover(self):
+        filename = self.write_log('tmpSegmentsTime', segment_duration=10)
+        segments = read_manifest(filename)
+        self.assertEqual(len(segments), 10)
+        self.assertEqual([offset for path, offset, header_records in segments],
+                         [to_ns(seconds=10 * i) // 1000 for i in range(10)])
+
+        with LogReader(filename, only_stream_id=2, start=timedelta(seconds=25),
+                       end=timedelta(seconds=44)) as log:
+            self.assertEqual([deserialize(data) for dt, stream_id, data in log], list(range(25, 45)))
+        self.assertEqual(log_metadata(filename).names, ['lidar.scan', 'pose2d'])
+        self.assertEqual(log_metadata(filename).config, {'robot': {}})
+        self.assertEqual(calculate_stat(filename, jobs=2)[1][1], 100)
+
+
+class LoggerVersion2Test(unittest.TestCase):
+
+    def write_log(self, prefix, **kwargs):
+        with patch('osgar.logger.monotonic_ns', return_value=0) as clock:
+            with osgar.logger.LogWriter(prefix=prefix, note='test_v2', version=2, **kwargs) as log:
+                scan, image = log.register('lidar.scan'), log.register('camera.raw')
+                for hour in range(3):  # no 32bit overflow handling needed
+                    clock.return_value = to_ns(hours=hour)
+                    log.write(scan, serialize([hour] * 10))
+                    log.write(image, bytes([hour]) * 100000)  # no 64kB chunks
+        self.addCleanup(remove_log, log.filename)
+        return log.filename
+
+    def test_read_write(self):
+        for buffered in [False, True]:
+            filename = self.write_log('tmpV2%d' % buffered, buffered=buffered, compress={'camera.raw': 'zlib'})
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(4), b'Pyr\x02')
+            with LogReader(filename, only_stream_id=[1, 2]) as log:
+                records = list(log)
+            self.assertEqual([(dt, stream_id) for dt, stream_id, __ in records],
+                             [(timedelta(hours=h), s) for h in range(3) for s in [1, 2]])
+            self.assertEqual(records[-1][2], bytes([2]) * 100000)
+
+            with LogIndexedReader(filename) as log:
+                self.assertEqual(log.stream_names(), ['lidar.scan', 'camera.raw'])
+                self.assertEqual(log[log.seek(timedelta(hours=1))],
+                                 (timedelta(hours=1), 1, serialize([1] * 10)))
+                self.assertEqual(log.stream('camera.raw')[2][2], bytes([2]) * 100000)
+                self.assertEqual(bytes(log.view(-2)[2]), serialize([2] * 10))
+            self.assertEqual(LogMetadata(filename).names, ['lidar.scan', 'camera.raw'])
+
+    def test_invalid_tail(self):
+        filename = self.write_log('tmpV2tail')
+        with LogIndexedReader(filename) as log:
+            count = len(log)
+        with open(filename, 'ab') as f:
+            f.write(bytes(1000))  # zeros after power cut
+        with LogReader(filename) as log:
+            self.assertEqual(len(list(log)), count)
+        with LogIndexedReader(filename) as log:
+            self.assertEqual(len(log), count)
 
 # vim: expandtab sw=4 ts=4
@@ -2,8 +2,9 @@ import unittest
 from unittest.mock import MagicMock
 from datetime import timedelta
 
-from osgar.bus import BusHandler
-from osgar.node import Node
+from osgar.bus import BusHandler, AsyncBusHandler, AsyncRuntime
+from osgar.node import Node, AsyncNode
+from osgar.record import Recorder
 
 
 class NodeTest(unittest.TestCase):
@@ -29,4 +30,49 @@ class NodeTest(unittest.TestCase):
         node = Node(config=empty_config, bus=bus2)
         self.assertNotIn('vel', dir(node))
 
+
+class Echo(AsyncNode):
+    async def update(self):
+        channel = await super().update()
+        self.publish('echo', getattr(self, channel))
+
+
+class AsyncNodeTest(unittest.TestCase):
+
+    def test_usage(self):
+        runtime = AsyncRuntime()
+        logger = MagicMock()
+        logger.register = MagicMock(return_value=1)
+        logger.write = MagicMock(return_value=timedelta(seconds=2))
+        output = BusHandler(logger)
+        bus = AsyncBusHandler(logger, runtime, name='echo', out={'echo': [(output.queue, 'value')]})
+        node = Echo(config={}, bus=bus)
+        node.start()
+        bus.queue.put((timedelta(seconds=1), 'vel', 3))  # from other thread
+        self.assertEqual(output.listen(), (timedelta(seconds=2), 'value', 3))
+        self.assertEqual(node.time, timedelta(seconds=1))
+        node.request_stop()
+        node.join(timeout=1)
+        runtime.stop()
+
+    def test_mixed_with_threads(self):
+        config = {
+                'modules': {
+                    'echo': {'driver': 'osgar.test_node:Echo', 'out':['echo'], 'init':{}},
+                    'node': {'driver': 'osgar.node:Node', 'out':['vel'], 'init':{}},
+                },
+                'links': [('node.vel', 'echo.vel'), ('echo.echo', 'node.echo')]
+        }
+        recorder = Recorder(config=config, logger=MagicMock())
+        self.assertIsInstance(recorder.modules['echo'].bus, AsyncBusHandler)
+        recorder.start()
+        node = recorder.modules['node']
+        node.publish('vel', 7)
+        for i in range(100):
+            if getattr(node, 'echo', None) == 7:
+                break
+            node.sleep(0.01)
+        self.assertEqual(node.echo, 7)
+        recorder.finish()
+
 # vim: expandtab sw=4 ts=4
@@ -0,0 +1,124 @@
+import os
+import unittest
+import tempfile
+import shutil
+from threading import Thread
+
+try:
+    import multiprocessing.shared_memory
+except ImportError:
+    raise unittest.SkipTest('multiprocessing.shared_memory requires Python 3.8+')
+
+from osgar.bus import BusQueue
+from osgar.lib.ring import SharedRing, RingClosed
+from osgar.logger import LogWriter, LogReader, ENV_OSGAR_LOGS, lookup_stream_names
+from osgar.node import Node
+from osgar.record import Recorder
+
+
+class Doubler(Node):
+    def __init__(self, config, bus):
+        super().__init__(config, bus)
+        self.factor = config.get('factor', 2)
+
+    def update(self):
+        channel = super().update()
+        if channel == 'value':
+            self.publish('value', self.value * self.factor)
+        return channel
+
+    def slot_error(self, data):
+        self.bus.report_error(data)
+
+
+class SharedRingTest(unittest.TestCase):
+
+    def test_wrap_around(self):
+        ring = SharedRing(100)
+        frames = [bytes([i]) * (1 + i % 37) for i in range(200)]
+
+        def producer():
+            for frame in frames:
+                ring.put(frame[:1], frame[1:])
+            ring.close()
+
+        thread = Thread(target=producer)
+        thread.start()
+        received = []
+        while True:
+            view = ring.get()
+            if view is None:
+                break
+            received.append(bytes(view))
+            ring.release()
+        thread.join()
+        ring.detach()
+        self.assertEqual(received, frames)
+
+    def test_large_frames(self):
+        ring = SharedRing(1000)
+        self.addCleanup(ring.detach)
+        self.addCleanup(ring.close)  # wakes up blocked put() on failure
+        for size in [500, 700, 900, 300, 996]:  # larger than the rest of the buffer
+            frame = bytes([size % 256]) * size
+            producer = Thread(target=ring.put, args=(frame,), daemon=True)
+            producer.start()
+            producer.join(1)
+            self.assertFalse(producer.is_alive())
+            self.assertEqual(bytes(ring.get()), frame)
+            ring.release()
+
+    def test_closed(self):
+        ring = SharedRing(100)
+        with self.assertRaises(ValueError):
+            ring.put(bytes(100))
+        ring.close()
+        with self.assertRaises(RingClosed):
+            ring.put(b'data')
+        self.assertIsNone(ring.get())
+        ring.detach()
+
+
+class ProcessNodeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.prev_logs = os.environ.get(ENV_OSGAR_LOGS)
+        os.environ[ENV_OSGAR_LOGS] = self.tmp_dir
+
+    def tearDown(self):
+        if self.prev_logs is None:
+            del os.environ[ENV_OSGAR_LOGS]
+        else:
+            os.environ[ENV_OSGAR_LOGS] = self.prev_logs
+        shutil.rmtree(self.tmp_dir)
+
+    def test_record(self):
+        config = {
+            'modules': {
+                'src': {'driver': 'osgar.node:Node', 'out': ['value'], 'init': {}},
+                'double': {'driver': 'osgar.test_process:Doubler', 'out': ['value'],
+                           'init': {'factor': 2}, 'process': True},
+            },
+            'links': [('src.value', 'double.value'), ('src.value', 'double.slot_error')]
+        }
+        with LogWriter(prefix='process-test-') as log:
+            recorder = Recorder(config=config, logger=log)
+            output = BusQueue()
+            recorder.modules['double'].bus.out['value'].append((output, 'value'))
+            recorder.start()
+            recorder.modules['src'].publish('value', 21)
+            timestamp, channel, data = output.get()
+            self.assertEqual((channel, data), ('value', 42))
+            recorder.finish()
+        names = lookup_stream_names(log.filename)
+        self.assertEqual(names, ['src.value', 'double.value'])
+        with LogReader(log.filename) as log:
+            records = [(stream_id, data) for __, stream_id, data in log]
+        self.assertIn((1, b'\x15'), records)
+        self.assertIn((2, b'*'), records)
+        self.assertIn((0, b"{'error': '21'}"), records)
+        self.assertEqual(timestamp, [dt for dt, stream_id, __ in LogReader(log.filename)
+                                     if stream_id == 2][0])
+
+# vim: expandtab sw=4 ts=4
@@ -46,6 +46,21 @@ class RecorderTest(unittest.TestCase):
             recorder.update()
             recorder.finish()
 
+    def test_link_queue_policy(self):
+        config = {
+                'modules': {
+                    'src': {'driver': 'osgar.node:Node', 'out':['raw'], 'init':{}},
+                    'dst': {'driver': 'osgar.node:Node', 'out':[], 'init':{}},
+                },
+                'links': [('src.raw', 'dst.raw', {'policy': 'latest'})]
+        }
+        recorder = Recorder(config=config, logger=MagicMock())
+        queue = recorder.modules['dst'].bus.queue
+        for i in range(3):
+            recorder.modules['src'].bus.publish('raw', i)
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.dropped, {'raw': 2})
+
     def test_spider_config(self):
         # first example with loop spider <-> serial
         with open(os.path.dirname(__file__) + '/../config/test-spider.json') as f:
@@ -0,0 +1,66 @@
+import unittest
+import os
+import json
+import tempfile
+from argparse import Namespace
+from contextlib import redirect_stdout
+from io import StringIO
+
+from osgar.logger import LogWriter
+from osgar.lib.serialize import serialize
+from osgar.replay import replay_graph, run_graph
+
+
+CONFIG = {
+    'version': 2,
+    'robot': {
+        'modules': {
+            'src': {'driver': 'serial', 'in': [], 'out': ['raw'], 'init': {'port': 'COM1', 'speed': 9600}},
+            'camera': {'driver': 'osgar.drivers.opencv:LogOpenCVCamera', 'in': [], 'out': ['raw'],
+                       'init': {'port': 0}},  # source without inputs
+            'double': {'driver': 'osgar.test_process:Doubler', 'in': ['value'], 'out': ['value'],
+                       'init': {'factor': 2}},
+            'triple': {'driver': 'osgar.test_process:Doubler', 'in': ['value'], 'out': ['value'],
+                       'init': {'factor': 3}},
+        },
+        'links': [['src.raw', 'double.value'], ['double.value', 'triple.value']]
+    }
+}
+
+
+class ReplayGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        with LogWriter(prefix='tmpReplay', note=str(['test'])) as log:
+            log.write(0, bytes(str(CONFIG), 'ascii'))
+            src, double, triple = [log.register(name) for name in ['src.raw', 'double.value', 'triple.value']]
+            for i in range(10):
+                log.write(src, serialize(i))
+                log.write(double, serialize(2 * i))
+                log.write(triple, serialize(6 * i))
+        self.filename = log.filename
+        self.addCleanup(os.remove, self.filename)
+
+    def replay(self, module, config=None):
+        args = Namespace(logfile=self.filename, force=False, config=config, module=module, verbose=False)
+        with redirect_stdout(StringIO()):
+            instances = replay_graph(args)
+            return instances, run_graph(instances)
+
+    def test_all(self):
+        instances, errors = self.replay(['all'])
+        self.assertEqual(list(instances.keys()), ['double', 'triple'])  # without recorded sources
+        self.assertEqual(errors, {'double': None, 'triple': None})
+
+    def test_subgraph_failure(self):
+        config = json.loads(json.dumps(CONFIG))
+        config['robot']['modules']['triple']['init']['factor'] = 4
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump(config, f)
+        self.addCleanup(os.remove, f.name)
+        instances, errors = self.replay(['triple', 'double'], config=[f.name])
+        self.assertEqual(list(instances.keys()), ['double', 'triple'])
+        self.assertIsNone(errors['double'])
+        self.assertIsInstance(errors['triple'], AssertionError)
+
+# vim: expandtab sw=4 ts=4
@@ -19,6 +19,7 @@ from osgar.lib import quaternion
 #WINDOW_SIZE = 1200, 660
 WINDOW_SIZE = 1600, 1000
 TAIL_MIN_STEP = 0.1  # in meters
+FOLLOW_WAIT = 0.1  # sec, max. waiting for new data of followed log (keeps UI responsive)
 HISTORY_SIZE = 100
 
 g_scale = 30
@@ -197,8 +198,11 @@ class History:
 
 class Framer:
     """Creates frames from log entries. Packs together closest scan, pose and camera picture."""
-    def __init__(self, filepath, lidar_name=None, pose2d_name=None, pose3d_name=None, camera_name=None):
+    def __init__(self, filepath, lidar_name=None, pose2d_name=None, pose3d_name=None, camera_name=None,
+                 start=None, end=None, follow=False):
         self.log = LogIndexedReader(filepath)
+        self.start, self.end = start, end
+        self.follow = follow
         self.current = 0
         self.pose = [0, 0, 0]
         self.pose2d = [0, 0, 0]
@@ -215,9 +219,18 @@ class Framer:
             self.pose3d_id = names.index(pose3d_name) + 1
         if camera_name is not None:
             self.camera_id = names.index(camera_name) + 1
+        self.pose_pos, self.image_pos = None, None  # positions of already decoded records
 
     def __enter__(self):
         self.log.__enter__()
+        # the frame rate is given by LIDAR, camera or pose (in this order)
+        self.streams = {}
+        for stream_id in [self.lidar_id, self.camera_id, self.pose2d_id, self.pose3d_id]:
+            if stream_id is not None:
+                self.streams[stream_id] = self.log.stream(stream_id)
+        self.frame_id = next(iter(self.streams))
+        if self.start is not None:
+            self.current = self.log.seek(self.start) - 1
         return self
 
     def __exit__(self, *args):
@@ -229,41 +242,61 @@ class Framer:
     def next(self):
         return self._step(1)
 
+    def _last(self, stream_id, pos):
+        "position of the last record of given stream up to pos (included)"
+        if stream_id is None:
+            return None
+        return self.streams[stream_id].prev_before(pos + 1)
+
     def _step(self, direction):
         if (self.current + direction) >= len(self.log):
             self.log.grow()
-        while self.current + direction >= 0 and self.current + direction < len(self.log):
-            self.current += direction
-            timestamp, stream_id, data = self.log[self.current]
-            if stream_id == self.lidar_id:
-                self.scan = deserialize(data)
-                return timestamp, self.pose, self.scan, self.image, False
-            elif stream_id == self.camera_id:
-                jpeg = deserialize(data)
-                self.image = pygame.image.load(io.BytesIO(jpeg), 'JPG').convert()
-                if self.lidar_id is None:
-                    return timestamp, self.pose, self.scan, self.image, False
-            elif stream_id == self.pose3d_id:
-                pose3d, orientation = deserialize(data)
+        frames = self.streams[self.frame_id]
+        if direction > 0:
+            pos = frames.next_after(self.current)
+        else:
+            pos = frames.prev_before(self.current)
+        if pos is None and direction > 0 and self.follow:
+            self.log.wait(FOLLOW_WAIT)  # live log - new records are indexed incrementally
+            pos = frames.next_after(self.current)
+        if pos is None or (self.end is not None and self.log.view(pos)[0] > self.end):
+            return timedelta(), self.pose, self.scan, self.image, True
+        self.current = pos
+        timestamp, __, data = self.log.view(pos)
+
+        pose_pos = max([p for p in [self._last(self.pose2d_id, pos), self._last(self.pose3d_id, pos)]
+                        if p is not None], default=None)
+        if pose_pos is not None and pose_pos != self.pose_pos:
+            self.pose_pos = pose_pos
+            __, stream_id, pose_data = self.log.view(pose_pos)
+            if stream_id == self.pose3d_id:
+                pose3d, orientation = deserialize(pose_data)
                 assert len(pose3d) == 3
                 assert len(orientation) == 4
                 self.pose = [pose3d[0], pose3d[1], quaternion.heading(orientation)]
                 self.pose3d = [pose3d, orientation]
-            elif stream_id == self.pose2d_id:
-                arr = deserialize(data)
+            else:
+                arr = deserialize(pose_data)
                 assert len(arr) == 3
                 self.pose = (arr[0]/1000.0, arr[1]/1000.0, math.radians(arr[2]/100.0))
                 x, y, heading = self.pose
                 self.pose = (x * math.cos(g_rotation_offset_rad) - y * math.sin(g_rotation_offset_rad),
                              x * math.sin(g_rotation_offset_rad) + y * math.cos(g_rotation_offset_rad),
                              heading + g_rotation_offset_rad)
-                if self.lidar_id is None and self.camera_id is None:
-                    return timestamp, self.pose, self.scan, self.image, False
-        return timedelta(), self.pose, self.scan, self.image, True
+
+        image_pos = self._last(self.camera_id, pos)
+        if image_pos is not None and image_pos != self.image_pos:
+            self.image_pos = image_pos
+            jpeg = deserialize(self.log.view(image_pos)[2])
+            self.image = pygame.image.load(io.BytesIO(jpeg), 'JPG').convert()
+
+        if self.lidar_id is not None:
+            self.scan = deserialize(data)
+        return timestamp, self.pose, self.scan, self.image, False
 
 
 
-def lidarview(gen, caption_filename, callback=False):
+def lidarview(gen, caption_filename, callback=False, follow=False):
     global g_scale
 
     pygame.display.init()
@@ -335,12 +368,12 @@ def lidarview(gen, caption_filename, callback=False):
             screen.blit(foreground, (0, 0))
             pygame.display.flip() 
 
-            if paused or eof:
+            if paused or (eof and not follow):
                 event = pygame.event.wait()
             else:
                 event = pygame.event.poll()
-            if event.type == pygame.NOEVENT:
-                pygame.time.wait(sleep_time)
+            if event.type == pygame.NOEVENT and not eof:
+                pygame.time.wait(sleep_time)  # at the end of followed log the framer waits for data
             if event.type == QUIT:
                 return
             if event.type == KEYDOWN:
@@ -390,7 +423,7 @@ def lidarview(gen, caption_filename, callback=False):
                     history.prev()
                     history.prev()
                     break
-            if event.type == pygame.NOEVENT and not paused and not eof:
+            if event.type == pygame.NOEVENT and not paused and (not eof or follow):
                 break
 
 
@@ -415,6 +448,12 @@ def main():
 
     parser.add_argument('--rotate', help='rotate poses by angle in degrees, offset',
                         type=float, default=0.0)
+    parser.add_argument('--start-time-sec', '-s', help='start at given time (sec)',
+                        type=float, default=None)
+    parser.add_argument('--end-time-sec', '-e', help='stop at given time (sec)',
+                        type=float, default=None)
+    parser.add_argument('--follow', '-f', help='display growing log of running robot',
+                        action='store_true')
 
     args = parser.parse_args()
     if not any([args.lidar, args.pose2d, args.pose3d, args.camera]):
@@ -433,8 +472,14 @@ def main():
         lidarview(scans_gen_legacy(args.logfile), caption_filename=filename, 
                   callback=callback)
     else:
-        with Framer(args.logfile, lidar_name=args.lidar, pose2d_name=args.pose2d, pose3d_name=args.pose3d, camera_name=args.camera) as framer:
-            lidarview(framer, caption_filename=filename, callback=callback)
+        start, end = None, None
+        if args.start_time_sec is not None:
+            start = timedelta(seconds=args.start_time_sec)
+        if args.end_time_sec is not None:
+            end = timedelta(seconds=args.end_time_sec)
+        with Framer(args.logfile, lidar_name=args.lidar, pose2d_name=args.pose2d, pose3d_name=args.pose3d, camera_name=args.camera,
+                    start=start, end=end, follow=args.follow) as framer:
+            lidarview(framer, caption_filename=filename, callback=callback, follow=args.follow)
 
 if __name__ == "__main__":
     main()
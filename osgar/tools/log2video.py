@@ -22,7 +22,9 @@ def create_video(logfile, stream, outfile, add_time=False,
                  start_time_sec=0, end_time_sec=None, fps=25):
     assert outfile.endswith(".avi"), outFilename
     only_stream = lookup_stream_id(logfile, stream)
-    with LogReader(logfile, only_stream_id=only_stream) as log:
+    start = timedelta(seconds=start_time_sec) if start_time_sec > 0 else None
+    end = timedelta(seconds=end_time_sec) if end_time_sec is not None else None
+    with LogReader(logfile, only_stream_id=only_stream, start=start, end=end) as log:
         writer = None
         for timestamp, stream_id, data in log:
             buf = deserialize(data)
@@ -47,10 +49,7 @@ def create_video(logfile, stream, outfile, add_time=False,
                 cv2.putText(img, s, (x, y), cv2.FONT_HERSHEY_PLAIN, 
                             size, (255, 255, 255), thickness=thickness)
 
-            if timestamp.total_seconds() > start_time_sec:
-                writer.write(img)
-            if end_time_sec is not None and timestamp.total_seconds() > end_time_sec:
-                break
+            writer.write(img)
         writer.release()
 
 
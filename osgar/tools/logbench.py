@@ -0,0 +1,349 @@
+"""
+  Benchmarks of logger read/write paths
+
+  usage:
+       python -m osgar.tools.logbench write --count 100000 --size 100
+       python -m osgar.tools.logbench bus --publishers 4 --slot-delay 0.001
+       python -m osgar.tools.logbench clock --count 1000000
+"""
+import os
+import math
+import time
+import mmap
+import struct
+import shutil
+import tempfile
+import random
+import datetime
+from queue import Queue
+from threading import Thread
+
+from osgar.logger import (LogWriter, LogReader, LogIndex, LogIndexedReader, ENV_OSGAR_LOGS,
+                          INDEX_FILE_EXT, TIMESTAMP_OVERFLOW_STEP, TIMESTAMP_MASK,
+                          _pack_record, _compress)
+from osgar.lib.serialize import serialize
+from osgar.bus import BusHandler
+
+
+def _report(name, count, size, duration):
+    print('{:<30} {:10.0f} msg/s {:10.1f} MB/s'.format(
+          name, count/duration, count*size/duration/1e6))
+
+
+def bench_write(count, size, threads=1, **kwargs):
+    data = bytes(size)
+    per_thread = count // threads
+    log = LogWriter(prefix='bench-', **kwargs)
+
+    def worker():
+        for i in range(per_thread):
+            log.write(1, data)
+
+    workers = [Thread(target=worker) for i in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    log.close()  # include flushing of the buffered data
+    duration = time.perf_counter() - start
+    os.remove(log.filename)
+    return per_thread * threads, duration
+
+
+def _legacy_create_index(data, pos):
+    "original index builder (list of (pos, timedelta)) as the reference"
+    index = []
+    end = len(data)
+    us_offset = 0
+    prev_micros = 0
+    dt = datetime.timedelta()
+    while pos + 8 <= end:
+        start = pos
+        header = data[pos:pos+8]
+        micros, channel, size = struct.unpack('IHH', header)
+        if prev_micros > micros:
+            us_offset += TIMESTAMP_OVERFLOW_STEP
+        prev_micros = micros
+        dt = datetime.timedelta(microseconds=micros+us_offset)
+        pos += 8 + size
+        while size == 0xFFFF and pos + 8 <= end:
+            header = data[pos:pos+8]
+            micros_, channel, size = struct.unpack('IHH', header)
+            assert micros == micros_
+            pos += 8 + size
+        if pos > end:
+            index.append((start, dt))
+            return index
+        index.append((start, dt))
+    index.append((pos, dt))
+    return index
+
+
+def bench_index(count, size):
+    data = bytes(size)
+    with LogWriter(prefix='bench-', buffered=True) as log:
+        for i in range(count):
+            log.write(1 + i % 3, data)
+    filename = log.filename
+
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            start = time.perf_counter()
+            legacy = _legacy_create_index(buf, 4+12)
+            legacy_duration = time.perf_counter() - start
+
+            start = time.perf_counter()
+            index = LogIndex()
+            index.update(buf)
+            duration = time.perf_counter() - start
+    assert len(legacy) == len(index) + 1, (len(legacy), len(index))
+
+    with LogIndexedReader(filename) as log:  # create sidecar file
+        pass
+    start = time.perf_counter()
+    with LogIndexedReader(filename) as log:
+        assert len(log) == len(index)
+    sidecar_duration = time.perf_counter() - start
+
+    os.remove(filename + INDEX_FILE_EXT)
+    os.remove(filename)
+    print('{} records of {} bytes'.format(len(index), size))
+    print('{:<30} {:8.3f} s'.format('legacy _create_index', legacy_duration))
+    print('{:<30} {:8.3f} s ({:.1f}x)'.format('_create_index', duration,
+                                             legacy_duration/duration))
+    print('{:<30} {:8.3f} s'.format('open with sidecar index', sidecar_duration))
+
+
+def _legacy_read(filename):
+    "original LogReader loop (unbuffered small reads, data += part) as the reference"
+    with open(filename, 'rb') as f:
+        f.read(4+12)
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            microseconds, stream_id, size = struct.unpack('IHH', header)
+            data = f.read(size)
+            while size == 0xFFFF:
+                header = f.read(8)
+                microseconds, stream_id, size = struct.unpack('IHH', header)
+                data += f.read(size)
+            yield data
+
+
+def bench_read(sizes, total):
+    for size in sizes:
+        count = max(1, total // size)
+        data = bytes(size)
+        with LogWriter(prefix='bench-', buffered=True) as log:
+            for i in range(count):
+                log.write(1, data)
+        filename = log.filename
+
+        start = time.perf_counter()
+        for record in _legacy_read(filename):
+            pass
+        legacy_duration = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with LogReader(filename) as log:
+            for record in log:
+                pass
+        duration = time.perf_counter() - start
+        os.remove(filename)
+
+        mb = count * size / 1e6
+        print('{:5.1f} MB records x {:3d}: legacy {:8.1f} MB/s, LogReader {:8.1f} MB/s'.format(
+              size / 1e6, count, mb/legacy_duration, mb/duration))
+
+
+def _sample_streams(count):
+    "synthetic data similar to real robot streams"
+    random.seed(0)
+    scans, can, poses, images = [], [], [], []
+    for i in range(count):
+        base = 2000 + 1000 * math.sin(i / 50)
+        scans.append(serialize([int(base + 500 * math.sin(k / 100) + random.randint(-10, 10))
+                                for k in range(811)]))
+        can.append(serialize([0x181 + i % 4, bytes([i % 256, 0, 0, 0, random.randint(0, 3), 0, 0, 0])]))
+        poses.append(serialize([i * 10, i * 5 + random.randint(-2, 2), (i * 7) % 36000]))
+        images.append(serialize(bytes(random.getrandbits(8) for k in range(1000))))  # JPEG-like
+    return {'lidar.scan': scans, 'can.raw': can, 'app.pose2d': poses, 'camera.raw': images}
+
+
+def bench_compress(count):
+    streams = _sample_streams(count)
+    for codec in [None, 'zlib', 'lzma']:
+        compress = {} if codec is None else {name: codec for name in streams}
+        print(codec or 'no compression')
+        for name, messages in streams.items():
+            size = sum(len(msg) for msg in messages)
+            with LogWriter(prefix='bench-', buffered=True, compress=compress) as log:
+                stream_id = log.register(name)
+                start = time.perf_counter()
+                for msg in messages:
+                    log.write(stream_id, msg)
+                publish_duration = time.perf_counter() - start
+            write_duration = time.perf_counter() - start  # including the flush
+
+            start = time.perf_counter()
+            with LogReader(log.filename, only_stream_id=stream_id) as log2:
+                for record in log2:
+                    pass
+            read_duration = time.perf_counter() - start
+            file_size = os.path.getsize(log.filename)
+            os.remove(log.filename)
+            print('  {:<12} publish {:8.1f} MB/s, write {:8.1f} MB/s, read {:8.1f} MB/s,'
+                  ' size {:9d} ({:5.1f}%)'.format(
+                  name, size/publish_duration/1e6, size/write_duration/1e6,
+                  size/read_duration/1e6, file_size, 100 * file_size/size))
+
+
+class _LegacyBusHandler(BusHandler):
+    "original publish() holding the global logger lock as the reference"
+    def publish(self, channel, data):
+        with self.logger.lock:
+            stream_id = self.stream_id[channel]
+            timestamp = self.logger.write(stream_id, serialize(data))
+            for queue, input_channel in self.out[channel]:
+                queue.put((timestamp, input_channel, data))
+            for slot in self.slots.get(channel, []):
+                slot(data)
+        return timestamp
+
+
+def bench_bus(bus_class, count, size, publishers, slot_delay):
+    data = [bytes(size), list(range(size // 4))]
+    slots = {'raw': [lambda data: time.sleep(slot_delay)]} if slot_delay > 0 else {}
+    per_thread = count // publishers
+    with LogWriter(prefix='bench-', buffered=True) as log:
+        buses = []
+        for i in range(publishers):
+            receiver = Queue()
+            buses.append((bus_class(log, name='pub%d' % i, out={'raw':[(receiver, 'raw')]},
+                                    slots=slots), receiver))
+
+        def worker(bus, receiver):
+            for k in range(per_thread):
+                bus.publish('raw', data)
+                receiver.get()
+
+        workers = [Thread(target=worker, args=item) for item in buses]
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        duration = time.perf_counter() - start
+    os.remove(log.filename)
+    return per_thread * publishers, duration
+
+
+class _LegacyLogWriter(LogWriter):
+    "original write() with datetime wall clock as the reference"
+    def write(self, stream_id, data):
+        with self.lock:
+            dt = datetime.datetime.utcnow() - self.start_time
+            assert dt.days == 0, dt  # multiple days not supported yet
+            time_frac = (dt.seconds * 1000000 + dt.microseconds) & TIMESTAMP_MASK
+            if self._flusher is None:
+                if stream_id in self._codecs:
+                    data = _compress(self._codecs[stream_id], data)
+                self.f.write(_pack_record(bytearray(), time_frac, stream_id, data))
+                self.f.flush()
+            else:
+                self._pending.append((time_frac, stream_id, data))
+                self._pending_size += len(data)
+                if self._pending_size >= self.flush_size:
+                    self._wakeup.notify()
+        return dt
+
+
+def bench_clock(count, size):
+    data = bytes(size)
+    for name, writer_class in [('datetime clock', _LegacyLogWriter),
+                               ('monotonic_ns clock', LogWriter)]:
+        # buffered writer without flushing - timestamping is the main cost of write()
+        log = writer_class(prefix='bench-', buffered=True, flush_size=1 << 40)
+        start = time.perf_counter()
+        for i in range(count):
+            log.write(1, data)
+        duration = time.perf_counter() - start
+        log.close()
+        os.remove(log.filename)
+        print('{:<30} {:8.3f} us/write'.format(name, duration/count * 1e6))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark logger')
+    subparsers = parser.add_subparsers(dest='bench')
+    subparsers.required = True
+
+    write = subparsers.add_parser('write', help='compare direct and buffered LogWriter')
+    write.add_argument('--count', help='number of messages', type=int, default=100000)
+    write.add_argument('--size', help='message size in bytes', type=int, default=100)
+    write.add_argument('--threads', help='number of writing threads', type=int, default=1)
+
+    index = subparsers.add_parser('index', help='compare index builders')
+    index.add_argument('--count', help='number of records', type=int, default=1000000)
+    index.add_argument('--size', help='record size in bytes', type=int, default=20)
+
+    read = subparsers.add_parser('read', help='compare LogReader on large records')
+    read.add_argument('--sizes', help='record sizes in MB', type=float, nargs='+',
+                      default=[1, 2, 5, 10])
+    read.add_argument('--total', help='total data size in MB', type=float, default=200)
+
+    compress = subparsers.add_parser('compress', help='compare stream compression codecs')
+    compress.add_argument('--count', help='number of messages per stream', type=int, default=2000)
+
+    bus = subparsers.add_parser('bus', help='compare BusHandler.publish under contention')
+    bus.add_argument('--count', help='total number of messages', type=int, default=100000)
+    bus.add_argument('--size', help='message size in bytes', type=int, default=100)
+    bus.add_argument('--publishers', help='number of publishing threads', type=int, default=4)
+    bus.add_argument('--slot-delay', help='delay of slot callback in seconds',
+                     type=float, default=0)
+
+    clock = subparsers.add_parser('clock', help='compare per-write overhead of timestamping')
+    clock.add_argument('--count', help='number of messages', type=int, default=1000000)
+    clock.add_argument('--size', help='message size in bytes', type=int, default=100)
+
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='logbench')
+    os.environ[ENV_OSGAR_LOGS] = tmp_dir
+    try:
+        if args.bench == 'write':
+            for name, kwargs in [
+                    ('direct', {}),
+                    ('buffered', {'buffered': True}),
+                    ('buffered fsync=close', {'buffered': True, 'fsync': 'close'}),
+                    ('buffered fsync=batch', {'buffered': True, 'fsync': 'batch'}),
+                ]:
+                count, duration = bench_write(args.count, args.size,
+                                              threads=args.threads, **kwargs)
+                _report(name, count, args.size, duration)
+        elif args.bench == 'index':
+            bench_index(args.count, args.size)
+        elif args.bench == 'compress':
+            bench_compress(args.count)
+        elif args.bench == 'bus':
+            for name, bus_class in [('global lock', _LegacyBusHandler),
+                                    ('per-publisher lock', BusHandler)]:
+                count, duration = bench_bus(bus_class, args.count, args.size,
+                                            args.publishers, args.slot_delay)
+                _report(name, count, args.size, duration)
+        elif args.bench == 'clock':
+            bench_clock(args.count, args.size)
+        elif args.bench == 'read':
+            bench_read([int(size * 1e6) for size in args.sizes], int(args.total * 1e6))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: expandtab sw=4 ts=4
@@ -0,0 +1,165 @@
+"""
+  Cut, filter and merge logs - records are copied raw without deserialization
+
+  usage:
+       python -m osgar.tools.logcut big.log --start-time-sec 3600 --end-time-sec 3720 --output incident.log
+       python -m osgar.tools.logcut a.log b.log --stream lidar.scan gps.position --output merged.log
+"""
+import os
+import struct
+import heapq
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from osgar.logger import (LogIndexedReader, log_metadata, INFO_STREAM_ID, LOG_MAGIC, INDEX_FILE_EXT,
+                          _pack_record, _pack_record_v2, _MICROSECOND)
+
+WRITE_BUFFER_SIZE = 1 << 20
+REPLACED_INFO = (b"{'names'", b"{'compress'")  # info records rewritten for new stream IDs
+
+
+def _log_version(log):
+    return log.version if log.segments is None else log.readers[0].version
+
+
+def _selected_positions(log, stream_ids, first, last):
+    "indices of records of given streams (None = all) in range first..last-1"
+    if stream_ids is None:
+        return range(first, last)
+    positions = []
+    for stream_id in stream_ids:
+        records = log.index.stream_records(stream_id)
+        positions.extend(records[bisect_left(records, first):bisect_left(records, last)])
+    positions.sort()
+    return positions
+
+
+def _records(k, log, positions, offset):
+    "yield (output timestamp, log number, record index) - sort key of the merge"
+    micros = log.index.micros
+    for i in positions:
+        yield micros[i] + offset, k, i
+
+
+def cut(filenames, output, start=None, end=None, streams=None, version=None):
+    """
+      Copy records of input logs in time window start..end (timedelta
+      relative to the start of the earliest log) into new log, the records
+      of several logs are merged by time. Only given streams (names, None
+      for all) are copied, the streams are renumbered and streams of the same
+      name in several logs are merged. Note and config of the first log are
+      kept. Return number of copied records.
+    """
+    with ExitStack() as stack:
+        logs = [stack.enter_context(LogIndexedReader(filename)) for filename in filenames]
+        metadata = [log_metadata(filename) for filename in filenames]
+        base_time = min(meta.start_time for meta in metadata)
+        start_micros = 0 if start is None else start // _MICROSECOND
+        end_micros = None if end is None else end // _MICROSECOND
+        if version is None:
+            version = _log_version(logs[0])
+
+        names, codecs = [], {}  # output stream names and {output stream ID: codec}
+        log_streams = []  # per log {input stream ID: output stream ID}
+        for log in logs:
+            compressed = log._compressed_streams()
+            mapping = {INFO_STREAM_ID: INFO_STREAM_ID}
+            for stream_id, name in enumerate(log.stream_names(), start=1):
+                if streams is not None and name not in streams:
+                    continue
+                if name not in names:
+                    names.append(name)
+                mapping[stream_id] = names.index(name) + 1
+                if stream_id in compressed:
+                    codecs.setdefault(mapping[stream_id], compressed[stream_id])
+            log_streams.append(mapping)
+
+        targets = []  # per log {input stream ID: (output stream ID, prefix of raw data)}
+        sources = []
+        for k, (log, meta, mapping) in enumerate(zip(logs, metadata, log_streams)):
+            target = {}
+            for stream_id, out_id in mapping.items():
+                # uncompressed records of stream compressed in other log get codec ID 0 (stored)
+                stored = out_id in codecs and stream_id not in log.compressed
+                target[stream_id] = (out_id, b'\x00' if stored else b'')
+            targets.append(target)
+            delta = (meta.start_time - base_time) // _MICROSECOND  # start of log in common time
+            first = max(len(meta.info),  # header info records are replaced by the header of output
+                        bisect_left(log.index.micros, start_micros - delta))
+            last = len(log) if end_micros is None else bisect_left(log.index.micros, end_micros - delta)
+            stream_ids = None if streams is None else sorted(mapping)
+            positions = _selected_positions(log, stream_ids, first, last)
+            sources.append(_records(k, log, positions, delta - start_micros))
+
+        pack = _pack_record if version == 1 else _pack_record_v2
+        count = 0
+        if os.path.exists(output + INDEX_FILE_EXT):
+            os.remove(output + INDEX_FILE_EXT)  # index of the overwritten log
+        with open(output, 'wb') as f:
+            t = base_time + _MICROSECOND * start_micros
+            f.write(LOG_MAGIC[version])
+            f.write(struct.pack('HBBBBBI', t.year, t.month, t.day,
+                    t.hour, t.minute, t.second, t.microsecond))
+            buf = bytearray()
+            for data in metadata[0].info:
+                if not data.startswith(REPLACED_INFO):
+                    pack(buf, 0, INFO_STREAM_ID, data)
+            if len(names) > 0:
+                pack(buf, 0, INFO_STREAM_ID, bytes(str({'names': names}), encoding='ascii'))
+            if len(codecs) > 0:
+                pack(buf, 0, INFO_STREAM_ID, bytes(str({'compress': codecs}), encoding='ascii'))
+
+            records = sources[0] if len(sources) == 1 else heapq.merge(*sources)
+            for micros, k, i in records:
+                log = logs[k]
+                stream_id = log.index.stream[i]
+                target = targets[k].get(stream_id)
+                if target is None:
+                    continue  # stream without name
+                data = log.view(i, decompress=False)[2]
+                if stream_id == INFO_STREAM_ID:
+                    data = bytes(data)
+                    if data.startswith(REPLACED_INFO):
+                        continue
+                out_id, prefix = target
+                if prefix:
+                    data = prefix + data
+                pack(buf, micros, out_id, data)
+                count += 1
+                if len(buf) >= WRITE_BUFFER_SIZE:
+                    f.write(buf)
+                    buf = bytearray()
+            f.write(buf)
+        return count
+
+
+def main():
+    import argparse
+    from datetime import timedelta
+
+    parser = argparse.ArgumentParser(description='Cut, filter and merge logs')
+    parser.add_argument('logfile', nargs='+', help='input log(s), several logs are merged by time')
+    parser.add_argument('--output', '-o', help='filename of new log', required=True)
+    parser.add_argument('--stream', nargs='+', help='stream names to copy (default all)')
+    parser.add_argument('--start-time-sec', '-s', help='start at given time (sec from the start of the earliest log)',
+                        type=float, default=None)
+    parser.add_argument('--end-time-sec', '-e', help='stop at given time (sec from the start of the earliest log)',
+                        type=float, default=None)
+    parser.add_argument('--log-version', help='output format version (default as the first log)', type=int,
+                        choices=[1, 2], default=None)
+    args = parser.parse_args()
+
+    start, end = None, None
+    if args.start_time_sec is not None:
+        start = timedelta(seconds=args.start_time_sec)
+    if args.end_time_sec is not None:
+        end = timedelta(seconds=args.end_time_sec)
+    count = cut(args.logfile, args.output, start=start, end=end, streams=args.stream,
+                version=args.log_version)
+    print('%d records written into %s' % (count, args.output))
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: expandtab sw=4 ts=4
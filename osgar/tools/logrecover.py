@@ -0,0 +1,78 @@
+"""
+  Recover log truncated by power cut - strip the invalid tail (from the first
+  damaged record on)
+
+  usage:
+       python -m osgar.tools.logrecover broken.log --output fixed.log
+       python -m osgar.tools.logrecover broken.log --in-place
+"""
+import os
+import mmap
+
+from osgar.logger import LogIndex, INDEX_FILE_EXT, _HEADER_V2, _valid_record_v2, _file_version
+
+
+def find_valid_end(data, index=None):
+    """
+      return the end of valid data (readable by LogReader) - records are
+      checked walking forward from the end of given index (loaded from
+      sidecar file, None = from the beginning) up to the first damaged or
+      incomplete record, version 1 (without CRC) detects only an incomplete
+      record. For version 2 the last record with valid CRC is searched
+      backwards to report valid records lost behind a damaged one.
+    """
+    if index is None:
+        index = LogIndex()
+    index.update(data)
+    if _file_version(data[:4]) == 1:
+        return index.end_pos
+    pos = len(data) - _HEADER_V2.size
+    while pos > index.end_pos:
+        end = _valid_record_v2(data, pos)
+        if end is not None:
+            print('damaged record at %d, removed also valid data up to %d' % (index.end_pos, end))
+            break
+        pos -= 1
+    return index.end_pos
+
+
+def recover(filename, output=None):
+    "strip invalid tail of the log (in place if output is None), return number of removed bytes"
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            size = len(data)
+            index = LogIndex.load(filename + INDEX_FILE_EXT, data, os.fstat(f.fileno()).st_mtime_ns)
+            end = find_valid_end(data, index)
+    if output is None:
+        if end < size:
+            os.truncate(filename, end)
+            if os.path.exists(filename + INDEX_FILE_EXT):
+                os.remove(filename + INDEX_FILE_EXT)  # indexed the damaged tail
+    else:
+        with open(filename, 'rb') as src, open(output, 'wb') as dst:
+            remaining = end
+            while remaining > 0:
+                buf = src.read(min(remaining, 1 << 20))
+                dst.write(buf)
+                remaining -= len(buf)
+    return size - end
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Recover log truncated by power cut')
+    parser.add_argument('logfile', help='filename of damaged log')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--output', '-o', help='write recovered log into new file')
+    group.add_argument('--in-place', help='truncate the original file', action='store_true')
+    args = parser.parse_args()
+
+    removed = recover(args.logfile, output=args.output)
+    print('removed %d bytes of invalid tail' % removed)
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: expandtab sw=4 ts=4
@@ -0,0 +1,154 @@
+"""
+  Batch replay of log corpus - regression test of modules
+
+  usage:
+       python -m osgar.tools.regression logs/ --module all --jobs 4 --report report.json
+"""
+import os
+import sys
+import json
+import time
+import glob
+from argparse import Namespace
+from functools import partial
+from contextlib import redirect_stdout, redirect_stderr
+from io import StringIO
+
+from osgar.logger import lookup_stream_names, scan_logs
+from osgar.replay import replay_graph, run_graph
+
+CACHE_FILENAME = '.regression-cache.json'
+
+
+class MetadataCache:
+    """
+      Stream names of logs cached in JSON file, the entry is valid while
+      the log size and modification time are the same. Names of new logs are
+      looked up in the info records at the beginning of the log (without
+      indexing the whole file).
+    """
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.entries = {}
+        self.modified = False
+        if filename is not None and os.path.exists(filename):
+            with open(filename) as f:
+                self.entries = json.load(f)
+
+    def names(self, logfile):
+        stat = os.stat(logfile)
+        key = os.path.abspath(logfile)
+        entry = self.entries.get(key)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+            names = lookup_stream_names(logfile)
+            entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'names': names}
+            self.entries[key] = entry
+            self.modified = True
+        return entry['names']
+
+    def save(self):
+        if self.filename is not None and self.modified:
+            with open(self.filename, 'w') as f:
+                json.dump(self.entries, f, indent=1)
+            self.modified = False
+
+
+def replay_log(logfile, modules, config=None, names=None):
+    "replay modules of single log, return dictionary with results"
+    args = Namespace(logfile=logfile, force=False, config=config, module=modules,
+                     verbose=False, names=names)
+    result = {'log': logfile, 'error': None, 'modules': {}}
+    start = time.perf_counter()
+    output = StringIO()
+    try:
+        with redirect_stdout(output), redirect_stderr(output):
+            instances = replay_graph(args)
+            errors = run_graph(instances)
+        for name, instance in instances.items():
+            error = errors[name]
+            result['modules'][name] = {
+                    'ok': error is None,
+                    'error': None if error is None else repr(error),
+                    'max_delay': instance.bus.max_delay.total_seconds()}
+    except Exception as e:
+        result['error'] = repr(e)  # i.e. unknown module or broken log
+    result['ok'] = result['error'] is None and all(m['ok'] for m in result['modules'].values())
+    result['runtime'] = time.perf_counter() - start
+    if not result['ok']:
+        result['output'] = output.getvalue()
+    return result
+
+
+def _replay_log_job(job, modules, config):
+    logfile, names = job
+    return replay_log(logfile, modules, config=config, names=names)
+
+
+def find_logs(paths, pattern='*.log'):
+    logs = []
+    for path in paths:
+        if os.path.isdir(path):
+            logs.extend(sorted(glob.glob(os.path.join(path, '**', pattern), recursive=True)))
+        else:
+            logs.append(path)
+    return logs
+
+
+def run_regression(logs, modules, config=None, jobs=None, cache=None):
+    if cache is None:
+        cache = MetadataCache()
+    jobs_list = [(logfile, cache.names(logfile)) for logfile in logs]
+    cache.save()
+    return scan_logs(jobs_list, partial(_replay_log_job, modules=modules, config=config), jobs=jobs)
+
+
+def print_summary(results, out=sys.stdout):
+    width = max([len(os.path.basename(r['log'])) for r in results] + [3])
+    for r in results:
+        name = os.path.basename(r['log']).ljust(width)
+        if r['error'] is not None:
+            print(name, 'ERROR', r['error'], file=out)
+            continue
+        for module, m in sorted(r['modules'].items()):
+            status = 'OK    ' if m['ok'] else 'FAILED'
+            print(name, status, module.ljust(12), 'max delay %.3fs' % m['max_delay'],
+                  '' if m['ok'] else m['error'], file=out)
+        print(name, 'runtime %.2fs' % r['runtime'], file=out)
+    failed = sum(1 for r in results if not r['ok'])
+    print('\n%d logs, %d failed, total runtime %.1fs' % (
+          len(results), failed, sum(r['runtime'] for r in results)), file=out)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Replay modules over log corpus')
+    parser.add_argument('logs', nargs='+', help='log files or directories')
+    parser.add_argument('--module', nargs='+', default=['all'],
+                        help='module name(s) to replay, "all" for all but drivers and modules without inputs (default)')
+    parser.add_argument('--config', nargs='+', help='force alternative configuration file')
+    parser.add_argument('--pattern', help='filename pattern in directories', default='*.log')
+    parser.add_argument('--jobs', '-j', help='number of processes', type=int, default=None)
+    parser.add_argument('--report', help='write results into JSON file')
+    parser.add_argument('--cache', help='stream names cache file (default %s in the first directory)'
+                        % CACHE_FILENAME)
+    args = parser.parse_args()
+
+    logs = find_logs(args.logs, args.pattern)
+    cache_filename = args.cache
+    if cache_filename is None and os.path.isdir(args.logs[0]):
+        cache_filename = os.path.join(args.logs[0], CACHE_FILENAME)
+    results = run_regression(logs, args.module, config=args.config, jobs=args.jobs,
+                             cache=MetadataCache(cache_filename))
+    print_summary(results)
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(results, f, indent=2)
+    if not all(r['ok'] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: expandtab sw=4 ts=4
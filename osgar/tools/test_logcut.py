@@ -0,0 +1,100 @@
+import unittest
+import os
+from datetime import timedelta
+from unittest.mock import patch
+
+from osgar.logger import LogWriter, LogReader, LogIndexedReader, log_metadata, read_manifest
+from osgar.tools.logcut import cut
+
+
+def to_ns(seconds):
+    return int(seconds * 1000000000)
+
+
+class LogCutTest(unittest.TestCase):
+
+    def write_log(self, prefix, times, **kwargs):
+        "write records of streams 'a' (small), 'b' (large) at given times (sec)"
+        with patch('osgar.logger.monotonic_ns', return_value=0) as clock:
+            with LogWriter(prefix=prefix, note='test_logcut', **kwargs) as log:
+                log.write(0, bytes(str({'robot': {}}), encoding='ascii'))  # config
+                a = log.register('a')
+                b = log.register('b')
+                for t in times:
+                    clock.return_value = to_ns(t)
+                    log.write(a, bytes([t]) * 10)
+                    log.write(b, bytes([t]) * 100000)  # split into chunks in format 1
+        self.addCleanup(self.remove_log, log.filename)
+        return log.filename
+
+    def remove_log(self, filename):
+        segments = read_manifest(filename)
+        for path in [filename] + [s[0] for s in segments or []]:
+            for name in [path, path + '.idx']:
+                if os.path.exists(name):
+                    os.remove(name)
+
+    def output(self, filename):
+        output = filename + '.cut'
+        self.addCleanup(self.remove_log, output)
+        return output
+
+    def records(self, filename):
+        with LogReader(filename) as log:
+            return [(dt, stream_id, data) for dt, stream_id, data in log if stream_id != 0]
+
+    def test_cut(self):
+        filename = self.write_log('tmpCut', range(10))
+        output = self.output(filename)
+        count = cut([filename], output, start=timedelta(seconds=3), end=timedelta(seconds=5),
+                    streams=['b'])
+        self.assertEqual(count, 2)
+        meta = log_metadata(output)
+        self.assertEqual(meta.note, 'test_logcut')
+        self.assertEqual(meta.config, {'robot': {}})
+        self.assertEqual(meta.names, ['b'])
+        self.assertEqual(meta.start_time, log_metadata(filename).start_time + timedelta(seconds=3))
+        self.assertEqual(self.records(output), [
+                (timedelta(0), 1, bytes([3]) * 100000),
+                (timedelta(seconds=1), 1, bytes([4]) * 100000)])
+
+    def test_convert_version(self):
+        filename = self.write_log('tmpCutV1', range(3))
+        output = self.output(filename)
+        self.assertEqual(cut([filename], output, version=2), 6)
+        with open(output, 'rb') as f:
+            self.assertEqual(f.read(4), b'Pyr\x02')
+        self.assertEqual(self.records(output), self.records(filename))
+        with LogIndexedReader(output) as log:
+            self.assertEqual(log.stream_names(), ['a', 'b'])
+            self.assertEqual(len(log), 3 + 6)  # note, config, names
+
+    def test_merge(self):
+        first = self.write_log('tmpMergeA', [0, 2, 4], compress={'b': 'zlib'})
+        second = self.write_log('tmpMergeB', [1, 3], segment_size=150000)
+        self.assertEqual(len(read_manifest(second)), 2)
+        output = self.output(first)
+        self.assertEqual(cut([first, second], output, streams=['b']), 5)
+        self.assertEqual(log_metadata(output).names, ['b'])
+
+        # timestamps relative to the start of the first log
+        delta = log_metadata(second).start_time - log_metadata(first).start_time
+        expected = [(timedelta(seconds=t), 1, bytes([t]) * 100000) for t in [0, 2, 4]]
+        expected += [(timedelta(seconds=t) + delta, 1, bytes([t]) * 100000) for t in [1, 3]]
+        self.assertEqual(self.records(output), sorted(expected))
+
+    def test_overwrite_output(self):
+        filename = self.write_log('tmpCutTwice', range(3))
+        output = self.output(filename)
+        self.assertEqual(cut([filename], output, streams=['b']), 3)
+        with LogIndexedReader(output) as log:  # stores index of the first output
+            self.assertEqual(len(log), 3 + 3)
+        self.assertTrue(os.path.exists(output + '.idx'))
+        self.assertEqual(cut([filename], output, streams=['a']), 3)
+        self.assertFalse(os.path.exists(output + '.idx'))
+        with LogIndexedReader(output) as log:
+            self.assertEqual(log.stream_names(), ['a'])
+            self.assertEqual([bytes(log.view(i)[2]) for i in range(3, len(log))],
+                             [bytes([t]) * 10 for t in range(3)])
+
+# vim: expandtab sw=4 ts=4
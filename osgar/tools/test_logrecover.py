@@ -0,0 +1,68 @@
+import unittest
+import os
+from unittest.mock import patch
+
+from osgar.logger import LogWriter, LogReader, LogIndexedReader, INDEX_FILE_EXT
+from osgar.tools.logrecover import recover
+
+
+class LogRecoverTest(unittest.TestCase):
+
+    def write_log(self, prefix, version):
+        with LogWriter(prefix=prefix, note='test_recover', version=version) as log:
+            stream_id = log.register('raw')
+            for i in range(100):
+                log.write(stream_id, bytes([i]) * 1000)
+        self.addCleanup(os.remove, log.filename)
+        return log.filename
+
+    def damage(self, filename, lost, garbage):
+        size = os.path.getsize(filename) - lost
+        with open(filename, 'r+b') as f:
+            f.truncate(size)  # the end of last record is lost
+            f.seek(size)
+            f.write(b'\xAA' * garbage)
+
+    def records(self, filename):
+        with LogReader(filename, only_stream_id=1) as log:
+            return [data for __, __, data in log]
+
+    def test_recover_v2(self):
+        filename = self.write_log('tmpRecoverV2', version=2)
+        self.damage(filename, lost=500, garbage=2000)
+        output = filename + '.fixed'
+        self.addCleanup(os.remove, output)
+        self.assertEqual(recover(filename, output=output), 1000 + 2000 - 500 + 18)
+        self.assertEqual(self.records(output), [bytes([i]) * 1000 for i in range(99)])
+
+    def test_recover_v2_damaged_middle(self):
+        filename = self.write_log('tmpRecoverMiddle', version=2)
+        size = os.path.getsize(filename)
+        with open(filename, 'r+b') as f:
+            f.seek(size // 2)
+            f.write(b'\xAA' * 300)
+        with patch('builtins.print'):
+            removed = recover(filename)
+        self.assertGreater(removed, size // 2 - 1100)
+        records = self.records(filename)
+        self.assertGreater(len(records), 0)
+        self.assertEqual(records, [bytes([i]) * 1000 for i in range(len(records))])
+        self.assertEqual(os.path.getsize(filename), size - removed)
+
+    def test_recover_with_index(self):
+        filename = self.write_log('tmpRecoverIndex', version=2)
+        with LogIndexedReader(filename) as log:
+            self.assertEqual(len(log), 2 + 100)  # note, names
+        self.damage(filename, lost=0, garbage=2000)  # the index is still valid for the grown log
+        self.assertEqual(recover(filename), 2000)
+        self.assertFalse(os.path.exists(filename + INDEX_FILE_EXT))
+        self.assertEqual(self.records(filename), [bytes([i]) * 1000 for i in range(100)])
+
+    def test_recover_v1_in_place(self):
+        filename = self.write_log('tmpRecoverV1', version=1)
+        self.damage(filename, lost=500, garbage=100)  # without CRC only incomplete record is detected
+        self.assertGreater(recover(filename), 0)
+        self.assertEqual(self.records(filename), [bytes([i]) * 1000 for i in range(99)])
+        self.assertEqual(recover(filename), 0)
+
+# vim: expandtab sw=4 ts=4
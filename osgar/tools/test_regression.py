@@ -0,0 +1,43 @@
+import unittest
+import os
+import tempfile
+
+from osgar.logger import LogWriter
+from osgar.lib.serialize import serialize
+from osgar.test_replay import CONFIG
+from osgar.tools.regression import MetadataCache, run_regression
+
+
+class RegressionTest(unittest.TestCase):
+
+    def write_log(self, prefix, factor):
+        with LogWriter(prefix=prefix, note=str(['test'])) as log:
+            log.write(0, bytes(str(CONFIG), 'ascii'))
+            src, double, triple = [log.register(name) for name in ['src.raw', 'double.value', 'triple.value']]
+            for i in range(10):
+                log.write(src, serialize(i))
+                log.write(double, serialize(2 * i))
+                log.write(triple, serialize(factor * 2 * i))
+        self.addCleanup(os.remove, log.filename)
+        self.addCleanup(lambda: os.path.exists(log.filename + '.idx') and os.remove(log.filename + '.idx'))
+        return log.filename
+
+    def test_run_regression(self):
+        good, bad = self.write_log('tmpRegressionGood', 3), self.write_log('tmpRegressionBad', 4)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = MetadataCache(os.path.join(tmpdir, 'cache.json'))
+            results = run_regression([good, bad], ['all'], jobs=2, cache=cache)
+            self.assertTrue(os.path.exists(cache.filename))
+            self.assertEqual(MetadataCache(cache.filename).names(good),
+                             ['src.raw', 'double.value', 'triple.value'])
+            self.assertFalse(os.path.exists(good + '.idx'))  # names without indexing of the log
+
+        self.assertEqual([r['log'] for r in results], [good, bad])
+        self.assertTrue(results[0]['ok'])
+        self.assertEqual(sorted(results[0]['modules']), ['double', 'triple'])
+        self.assertFalse(results[1]['ok'])
+        self.assertTrue(results[1]['modules']['double']['ok'])
+        self.assertFalse(results[1]['modules']['triple']['ok'])
+        self.assertIn('AssertionError', results[1]['modules']['triple']['error'])
+
+# vim: expandtab sw=4 ts=4